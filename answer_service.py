@@ -0,0 +1,190 @@
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+
+class ServiceBusy(RuntimeError):
+    """The answer queue is full; the question should be asked again in a moment."""
+
+
+class Job:
+    """One question being answered; every session that asked it reads the same event stream."""
+
+    def __init__(self, key, run):
+        self.key = key
+        self._run = run  # () -> iterable of events, called on a worker thread
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.subscribers = 1
+        self.error = None
+        self._events = []
+        self._done = False
+        self._condition = threading.Condition()
+
+    @property
+    def started(self) -> bool:
+        return self.started_at is not None
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def _publish(self, event):
+        with self._condition:
+            self._events.append(event)
+            self._condition.notify_all()
+
+    def _finish(self, error: Exception | None = None):
+        with self._condition:
+            self.error = error
+            self.finished_at = time.monotonic()
+            self._done = True
+            self._condition.notify_all()
+
+    def events(self):
+        """Every event of the job from the start, then each new one as it is published; re-raises the job's error."""
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self._events) and not self._done:
+                    self._condition.wait()
+                batch, done, error = self._events[index:], self._done, self.error
+            index += len(batch)
+            yield from batch
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class _Call:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key: the first caller runs the function, later ones wait for its result.
+
+    Nothing is kept once the call returns (that is the result caches' job), so only calls that overlap in time share.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    def do(self, key, fn) -> tuple[object, bool]:
+        """(result, shared): shared is True when the result came from a call another thread had already started."""
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            call.finished.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.finished.set()
+        return call.result, False
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+class AnswerService:
+    """Shared queue and fixed worker pool that answers the questions of every session.
+
+    submit() returns the Job for a key: a new one queued for the next free worker, or the job already queued or
+    running for the same key (single flight). At most `max_concurrency` jobs run at once; when `max_queued` jobs
+    are waiting, new keys are refused with ServiceBusy instead of queueing without bound.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queued: int = 64, name: str = "answer"):
+        self.max_concurrency = max_concurrency
+        self.max_queued = max_queued
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> Job, queued or running
+        self._queued = 0
+        self._running = 0
+        self._latencies = deque(maxlen=1000)  # submit -> finish, seconds
+        self._waits = deque(maxlen=1000)  # submit -> start, seconds
+        self.stats = {"submitted": 0, "coalesced": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self._workers = [
+            threading.Thread(target=self._work, name=f"{name}-worker-{i}", daemon=True) for i in range(max_concurrency)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, key, run) -> Job:
+        with self._lock:
+            self.stats["submitted"] += 1
+            job = self._in_flight.get(key)
+            if job is not None:
+                job.subscribers += 1
+                self.stats["coalesced"] += 1
+                return job
+            if self._queued >= self.max_queued:
+                self.stats["rejected"] += 1
+                raise ServiceBusy(f"{self._queued} questions are already waiting; please ask again in a moment.")
+            job = self._in_flight[key] = Job(key, run)
+            self._queued += 1
+        self._queue.put(job)
+        return job
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+            job.started_at = time.monotonic()
+            error = None
+            try:
+                for event in job._run():
+                    job._publish(event)
+            except Exception as e:
+                logging.getLogger(__name__).warning("Answer job %r failed: %s", job.key, e)
+                error = e
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    if self._in_flight.get(job.key) is job:
+                        del self._in_flight[job.key]
+                    self.stats["failed" if error is not None else "completed"] += 1
+                    self._waits.append(job.started_at - job.submitted_at)
+                    self._latencies.append(time.monotonic() - job.submitted_at)
+                job._finish(error)
+
+    def shutdown(self):
+        for _ in self._workers:
+            self._queue.put(None)
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            waits = list(self._waits)
+            summary = dict(self.stats, queued=self._queued, running=self._running, workers=self.max_concurrency)
+        summary["avg_wait_ms"] = round(1000 * sum(waits) / len(waits), 1) if waits else 0.0
+        summary["p95_ms"] = round(1000 * latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 1) if latencies else 0.0
+        return summary
@@ -0,0 +1,183 @@
+"""Load benchmark of the shared answer service: throughput and latency as the number of sessions grows.
+
+Usage: python bench_answer_service.py [--sessions 1,4,16,64] [--questions-per-session N] [--workers N]
+                                      [--llm-latency-ms MS] [--query-latency-ms MS] [--llm-capacity N] [--query-capacity N]
+
+get_database_answer is loaded from newwneww.py as in bench_pipeline.py and driven by local stand-ins:
+- an LLM that answers each golden-set database question with its recorded SQL after a fixed delay and serves at
+  most --llm-capacity calls at once (the rest wait, as they would for Vertex AI quota);
+- SQLite over the seeded schema with a fixed delay per query and at most --query-capacity queries at once (BigQuery).
+Every session asks its questions back to back and all sessions start together, drawing from the golden questions
+with a skewed popularity (a few questions are asked by most people, as at 9 a.m.). Two setups are compared:
+- inline: each session runs the pipeline on its own thread, as the app did before the answer service;
+- service: sessions submit to one AnswerService (bounded workers, identical in-flight questions coalesced) and
+  run_bigquery coalesces identical in-flight SQL.
+Charts are not rendered, so the numbers are queueing, LLM and query time. Reports questions per second, p50/p95
+latency per question, and the LLM calls and query executions actually made.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+from answer_service import AnswerService, SingleFlight
+from bench_pipeline import APP_PATH, GOLDEN_SET_PATH, SCHEMA_PATH, RecordedMessage, _percentile, load_app_pipeline
+from caches import RenderedPlotCache, normalize_question
+from join_planner import JoinPlanner
+from query_backends import SQLiteBackend, seed_sqlite_from_schema
+from schema_index import SchemaIndex
+from sql_tools import SQLAliasRewriter, SQLValidator, alias_map, reserved_keywords
+
+
+class StandInLLM:
+    """Vertex AI stand-in: the recorded SQL for the question in the prompt, after `latency_seconds`."""
+
+    def __init__(self, recorded_sql: dict, latency_seconds: float, capacity: int):
+        self.recorded_sql = recorded_sql
+        self.latency_seconds = latency_seconds
+        self._capacity = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def invoke(self, prompt: str):
+        question = prompt.rsplit("User Question:", 1)[-1].strip()
+        with self._lock:
+            self.calls += 1
+        with self._capacity:
+            time.sleep(self.latency_seconds)
+        return RecordedMessage(self.recorded_sql.get(question, "Sorry, this data is not available"))
+
+
+class StandInBigQuery(SQLiteBackend):
+    """BigQuery stand-in: SQLite plus a fixed delay per query, at most `capacity` queries at once."""
+
+    def __init__(self, db_path: str, latency_seconds: float, capacity: int):
+        super().__init__(db_path)
+        self.latency_seconds = latency_seconds
+        self._capacity = threading.BoundedSemaphore(capacity)
+        self._lock = threading.Lock()
+        self.executions = 0
+
+    def run(self, sql: str):
+        with self._lock:
+            self.executions += 1
+        with self._capacity:
+            time.sleep(self.latency_seconds)
+            return super().run(sql)
+
+
+def run_sessions(app: dict, answer, llm: StandInLLM, backend: StandInBigQuery, setup: str, sessions: int,
+                 questions: list, weights: list, questions_per_session: int, workers: int) -> dict:
+    """Runs the sessions once; `answer(question)` is the pipeline call."""
+    llm.calls, backend.executions = 0, 0
+    app["sql_flight"] = SingleFlight() if setup == "service" else None
+    service = AnswerService(max_concurrency=workers, max_queued=sessions * questions_per_session) if setup == "service" else None
+    latencies, failures, lock = [], [], threading.Lock()
+    start_together = threading.Barrier(sessions + 1)
+
+    def session(index: int):
+        asked = random.Random(index).choices(questions, weights, k=questions_per_session)
+        start_together.wait()
+        for question in asked:
+            started = time.perf_counter()
+            try:
+                if service is None:
+                    answer(question)
+                else:
+                    job = service.submit(normalize_question(question), lambda question=question: [answer(question)])
+                    for _ in job.events():
+                        pass
+            except Exception as e:
+                with lock:
+                    failures.append(str(e))
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    start_together.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    if service is not None:
+        service.shutdown()
+    return {
+        "qps": len(latencies) / wall,
+        "p50_ms": 1000 * statistics.median(latencies),
+        "p95_ms": 1000 * _percentile(latencies, 95),
+        "llm_calls": llm.calls,
+        "executions": backend.executions,
+        "failures": len(failures),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="1,4,16,64", help="comma-separated session counts")
+    parser.add_argument("--questions-per-session", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=8, help="AnswerService workers (ANSWER_SERVICE_WORKERS)")
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--query-latency-ms", type=float, default=400)
+    parser.add_argument("--llm-capacity", type=int, default=8, help="LLM calls served at once")
+    parser.add_argument("--query-capacity", type=int, default=16, help="queries executed at once")
+    parser.add_argument("--rows-per-table", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(GOLDEN_SET_PATH, "r", encoding="utf-8") as f:
+        golden = yaml.safe_load(f)
+    cases = [case for case in golden["questions"] if case["path"] == "database" and case.get("llm_sql")
+             and not case.get("retry_sql") and not case.get("inject_error")]
+    questions = [case["question"] for case in cases]
+    weights = [1 / (rank + 1) for rank in range(len(questions))]  # Zipf-like: the first questions are the popular ones
+    project, dataset = golden["project_id"], golden["dataset_id"]
+    schema_index = SchemaIndex.from_yaml_file(SCHEMA_PATH)
+    validator = SQLValidator(schema_index)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        seed_sqlite_from_schema(schema_index, db_path, rows_per_table=args.rows_per_table)
+        app = load_app_pipeline(APP_PATH)
+        backend = StandInBigQuery(db_path, args.query_latency_ms / 1000, args.query_capacity)
+        llm = StandInLLM({case["question"]: case["llm_sql"] for case in cases}, args.llm_latency_ms / 1000, args.llm_capacity)
+        app.update({
+            "PROJECT_ID": project,
+            "DATASET_ID": dataset,
+            "sql_rewriter": SQLAliasRewriter(schema_index, alias_map, project, dataset, reserved_keywords),
+            "join_planner": JoinPlanner(schema_index, project, dataset),
+            "result_cache": None,  # every question reaches the backend, so coalescing is what is measured
+            "sql_candidates": None,
+            "result_compactor": None,
+            "dimension_replica": None,
+            "rollup_router": None,
+            "query_backend": backend,
+            "plot_cache": RenderedPlotCache(memory_cap_bytes=0),
+            "plot_result": lambda *args, **kwargs: None,
+        })
+
+        def answer(question):
+            return app["get_database_answer"](question, llm, schema_index.full_guide, schema_index, None, False, validator)
+
+        answer(questions[0])  # warm-up: imports, schema pruning structures
+        print(f"{len(questions)} distinct questions, {args.questions_per_session} per session; LLM {args.llm_latency_ms:.0f} ms "
+              f"(x{args.llm_capacity}), query {args.query_latency_ms:.0f} ms (x{args.query_capacity}), {args.workers} service workers\n")
+        print(f"{'sessions':>8} {'setup':<8} {'q/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'LLM calls':>10} {'queries':>8}")
+        failed = False
+        for sessions in [int(n) for n in args.sessions.split(",")]:
+            for setup in ("inline", "service"):
+                r = run_sessions(app, answer, llm, backend, setup, sessions, questions, weights, args.questions_per_session, args.workers)
+                failed = failed or r["failures"] > 0
+                print(f"{sessions:>8} {setup:<8} {r['qps']:>7.2f} {r['p50_ms']:>9.0f} {r['p95_ms']:>9.0f} "
+                      f"{r['llm_calls']:>10} {r['executions']:>8}" + (f"  {r['failures']} FAILED" if r["failures"] else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
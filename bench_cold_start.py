@@ -0,0 +1,107 @@
+"""Cold-start benchmark: what a fresh process pays before the login form renders.
+
+Usage: python bench_cold_start.py [--repeats N]
+
+Each measurement runs in a new interpreter so nothing is already imported:
+- the module-level imports of newwneww.py, executed in file order (modules missing here are skipped and listed);
+- the modules that are now imported lazily, one at a time, i.e. what the old eager imports added;
+- the schema: yaml.safe_load + SchemaIndex (the old path) vs. SchemaIndex.load from the compiled artifact.
+The app itself reports the same milestones (login_form, app_ready, documents_loaded) in the sidebar and as
+chatbot_startup_seconds on the /metrics endpoint.
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_PATH = "newwneww.py"
+SCHEMA_PATH = "Full_Procurement_Schema.yaml"
+LAZY_MODULES = ["langchain_google_vertexai", "langchain_community.vectorstores", "google.cloud.bigquery", "matplotlib.pyplot", "seaborn"]
+
+_TIMED_IMPORTS = """
+import json, sys, time
+started, skipped = time.perf_counter(), []
+for statement in json.loads(sys.argv[1]):
+    try:
+        exec(statement, {})
+    except Exception:
+        skipped.append(statement)
+print(json.dumps({"seconds": time.perf_counter() - started, "skipped": skipped}))
+"""
+
+_TIMED_SCHEMA = """
+import json, sys, time
+started = time.perf_counter()
+if sys.argv[1] == "yaml":
+    import yaml
+    from schema_index import SchemaIndex
+    with open(sys.argv[2], "r", encoding="utf-8") as f:
+        SchemaIndex(yaml.safe_load(f))
+else:
+    from schema_index import SchemaIndex
+    SchemaIndex.load(sys.argv[2], sys.argv[3])
+print(json.dumps({"seconds": time.perf_counter() - started, "skipped": []}))
+"""
+
+
+def app_import_statements() -> list[str]:
+    """The app's top-level import statements (streamlit excluded: the server has it loaded before the script runs)."""
+    with open(APP_PATH, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=APP_PATH)
+    statements = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            source = ast.unparse(node)
+            if "__future__" not in source and "streamlit" not in source:
+                statements.append(source)
+    return statements
+
+
+def run_timed(script: str, args: list, repeats: int) -> tuple[float, list]:
+    timings, skipped = [], []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", script, *args], capture_output=True, text=True, check=True)
+        result = json.loads(output.stdout.strip().splitlines()[-1])
+        timings.append(result["seconds"])
+        skipped = result["skipped"]
+    return statistics.median(timings), skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    statements = app_import_statements()
+    app_seconds, skipped = run_timed(_TIMED_IMPORTS, [json.dumps(statements)], args.repeats)
+    print(f"App imports before the login form: {1000 * app_seconds:.0f} ms ({len(statements)} statements)")
+    for statement in skipped:
+        print(f"  skipped (not installed here): {statement}")
+
+    print("\nNow imported on first use (prewarmed in the background on the login page):")
+    lazy_total = 0.0
+    for module in LAZY_MODULES:
+        seconds, missing = run_timed(_TIMED_IMPORTS, [json.dumps([f"import {module}"])], args.repeats)
+        if missing:
+            print(f"  {module:<36} not installed here")
+            continue
+        lazy_total += seconds
+        print(f"  {module:<36} {1000 * seconds:>7.0f} ms")
+    print(f"  {'total kept off the cold start':<36} {1000 * lazy_total:>7.0f} ms (installed modules only)")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        artifact_path = os.path.join(workdir, "schema_index.pickle")
+        yaml_seconds, _ = run_timed(_TIMED_SCHEMA, ["yaml", SCHEMA_PATH], args.repeats)
+        run_timed(_TIMED_SCHEMA, ["artifact", SCHEMA_PATH, artifact_path], 1)  # compiles the artifact
+        artifact_seconds, _ = run_timed(_TIMED_SCHEMA, ["artifact", SCHEMA_PATH, artifact_path], args.repeats)
+        print(f"\nSchema: yaml.safe_load + SchemaIndex {1000 * yaml_seconds:.0f} ms -> compiled artifact "
+              f"{1000 * artifact_seconds:.0f} ms ({os.path.getsize(artifact_path) / 1e6:.1f} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
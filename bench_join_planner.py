@@ -0,0 +1,164 @@
+"""Before/after benchmark for JoinPlanner.verify on the join mistakes Gemini makes with this schema.
+
+Usage: python bench_join_planner.py [--rows N]
+
+Seeds a SQLite database from the schema sample values and runs every query below through the app's rewrite
+path twice: alias rewriting + SQLValidator (before), and alias rewriting + JoinPlanner.verify + SQLValidator
+(after). A query the validator blocks costs a Gemini fix call (a retry); a query that runs but returns other rows
+than its `intended` SQL is a wrong answer, and the table bytes it read (SQLite dbstat, standing in for BigQuery
+bytes scanned) are wasted, plus the same again when the user re-asks. Every query the planner changes must
+return the intended rows; exits with status 1 if one does not. The planned JOIN ... ON clauses the prompt would
+get for each question are printed below it.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+
+import yaml
+
+from join_planner import JoinPlanner
+from query_backends import SQLiteBackend, seed_sqlite_from_schema
+from schema_index import SchemaIndex
+from sql_tools import SQLAliasRewriter, SQLValidator, alias_map, mask_quoted, reserved_keywords, _TABLE_REFERENCE_PATTERN
+
+SCHEMA_PATH = "Full_Procurement_Schema.yaml"
+GOLDEN_SET_PATH = "bench_golden_set.yaml"
+
+# (question, SQL as Gemini wrote it, SQL it meant); intended None = no declared relationship, nothing to compare
+JOIN_MISTAKES = {
+    "received_quantity_wrong_date_column": (
+        "Received quantity by year",
+        """SELECT YEAR_VALUE, SUM(QUANTITY) AS received FROM `{project}.{dataset}.DIL_PURCH_RECPTS_F`
+JOIN `{project}.{dataset}.DIL_COMMON_DT_D` ON DIL_PURCH_RECPTS_F.DW_RECEIVED_ON_DT_KEY = DIL_COMMON_DT_D.DW_RECEIVED_ON_DT_KEY
+GROUP BY YEAR_VALUE""",
+        """SELECT d.YEAR_VALUE, SUM(r.QUANTITY) FROM DIL_PURCH_RECPTS_F r
+JOIN DIL_COMMON_DT_D d ON r.DW_RECEIVED_ON_DT_KEY = d.COMMON_DT_KEY GROUP BY d.YEAR_VALUE""",
+    ),
+    "ordered_amount_wrong_date_column": (
+        "Ordered amount on PO schedule lines by month",
+        """SELECT MONTH_VALUE, SUM(ORDERED_AMOUNT) AS ordered FROM `{project}.{dataset}.DIL_PURCH_SCHEDULE_LINE_F`
+JOIN `{project}.{dataset}.DIL_COMMON_DT_D` ON DIL_PURCH_SCHEDULE_LINE_F.DW_ORDERED_ON_DT_KEY = DIL_COMMON_DT_D.DW_ORDERED_ON_DT_KEY
+GROUP BY MONTH_VALUE""",
+        """SELECT d.MONTH_VALUE, SUM(s.ORDERED_AMOUNT) FROM DIL_PURCH_SCHEDULE_LINE_F s
+JOIN DIL_COMMON_DT_D d ON s.DW_ORDERED_ON_DT_KEY = d.COMMON_DT_KEY GROUP BY d.MONTH_VALUE""",
+    ),
+    "spend_by_supplier_on_integration_id": (
+        "Total amount billed by supplier",
+        """SELECT VENDOR_NAME, SUM(AMOUNT_BILLED) AS billed FROM `{project}.{dataset}.DIL_PURCH_COST_F`
+JOIN `{project}.{dataset}.DIL_SUPPLIERS_D` ON DIL_PURCH_COST_F.INTEGRATION_ID = DIL_SUPPLIERS_D.INTEGRATION_ID
+GROUP BY VENDOR_NAME""",
+        """SELECT s.VENDOR_NAME, SUM(c.AMOUNT_BILLED) FROM DIL_PURCH_COST_F c
+JOIN DIL_SUPPLIERS_D s ON c.DW_SUPPLIER_KEY = s.DW_SUPPLIER_KEY GROUP BY s.VENDOR_NAME""",
+    ),
+    "po_lines_by_status_on_status_code": (
+        "Number of PO schedule lines per PO status",
+        """SELECT DIL_PO_STATUS_D.DESCRIPTION, COUNT(*) AS po_lines FROM `{project}.{dataset}.DIL_PURCH_SCHEDULE_LINE_F`
+JOIN `{project}.{dataset}.DIL_PO_STATUS_D` ON DIL_PURCH_SCHEDULE_LINE_F.DW_PO_STATUS_KEY = DIL_PO_STATUS_D.STATUS_CODE
+GROUP BY DIL_PO_STATUS_D.DESCRIPTION""",
+        """SELECT p.DESCRIPTION, COUNT(*) FROM DIL_PURCH_SCHEDULE_LINE_F s
+JOIN DIL_PO_STATUS_D p ON s.DW_PO_STATUS_KEY = p.DW_PO_STATUS_KEY GROUP BY p.DESCRIPTION""",
+    ),
+    "open_value_by_supplier_on_terms_id": (
+        "Open PO value by supplier",
+        """SELECT VENDOR_NAME, SUM(OPEN_PO_VALUE) AS open_value FROM `{project}.{dataset}.DIL_PURCH_SCHEDULE_LINE_F`
+JOIN `{project}.{dataset}.DIL_SUPPLIERS_D` ON DIL_PURCH_SCHEDULE_LINE_F.TERMS_ID = DIL_SUPPLIERS_D.TERMS_ID
+GROUP BY VENDOR_NAME""",
+        """SELECT s.VENDOR_NAME, SUM(l.OPEN_PO_VALUE) FROM DIL_PURCH_SCHEDULE_LINE_F l
+JOIN DIL_SUPPLIERS_D s ON l.DW_SUPPLIER_KEY = s.DW_SUPPLIER_KEY GROUP BY s.VENDOR_NAME""",
+    ),
+    "buyer_unit_price_correct": (
+        "Average unit price per buyer on requisition lines",
+        """SELECT FULL_NAME, AVG(UNIT_PRICE) AS avg_price FROM `{project}.{dataset}.DIL_PURCH_REQ_LINES_F`
+JOIN `{project}.{dataset}.DIL_BUYER_D` ON DIL_PURCH_REQ_LINES_F.DW_BUYER_KEY = DIL_BUYER_D.DW_BUYER_KEY
+GROUP BY FULL_NAME""",
+        """SELECT b.FULL_NAME, AVG(r.UNIT_PRICE) FROM DIL_PURCH_REQ_LINES_F r
+JOIN DIL_BUYER_D b ON r.DW_BUYER_KEY = b.DW_BUYER_KEY GROUP BY b.FULL_NAME""",
+    ),
+    "billed_vs_received_fact_to_fact": (
+        "Amount billed and received quantity per PO",
+        """SELECT DIL_PURCH_COST_F.PO_NUMBER, SUM(AMOUNT_BILLED) AS billed, SUM(QUANTITY) AS received
+FROM `{project}.{dataset}.DIL_PURCH_COST_F`
+JOIN `{project}.{dataset}.DIL_PURCH_RECPTS_F` ON DIL_PURCH_COST_F.PO_NUMBER = DIL_PURCH_RECPTS_F.PO_NUMBER
+GROUP BY DIL_PURCH_COST_F.PO_NUMBER""",
+        None,
+    ),
+}
+
+
+def bytes_read(conn: sqlite3.Connection, sql: str) -> int:
+    masked = mask_quoted(sql)
+    tables = {sql[m.start(2):m.end(2)].strip("`").split(".")[-1].upper() for m in _TABLE_REFERENCE_PATTERN.finditer(masked)}
+    return sum(conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", [table]).fetchone()[0] for table in tables)
+
+
+def rows_of(conn: sqlite3.Connection, sql: str) -> list:
+    return sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in conn.execute(sql))
+
+
+def attempt(conn: sqlite3.Connection, validator: SQLValidator, sql: str, intended: str | None) -> tuple[str, int]:
+    """(outcome, wasted bytes): "retry" when the validator blocks the query, else "ok" / "wrong" / "ran" (nothing to compare)."""
+    validation = validator.validate(sql)
+    if validation.errors:
+        return "retry", 0
+    if intended is None:
+        return "ran", 0
+    if rows_of(conn, SQLiteBackend.translate(validation.sql)) == rows_of(conn, intended):
+        return "ok", 0
+    return "wrong", bytes_read(conn, validation.sql)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000, help="rows per seeded table")
+    args = parser.parse_args()
+
+    with open(GOLDEN_SET_PATH, "r", encoding="utf-8") as f:
+        golden = yaml.safe_load(f)
+    project, dataset = golden["project_id"], golden["dataset_id"]
+    schema_index = SchemaIndex.from_yaml_file(SCHEMA_PATH)
+    rewriter = SQLAliasRewriter(schema_index, alias_map, project, dataset, reserved_keywords)
+    validator = SQLValidator(schema_index)
+    planner = JoinPlanner(schema_index, project, dataset)
+    print(f"Join graph: {sum(len(rels) for rels in planner.between.values())} relationships between "
+          f"{len(planner.between)} table pairs, {len(planner.dimensions_of)} fact tables\n")
+
+    mismatches = []
+    totals = {(when, outcome): 0 for when in ("before", "after") for outcome in ("retry", "wrong", "bytes")}
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "joins.sqlite3")
+        seed_sqlite_from_schema(schema_index, db_path, rows_per_table=args.rows)
+        conn = sqlite3.connect(db_path)
+        print(f"{'query':<38} {'before':>8} {'after':>8}  planner")
+        for name, (question, llm_sql, intended) in JOIN_MISTAKES.items():
+            _, tables = schema_index.prune_guide(question, 4)
+            sql = rewriter.rewrite(llm_sql.format(project=project, dataset=dataset))
+            check = planner.verify(sql)
+            outcomes = {"before": attempt(conn, validator, sql, intended), "after": attempt(conn, validator, check.sql, intended)}
+            for when, (outcome, wasted) in outcomes.items():
+                if outcome in ("retry", "wrong"):
+                    totals[(when, outcome)] += 1
+                totals[(when, "bytes")] += wasted
+            note = f"{len(check.fixes)} fixed" if check.fixes else ("undeclared join" if check.problems else "unchanged")
+            if check.fixes and outcomes["after"][0] != "ok":
+                mismatches.append(name)
+                note += "  MISMATCH"
+            print(f"{name:<38} {outcomes['before'][0]:>8} {outcomes['after'][0]:>8}  {note}")
+            for line in planner.prompt_section(question, tables).splitlines()[1:]:
+                print(f"    prompt {line}")
+        conn.close()
+
+    stats = planner.summary()
+    print(f"\nGemini fix calls (retries): {totals[('before', 'retry')]} -> {totals[('after', 'retry')]}")
+    print(f"Wrong answers: {totals[('before', 'wrong')]} -> {totals[('after', 'wrong')]}; bytes read by them "
+          f"{totals[('before', 'bytes')]:,} -> {totals[('after', 'bytes')]:,} (doubled once the user re-asks)")
+    print(f"Joins checked {stats['joins_checked']}, fixed {stats['joins_fixed']}, on undeclared relationships {stats['unplanned_joins']}")
+    if mismatches:
+        print(f"\nFAILED: {', '.join(mismatches)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
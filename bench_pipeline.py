@@ -0,0 +1,468 @@
+"""Offline end-to-end benchmark and accuracy check of the answer pipeline (no Vertex AI, no BigQuery).
+
+Usage: python bench_pipeline.py [--repeats N] [--rows-per-table N] [--llm-latency-ms MS] [--json results.json]
+
+get_database_answer, get_document_answer and the helpers they call (aliasing, auto_cast_fix, row caps,
+plotting) are loaded from newwneww.py as they are, without running the Streamlit page, and driven with:
+- RecordedLLM, a deterministic ChatVertexAI stand-in replaying the responses in bench_golden_set.yaml,
+- SQLiteBackend over a database seeded from the sample_values in Full_Procurement_Schema.yaml,
+- a BM25 retriever over the document chunks in place of Chroma.
+
+Per question it reports stage latencies (prompt build, LLM, rewrite, execute, auto-cast, plot, RAG retrieval),
+whether the first generated SQL ran, fix attempts and peak traced memory, and checks the answer against the
+golden expectation. The first pass runs under tracemalloc (memory); the timings are medians of the timed passes.
+Needs only pandas, pyarrow, matplotlib/seaborn and the stdlib sqlite3; the document questions are run when LangChain
+(its document loaders and text splitter) is installed too, and skipped otherwise.
+Exits with status 1 when any golden question fails its check.
+"""
+import __future__
+import argparse
+import ast
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+os.environ.setdefault("MPLBACKEND", "Agg")  # before the app's pyplot import
+
+import yaml
+
+from caches import RenderedPlotCache
+from doc_ingest import load_pages
+from intent_router import IntentRouter
+from join_planner import JoinPlanner
+from query_backends import SQLiteBackend, seed_sqlite_from_schema
+from report_index import BM25Index, KeyQuestionIndex, extract_report_rows
+from result_frames import ResultCompactor
+from schema_index import SchemaIndex
+from sql_tools import SQLAliasRewriter, SQLValidator, alias_map, reserved_keywords
+
+APP_PATH = "newwneww.py"
+SCHEMA_PATH = "Full_Procurement_Schema.yaml"
+GOLDEN_SET_PATH = "bench_golden_set.yaml"
+# Answer pipeline definitions taken from the app; everything else in it is Streamlit page code
+PIPELINE_DEFINITIONS = {
+    "AnswerEvent", "_emit", "_path_cancelled", "run_bigquery", "_run_uncached", "apply_table_aliases", "auto_cast_fix",
+    "_save_plot_to_bytes", "run_capped_query", "chart_frame", "plot_result", "generate_plot_from_df",
+    "_fold_others", "_render_plot_from_df", "get_document_answer", "generate_sql", "check_sql_candidate", "default_chart",
+    "present_database_result", "get_database_answer",
+}
+STAGES = ["prompt_build", "llm", "rewrite", "execute", "auto_cast", "plot", "rag"]
+
+
+# --- Loading the pipeline out of the app ---
+class FormatPromptTemplate:
+    """PromptTemplate stand-in for when LangChain is not installed; the app's templates are plain {name} f-strings."""
+
+    def __init__(self, template: str, **kwargs):
+        self.template = template
+
+    @classmethod
+    def from_template(cls, template: str):
+        return cls(template)
+
+    def format(self, **kwargs) -> str:
+        return self.template.format(**kwargs)
+
+
+def load_app_pipeline(app_path: str) -> dict:
+    """Executes the app's imports, UPPER_CASE constants and PIPELINE_DEFINITIONS into a fresh namespace.
+
+    Statements are run one at a time and any that fail (secrets, unavailable optional packages) are skipped;
+    annotations are not evaluated, so type hints on packages that are missing here do not matter. Without
+    LangChain, PromptTemplate is FormatPromptTemplate.
+    """
+    with open(app_path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=app_path)
+    # A real module object, so dataclasses and pickling can resolve definitions by module name
+    module = types.ModuleType("answer_pipeline")
+    module.__file__ = app_path
+    sys.modules[module.__name__] = module
+    namespace = module.__dict__
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            wanted = True
+        elif isinstance(node, ast.Assign):
+            wanted = all(isinstance(target, ast.Name) and target.id.isupper() for target in node.targets)
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            wanted = node.name in PIPELINE_DEFINITIONS
+        else:
+            wanted = False
+        if not wanted:
+            continue
+        code = compile(ast.Module(body=[node], type_ignores=[]), app_path, "exec",
+                       flags=__future__.annotations.compiler_flag, dont_inherit=True)
+        try:
+            exec(code, namespace)
+        except Exception:
+            pass
+    namespace.setdefault("PromptTemplate", FormatPromptTemplate)
+    missing = PIPELINE_DEFINITIONS - namespace.keys()
+    if missing:
+        raise RuntimeError(f"{app_path} no longer defines: {', '.join(sorted(missing))}")
+    return namespace
+
+
+# --- Per-question measurements ---
+class StageRecorder:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.executions = []  # True/False per query execution, in order
+
+    def reset(self):
+        self.seconds.clear()
+        self.counts.clear()
+        self.executions = []
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+
+    def timed(self, name: str, fn, count: str | None = None):
+        def wrapper(*args, **kwargs):
+            if count:
+                self.counts[count] += 1
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+@dataclass
+class RecordedMessage:
+    """AIMessage / AIMessageChunk stand-in with what the app reads of one; chunks add up like LangChain's do."""
+    content: str
+    usage_metadata: dict | None = None
+
+    def __add__(self, other: "RecordedMessage") -> "RecordedMessage":
+        usage = None
+        if self.usage_metadata or other.usage_metadata:
+            mine, theirs = self.usage_metadata or {}, other.usage_metadata or {}
+            usage = {key: mine.get(key, 0) + theirs.get(key, 0) for key in {**mine, **theirs}}
+        return RecordedMessage(self.content + other.content, usage)
+
+
+class RecordedLLM:
+    """ChatVertexAI stand-in: replays the golden set's recorded responses for the current question."""
+
+    def __init__(self, recorder: StageRecorder, latency_seconds: float = 0.0):
+        self.recorder = recorder
+        self.latency_seconds = latency_seconds
+        self.case = {}
+        self._retries = []
+
+    @staticmethod
+    def _usage(prompt: str, completion: str) -> dict:
+        # Rough ~4 characters per token, so traced spans carry token counts like Gemini's usage_metadata
+        input_tokens, output_tokens = len(prompt) // 4, len(completion) // 4
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def start(self, case: dict):
+        self.case = case
+        self._retries = list(case.get("retry_sql") or [])
+
+    def invoke(self, prompt: str):
+        kind = "retry" if "Broken SQL:" in prompt else "sql"
+        self.recorder.counts[f"llm_{kind}_calls"] += 1
+        with self.recorder.stage("llm"):
+            time.sleep(self.latency_seconds)
+            if kind == "sql":
+                content = self.case.get("llm_sql", "Sorry, this data is not available")
+            else:
+                content = self._retries.pop(0) if self._retries else self.case.get("llm_sql", "")
+        return RecordedMessage(content, self._usage(prompt, content))
+
+    def stream(self, prompt: str):
+        self.recorder.counts["llm_rag_calls"] += 1
+        with self.recorder.stage("llm"):
+            time.sleep(self.latency_seconds)
+            words = self.case.get("llm_answer", "Sorry, I don't have enough information in the documents to answer that.").split(" ")
+        for index, word in enumerate(words):
+            yield RecordedMessage(word if index == 0 else f" {word}")
+        yield RecordedMessage("", self._usage(prompt, " ".join(words)))
+
+
+class RecordingBackend(SQLiteBackend):
+    """SQLiteBackend that times every execution and can fail the next ones with recorded BigQuery errors."""
+
+    def __init__(self, db_path: str, recorder: StageRecorder):
+        super().__init__(db_path)
+        self.recorder = recorder
+        self.injected_errors = []
+
+    def run(self, sql: str):
+        with self.recorder.stage("execute"):
+            if self.injected_errors:
+                self.recorder.executions.append(False)
+                raise RuntimeError(self.injected_errors.pop(0))
+            try:
+                df = super().run(sql)
+            except Exception:
+                self.recorder.executions.append(False)
+                raise
+        self.recorder.executions.append(True)
+        return df
+
+
+class LocalRetrieverStore:
+    """Chroma stand-in for get_document_answer: BM25 over the document chunks instead of embeddings."""
+
+    def __init__(self, chunks: list[str], recorder: StageRecorder):
+        self.chunks = chunks
+        self.bm25 = BM25Index(chunks)
+        self.recorder = recorder
+        self.last_context = []
+
+    def as_retriever(self, search_kwargs: dict | None = None):
+        k = (search_kwargs or {}).get("k", 4)
+        return SimpleNamespace(invoke=lambda question: self._search(question, k))
+
+    def _search(self, question: str, k: int) -> list:
+        with self.recorder.stage("rag"):
+            scores = self.bm25.score(question)
+            best = sorted(scores, key=lambda index: -scores[index])[:k]
+            self.last_context = [self.chunks[index] for index in best]
+        return [SimpleNamespace(page_content=text) for text in self.last_context]
+
+
+def load_document_chunks(doc_paths: list) -> tuple[list[str] | None, list]:
+    """(chunk texts split like DocumentIngestor does, report rows of every document); chunks is None without LangChain."""
+    try:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter  # as DocumentIngestor; loaders need LangChain too
+    except ImportError:
+        print("WARN LangChain is not installed: documents are not loaded and document questions are skipped")
+        return None, []
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    chunks, rows = [], []
+    for doc_path in doc_paths:
+        parsed = load_pages(doc_path)
+        if parsed["error"]:
+            print(f"WARN could not load {doc_path}: {parsed['error']}")
+            continue
+        for text, _ in parsed["pages"]:
+            chunks.extend(splitter.split_text(text))
+        rows.extend(extract_report_rows(parsed["pages"], source=os.path.basename(doc_path)))
+    return chunks, rows
+
+
+# --- Checks ---
+def _normalized_rows(df) -> list:
+    def cell(value):
+        if value is None or value != value:  # None / NaN
+            return None
+        if hasattr(value, "item"):
+            value = value.item()
+        return round(value, 6) if isinstance(value, float) else value
+    return sorted((tuple(cell(v) for v in row) for row in df.itertuples(index=False)), key=repr)
+
+
+def check_answer(case: dict, result: dict, reference_backend: SQLiteBackend) -> tuple[bool, str]:
+    if case["path"] == "database":
+        df = result["dataframe"]
+        if case.get("expect_not_available"):
+            return df is None and "Sorry" in result["text"], "declined" if df is None else "returned data"
+        if df is None:
+            return False, "no result"
+        expected = reference_backend.run(case["expected_sql"])
+        if _normalized_rows(df) != _normalized_rows(expected):
+            return False, f"rows differ ({len(df)} vs {len(expected)} expected)"
+        return True, f"{len(df)} rows match"
+    if case.get("expect_key_question") and result["llm_rag_calls"]:
+        return False, "went to RAG instead of the key-question index"
+    for phrase in case.get("expected_context_contains", []):
+        if not any(phrase in chunk for chunk in result["context"]):
+            return False, f"retrieval missed '{phrase}'"
+    for phrase in case.get("expected_answer_contains", []):
+        if phrase not in result["text"]:
+            return False, f"answer lacks '{phrase}'"
+    return True, "answer matches"
+
+
+# --- Benchmark ---
+class PipelineBench:
+    def __init__(self, rows_per_table: int, llm_latency_seconds: float, workdir: str):
+        with open(GOLDEN_SET_PATH, "r", encoding="utf-8") as f:
+            golden = yaml.safe_load(f)
+        self.cases = golden["questions"]
+        self.recorder = StageRecorder()
+        self.schema_index = SchemaIndex.from_yaml_file(SCHEMA_PATH)
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        seed_sqlite_from_schema(self.schema_index, db_path, rows_per_table=rows_per_table)
+        self.backend = RecordingBackend(db_path, self.recorder)
+        self.reference_backend = SQLiteBackend(db_path)
+        self.llm = RecordedLLM(self.recorder, llm_latency_seconds)
+
+        self.app = load_app_pipeline(APP_PATH)
+        chunks, report_rows = load_document_chunks(self.app["DOCUMENT_PATHS"])
+        if chunks is None:
+            chunks, self.cases = [], [case for case in self.cases if case["path"] == "database"]
+        self.store = LocalRetrieverStore(chunks, self.recorder)
+        self.key_question_index = KeyQuestionIndex(report_rows)
+        self.router = IntentRouter(self.schema_index, chunks)
+        self.sql_validator = SQLValidator(self.schema_index)
+        self.schema_index.prune_guide = self.recorder.timed("prompt_build", self.schema_index.prune_guide)
+        self.sql_validator.validate = self.recorder.timed("rewrite", self.sql_validator.validate)
+
+        rewriter = SQLAliasRewriter(self.schema_index, alias_map, golden["project_id"], golden["dataset_id"], reserved_keywords)
+        app_prompt_template = self.app["PromptTemplate"]
+        recorder = self.recorder
+
+        class TimedPromptTemplate:
+            # get_database_answer builds and formats its prompts inline; both count as prompt build
+            @staticmethod
+            def _wrap(template):
+                return SimpleNamespace(format=recorder.timed("prompt_build", template.format))
+
+            def __new__(cls, **kwargs):
+                with recorder.stage("prompt_build"):
+                    return cls._wrap(app_prompt_template(**kwargs))
+
+            @classmethod
+            def from_template(cls, template: str):
+                with recorder.stage("prompt_build"):
+                    return cls._wrap(app_prompt_template.from_template(template))
+
+        join_planner = JoinPlanner(self.schema_index, golden["project_id"], golden["dataset_id"])
+        join_planner.verify = self.recorder.timed("rewrite", join_planner.verify)
+
+        self.app.update({
+            "PROJECT_ID": golden["project_id"],
+            "DATASET_ID": golden["dataset_id"],
+            "sql_rewriter": rewriter,
+            "join_planner": join_planner,
+            "result_cache": None,
+            "sql_flight": None,
+            "sql_candidates": None,  # the recorded answers are for the unchanged prompt
+            "result_compactor": ResultCompactor.from_schema_index(self.schema_index),
+            "dimension_replica": None,  # every query runs on the seeded SQLite database
+            "rollup_router": None,  # fact tables are read directly, as the recorded answers expect
+            "query_backend": self.backend,
+            "plot_cache": RenderedPlotCache(memory_cap_bytes=0),  # never hits: every plot is rendered and timed
+            "PromptTemplate": TimedPromptTemplate,
+        })
+        self.app["apply_table_aliases"] = self.recorder.timed("rewrite", self.app["apply_table_aliases"])
+        self.app["auto_cast_fix"] = self.recorder.timed("auto_cast", self.app["auto_cast_fix"], count="auto_cast_attempts")
+        self.app["_render_plot_from_df"] = self.recorder.timed("plot", self.app["_render_plot_from_df"])
+
+    def run_case(self, case: dict) -> dict:
+        self.recorder.reset()
+        self.llm.start(case)
+        self.backend.injected_errors = [case["inject_error"]] if case.get("inject_error") else []
+        self.store.last_context = []
+        started = time.perf_counter()
+        if case["path"] == "database":
+            text, df, _, _ = self.app["get_database_answer"](
+                case["question"], self.llm, self.schema_index.full_guide, self.schema_index, None, False, self.sql_validator)
+        else:
+            text = self.app["get_document_answer"](
+                case["question"], self.store, self.llm, key_question_index=self.key_question_index)
+            df = None
+        total = time.perf_counter() - started
+        counts = self.recorder.counts
+        return {
+            "text": text,
+            "dataframe": df,
+            "context": list(self.store.last_context),
+            "total_seconds": total,
+            "stages": {stage: self.recorder.seconds.get(stage, 0.0) for stage in STAGES},
+            "first_try_ok": bool(self.recorder.executions) and self.recorder.executions[0] and not counts["llm_retry_calls"],
+            "fix_attempts": counts["auto_cast_attempts"] + counts["llm_retry_calls"],
+            "llm_calls": counts["llm_sql_calls"] + counts["llm_retry_calls"] + counts["llm_rag_calls"],
+            "llm_rag_calls": counts["llm_rag_calls"],
+        }
+
+    def run(self, repeats: int) -> list[dict]:
+        results = []
+        for case in self.cases:
+            # Memory pass first: it also warms imports and matplotlib before the timed passes
+            tracemalloc.start()
+            first = self.run_case(case)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            timed = [self.run_case(case) for _ in range(repeats)]
+            passed, detail = check_answer(case, first, self.reference_backend)
+            record = {
+                "name": case["name"],
+                "path": case["path"],
+                "routed_to": self.router.route(case["question"]),
+                "passed": passed,
+                "detail": detail,
+                "first_try_ok": first["first_try_ok"] if case["path"] == "database" and not case.get("expect_not_available") else None,
+                "fix_attempts": first["fix_attempts"],
+                "llm_calls": first["llm_calls"],
+                "peak_kb": round(peak_bytes / 1024, 1),
+                "total_ms": round(1000 * statistics.median(r["total_seconds"] for r in timed), 2),
+                "stages_ms": {
+                    stage: round(1000 * statistics.median(r["stages"][stage] for r in timed), 3) for stage in STAGES
+                },
+            }
+            results.append(record)
+        return results
+
+
+def _percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def print_report(results: list[dict]):
+    print(f"{'question':38} {'path':9} {'routed':9} {'total ms':>9} {'1st try':>7} {'fixes':>5} {'LLM':>3} {'peak KB':>9}  result")
+    for r in results:
+        first_try = "-" if r["first_try_ok"] is None else ("yes" if r["first_try_ok"] else "no")
+        status = "ok  " if r["passed"] else "FAIL"
+        print(f"{r['name'][:38]:38} {r['path']:9} {r['routed_to']:9} {r['total_ms']:9.2f} {first_try:>7} "
+              f"{r['fix_attempts']:5d} {r['llm_calls']:3d} {r['peak_kb']:9.1f}  {status} {r['detail']}")
+
+    print(f"\n{'stage':14} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for stage in STAGES:
+        values = [r["stages_ms"][stage] for r in results if r["stages_ms"][stage] > 0]
+        if values:
+            print(f"{stage:14} {statistics.mean(values):9.3f} {_percentile(values, 50):9.3f} {_percentile(values, 95):9.3f}")
+
+    database = [r for r in results if r["path"] == "database" and r["first_try_ok"] is not None]
+    passed = sum(r["passed"] for r in results)
+    routed = sum(r["routed_to"] in (r["path"], "both") for r in results)
+    one_sided = sum(r["routed_to"] == r["path"] for r in results)
+    print(f"\nGolden set: {passed}/{len(results)} passed")
+    print(f"First-try SQL success: {sum(r['first_try_ok'] for r in database)}/{len(database)}; "
+          f"fix attempts: {sum(r['fix_attempts'] for r in results)}; LLM calls: {sum(r['llm_calls'] for r in results)}")
+    print(f"Routing: {routed}/{len(results)} kept the needed path ({one_sided} skipped the other one)")
+    try:
+        import resource
+        print(f"Max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    except ImportError:
+        pass
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeats", type=int, default=5, help="timed passes per question (median is reported)")
+    parser.add_argument("--rows-per-table", type=int, default=2000, help="rows seeded into every local table")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated latency per LLM call")
+    parser.add_argument("--json", help="also write the per-question results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bench = PipelineBench(args.rows_per_table, args.llm_latency_ms / 1000, workdir)
+        results = bench.run(max(1, args.repeats))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r["passed"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""Per-query overhead of read_gbq vs the shared-client BigQueryBackend, for a small and a large result.
+
+Usage: python bench_query_backend.py <service_account.json> <project_id> <dataset_id> [repeats]
+
+Each query runs `repeats` times through both paths (BigQuery's own result cache is disabled so every
+run is a real job); the median wall time and row count are printed.
+"""
+import statistics
+import sys
+import time
+
+from query_backends import BigQueryBackend
+
+
+def bench_queries(project_id: str, dataset_id: str) -> dict:
+    table = f"`{project_id}.{dataset_id}.DIL_PURCH_COST_F`"
+    return {
+        "small (<=100 rows)": f"SELECT * FROM {table} LIMIT 100",
+        "large (~200k rows)": f"SELECT * FROM {table} LIMIT 200000",
+    }
+
+
+def median_seconds(fn, repeats: int) -> tuple[float, int]:
+    timings, rows = [], 0
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = len(fn())
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), rows
+
+
+def main():
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(2)
+    credentials_path, project_id, dataset_id = sys.argv[1:4]
+    repeats = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+    from google.cloud import bigquery  # only this bench needs the BigQuery clients; the others run offline
+    from google.oauth2 import service_account
+    from pandas_gbq import read_gbq
+
+    credentials = service_account.Credentials.from_service_account_file(credentials_path)
+    no_cache = bigquery.QueryJobConfig(use_query_cache=False)
+    client = bigquery.Client(credentials=credentials, project=project_id, default_query_job_config=no_cache)
+    try:
+        from google.cloud import bigquery_storage
+        storage_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+    except ImportError:
+        storage_client = None
+    backend = BigQueryBackend(client, storage_client)
+
+    for label, sql in bench_queries(project_id, dataset_id).items():
+        legacy, rows = median_seconds(
+            lambda: read_gbq(sql, project_id=project_id, credentials=credentials,
+                             configuration={"query": {"useQueryCache": False}}), repeats)
+        shared, _ = median_seconds(lambda: backend.run(sql), repeats)
+        print(f"{label}: {rows:,} rows | read_gbq {legacy * 1000:8.1f} ms | shared client {shared * 1000:8.1f} ms")
+    print("Fetch paths used:", {path: entry["queries"] for path, entry in backend.summary().items()})
+
+
+if __name__ == "__main__":
+    main()
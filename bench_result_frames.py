@@ -0,0 +1,206 @@
+"""Memory and chart render time of query results as fetched versus compacted by ResultCompactor.
+
+Usage: python bench_result_frames.py [--rows-per-table N] [--row-limit N] [--renders N]
+
+SQLite is seeded from the schema YAML and every golden-set database question's expected_sql is run, together
+with detail queries that return up to --row-limit rows (the app's RESULT_ROW_CAP by default): SELECT * of each
+fact table and a fact table joined to its supplier dimension. For each result it reports the deep memory of the
+frame as fetched (object columns) and after compaction, the time compaction took, and the median time of
+drawing a chart of it (a label column against a number, and for detail results a DATE column against a number):
+the plot cache key (dataframe_fingerprint) plus _render_plot_from_df, loaded from newwneww.py as in
+bench_pipeline.py. "Before" fingerprints the whole fetched frame and renders a copy of it, as
+generate_plot_from_df did; "after" fingerprints the plotted columns of the compacted frame and renders it
+as it is. Every bar chart of a compacted frame, and one of a categorical column with unused categories, is
+also checked to draw its bars largest first, at most PLOT_MAX_BAR_CATEGORIES of them plus 'Others'.
+Exits with status 1 if a compacted frame holds different values from the fetched one or a bar chart is out of order.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+from bench_pipeline import APP_PATH, GOLDEN_SET_PATH, SCHEMA_PATH, load_app_pipeline
+from caches import RenderedPlotCache, dataframe_fingerprint
+from query_backends import SQLiteBackend, seed_sqlite_from_schema
+from result_frames import ResultCompactor, is_label_column
+from schema_index import SchemaIndex
+
+FACT_TABLES = ["DIL_PURCH_COST_F", "DIL_PURCH_RECPTS_F", "DIL_PURCH_REQ_LINES_F", "DIL_PURCH_SCHEDULE_LINE_F"]
+
+
+def detail_queries(row_limit: int) -> dict:
+    queries = {f"{table} rows": f"SELECT * FROM {table} LIMIT {row_limit}" for table in FACT_TABLES}
+    queries["receipts x suppliers"] = (
+        "SELECT r.*, s.VENDOR_NAME, s.VENDOR_TYPE_LOOKUP_CODE, s.INVOICE_CURRENCY_CODE FROM DIL_PURCH_RECPTS_F r "
+        f"LEFT JOIN DIL_SUPPLIERS_D s ON r.DW_SUPPLIER_KEY = s.DW_SUPPLIER_KEY LIMIT {row_limit}"
+    )
+    return queries
+
+
+def same_values(fetched: pd.DataFrame, compacted: pd.DataFrame) -> bool:
+    if list(fetched.columns) != list(compacted.columns) or len(fetched) != len(compacted):
+        return False
+    for index in range(fetched.shape[1]):
+        before, after = fetched.iloc[:, index], compacted.iloc[:, index]
+        if pd.api.types.is_datetime64_any_dtype(after) and not pd.api.types.is_datetime64_any_dtype(before):
+            before = pd.to_datetime(before)
+        before = [None if pd.isna(value) else value for value in before.astype(object)]
+        after = [None if pd.isna(value) else value for value in after.astype(object)]
+        for b, a in zip(before, after):
+            if isinstance(b, float) or isinstance(a, float):
+                if b is None or a is None or abs(float(b) - float(a)) > 1e-9 * max(1.0, abs(float(b))):
+                    return False
+            elif b != a:
+                return False
+    return True
+
+
+def charts(compacted: pd.DataFrame) -> list[tuple[str, str, str]]:
+    """(x, y, chart type) pairs a user would ask for: a text label against a number, and a date against a number."""
+    numbers = [c for c in compacted.columns if pd.api.types.is_float_dtype(compacted[c])]
+    numbers = numbers or [c for c in compacted.columns if pd.api.types.is_numeric_dtype(compacted[c])]
+    labels = [c for c in compacted.columns if is_label_column(compacted[c]) and compacted[c].nunique() > 1]
+    dates = [c for c in compacted.columns if pd.api.types.is_datetime64_any_dtype(compacted[c])]
+    pairs = []
+    if labels and numbers:
+        pairs.append((labels[0], numbers[0], "bar"))
+    if dates and numbers:
+        pairs.append((dates[0], numbers[0], "line"))
+    return pairs
+
+
+def drawn_bars(render, frame: pd.DataFrame, x_col: str, y_col: str) -> list[tuple[str, float]]:
+    """(label, height) of the bars _render_plot_from_df draws, left to right, read off the axes seaborn drew on."""
+    import seaborn as sns
+
+    bars, barplot = [], sns.barplot
+
+    def recording_barplot(*args, **kwargs):
+        ax = barplot(*args, **kwargs)
+        ax.figure.canvas.draw()  # tick labels are only set when drawn
+        labels = [label.get_text() for label in ax.get_xticklabels()]
+        bars.extend(zip(labels, [patch.get_height() for patch in ax.patches]))
+        return ax
+
+    sns.barplot = recording_barplot
+    try:
+        render(frame, x_col, y_col, "bar")
+    finally:
+        sns.barplot = barplot
+    return bars
+
+
+def bars_in_order(bars: list[tuple[str, float]], frame: pd.DataFrame, x_col: str, max_bars: int) -> bool:
+    """One bar per category the frame holds, largest first, capped at max_bars; 'Others' only last. Empty bars of
+    categories no row uses count as categories too, so they fail the check."""
+    named = bars[:-1] if bars and bars[-1][0] == "Others" else bars
+    labels = [label for label, _ in named]
+    heights = [height for _, height in named]
+    return (len(set(labels)) == len(labels) and len(labels) == min(frame[x_col].nunique(), max_bars)
+            and all(a >= b for a, b in zip(heights, heights[1:])))
+
+
+def unused_categories_frame() -> pd.DataFrame:
+    """A compacted-looking result whose label column is categorical with categories no row uses."""
+    vendors = [f"Vendor {index:02d}" for index in range(40)]
+    used = vendors[:10]
+    return pd.DataFrame({
+        "VENDOR_NAME": pd.Categorical([used[index % len(used)] for index in range(200)], categories=vendors),
+        "AMOUNT_BILLED": [float((index * 37) % 101) for index in range(200)],
+    })
+
+
+def median_seconds(fn, repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows-per-table", type=int, default=20000)
+    parser.add_argument("--row-limit", type=int, default=None, help="rows of the detail queries (default: the app's RESULT_ROW_CAP)")
+    parser.add_argument("--renders", type=int, default=3, help="renders per chart; the median is reported")
+    args = parser.parse_args()
+    os.environ.setdefault("MPLBACKEND", "Agg")
+
+    with open(GOLDEN_SET_PATH, "r", encoding="utf-8") as f:
+        golden = yaml.safe_load(f)
+    schema_index = SchemaIndex.from_yaml_file(SCHEMA_PATH)
+    compactor = ResultCompactor.from_schema_index(schema_index)
+    app = load_app_pipeline(APP_PATH)
+    app.update({"plot_cache": RenderedPlotCache(memory_cap_bytes=0)})
+    render = app["_render_plot_from_df"]
+    row_limit = args.row_limit or app["RESULT_ROW_CAP"]
+
+    queries = {case["question"][:40]: case["expected_sql"] for case in golden["questions"]
+               if case["path"] == "database" and case.get("expected_sql")}
+    queries.update(detail_queries(row_limit))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        seed_sqlite_from_schema(schema_index, db_path, rows_per_table=args.rows_per_table)
+        backend = SQLiteBackend(db_path)
+        render(pd.DataFrame({"x": ["a"], "y": [1.0]}), "x", "y", "bar")  # pays the matplotlib / seaborn import
+
+        print(f"{len(queries)} results; detail queries capped at {row_limit} rows\n")
+        print(f"{'result':<40} {'rows':>6} {'cols':>5} {'fetched KB':>11} {'compact KB':>11} {'saved':>6} {'compact ms':>11} "
+              f"{'chart ms before/after':>23}")
+        different, totals = [], {"before": 0, "after": 0, "render_before": 0.0, "render_after": 0.0}
+        bar_charts, out_of_order = {"unused categories": (unused_categories_frame(), "VENDOR_NAME", "AMOUNT_BILLED")}, []
+        for name, sql in queries.items():
+            fetched = backend.run(sql)
+            started = time.perf_counter()
+            compacted = compactor.compact(fetched)
+            compact_ms = 1000 * (time.perf_counter() - started)
+            if not same_values(fetched, compacted):
+                different.append(name)
+            before = int(fetched.memory_usage(deep=True).sum())
+            after = int(compacted.memory_usage(deep=True).sum())
+            totals["before"] += before
+            totals["after"] += after
+            render_before = render_after = 0.0
+            for x_col, y_col, chart_type in charts(compacted):
+                if chart_type == "bar":
+                    bar_charts[name] = (compacted, x_col, y_col)
+                def before_path():
+                    dataframe_fingerprint(fetched)
+                    render(fetched.copy(), x_col, y_col, chart_type)
+
+                def after_path():
+                    dataframe_fingerprint(compacted[[x_col, y_col]])
+                    render(compacted, x_col, y_col, chart_type)
+
+                render_before += median_seconds(before_path, args.renders)
+                render_after += median_seconds(after_path, args.renders)
+            totals["render_before"] += render_before
+            totals["render_after"] += render_after
+            renders = f"{1000 * render_before:.0f} / {1000 * render_after:.0f}" if render_before else "-"
+            print(f"{name:<40} {len(fetched):>6} {fetched.shape[1]:>5} {before / 1024:>11.1f} {after / 1024:>11.1f} "
+                  f"{100 * (1 - after / before):>5.0f}% {compact_ms:>11.1f} {renders:>23}")
+
+        for name, (frame, x_col, y_col) in bar_charts.items():
+            if not bars_in_order(drawn_bars(render, frame, x_col, y_col), frame, x_col, app["PLOT_MAX_BAR_CATEGORIES"]):
+                out_of_order.append(name)
+
+    print(f"\nTotal: {totals['before'] / 2 ** 20:.1f} MB fetched -> {totals['after'] / 2 ** 20:.1f} MB compacted "
+          f"({100 * (1 - totals['after'] / totals['before']):.0f}% saved); chart renders "
+          f"{1000 * totals['render_before']:.0f} ms -> {1000 * totals['render_after']:.0f} ms; compactor {compactor.summary()}")
+    print(f"Bar order: {len(bar_charts) - len(out_of_order)}/{len(bar_charts)} bar charts drawn largest first")
+    if different:
+        print(f"Compacted values differ from the fetched ones: {', '.join(different)}")
+    if out_of_order:
+        print(f"Bars out of order: {', '.join(out_of_order)}")
+    return 1 if different or out_of_order else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
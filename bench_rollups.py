@@ -0,0 +1,187 @@
+"""Correctness check and before/after benchmark for the KPI rollups in rollup_catalog.yaml.
+
+Usage: python bench_rollups.py [--rows N] [--repeats N]
+
+Seeds a SQLite database from the schema sample values, builds every rollup with a full refresh and runs the
+KPI queries below (plus the golden-set SQL, after alias rewriting, JOIN checking and validation as in the app)
+once against the fact table and once as rewritten by RollupRouter.
+For each routed query it reports the rows and table bytes read (SQLite dbstat, standing in for BigQuery bytes
+scanned) and the median latency before and after. It then updates some fact rows, runs an incremental refresh
+and compares every rollup with a fresh full rebuild. Exits with status 1 if any result differs, or if the app's
+result cache (its TTL settings, loaded from newwneww.py as in bench_pipeline.py) would keep a routed result
+past the next rollup refresh.
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+from bench_pipeline import APP_PATH, load_app_pipeline
+from caches import QueryResultCache
+from join_planner import JoinPlanner
+from query_backends import SQLiteBackend, seed_sqlite_from_schema
+from rollups import RollupRefresher, RollupRouter, load_rollup_catalog, register_rollup_ttls
+from schema_index import SchemaIndex
+from sql_tools import SQLAliasRewriter, SQLValidator, alias_map, mask_quoted, reserved_keywords, _TABLE_REFERENCE_PATTERN
+
+SCHEMA_PATH = "Full_Procurement_Schema.yaml"
+CATALOG_PATH = "rollup_catalog.yaml"
+GOLDEN_SET_PATH = "bench_golden_set.yaml"
+
+# Standard questions from the metrics document, as Gemini writes them (before alias rewriting and validation)
+KPI_QUERIES = {
+    "spend_by_supplier": """SELECT DIL_SUPPLIERS_D.VENDOR_NAME, SUM(DIL_PURCH_COST_F.AMOUNT_BILLED) AS total_spend
+FROM `{project}.{dataset}.DIL_PURCH_COST_F`
+JOIN `{project}.{dataset}.DIL_SUPPLIERS_D` ON DIL_PURCH_COST_F.DW_SUPPLIER_KEY = DIL_SUPPLIERS_D.DW_SUPPLIER_KEY
+GROUP BY DIL_SUPPLIERS_D.VENDOR_NAME ORDER BY total_spend DESC LIMIT 10""",
+    "spend_by_currency": """SELECT CURRENCY_CODE, SUM(AMOUNT_ORDERED) AS ordered, AVG(AMOUNT_BILLED) AS avg_billed, COUNT(*) AS lines
+FROM `{project}.{dataset}.DIL_PURCH_COST_F` GROUP BY CURRENCY_CODE""",
+    "cost_by_po_status": """SELECT DIL_PO_STATUS_D.DESCRIPTION, SUM(DIL_PURCH_COST_F.AMOUNT_ENCUMBERED) AS encumbered
+FROM `{project}.{dataset}.DIL_PURCH_COST_F`
+JOIN `{project}.{dataset}.DIL_PO_STATUS_D` ON DIL_PURCH_COST_F.DW_PO_STATUS_KEY = DIL_PO_STATUS_D.DW_PO_STATUS_KEY
+GROUP BY DIL_PO_STATUS_D.DESCRIPTION""",
+    "po_lines_by_approval": """SELECT AUTHORIZATION_STATUS, COUNT(*) AS po_lines, SUM(OPEN_PO_VALUE) AS open_value
+FROM `{project}.{dataset}.DIL_PURCH_SCHEDULE_LINE_F` GROUP BY AUTHORIZATION_STATUS ORDER BY po_lines DESC""",
+    "receipts_by_type": """SELECT TRANSACTION_TYPE, SUM(QUANTITY) AS received_quantity, SUM(AMOUNT) AS received_amount
+FROM `{project}.{dataset}.DIL_PURCH_RECPTS_F` GROUP BY TRANSACTION_TYPE""",
+    "suppliers_with_receipts": """SELECT COUNT(DISTINCT DW_SUPPLIER_KEY) AS suppliers FROM `{project}.{dataset}.DIL_PURCH_RECPTS_F`
+WHERE TRANSACTION_TYPE = 'RECEIVE'""",
+}
+
+
+def median_seconds(backend: SQLiteBackend, sql: str, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        backend.run(sql)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def tables_read(sql: str) -> set:
+    masked = mask_quoted(sql)
+    return {sql[m.start(2):m.end(2)].strip("`").split(".")[-1].upper() for m in _TABLE_REFERENCE_PATTERN.finditer(masked)}
+
+
+def scan_size(conn: sqlite3.Connection, tables: set) -> tuple[int, int]:
+    """(rows, bytes) stored in the tables a query reads; a full scan reads all of them."""
+    rows = sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+    size = sum(conn.execute("SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name = ?", [table]).fetchone()[0] for table in tables)
+    return rows, size
+
+
+def same_rows(left, right) -> bool:
+    def normalized(df):
+        return sorted(
+            tuple(None if pd.isna(v) else round(float(v), 6) if isinstance(v, (int, float)) else v for v in row)
+            for row in df.itertuples(index=False)
+        )
+    return len(left.columns) == len(right.columns) and normalized(left) == normalized(right)
+
+
+def check_incremental(refresher: RollupRefresher, backend: SQLiteBackend, db_path: str) -> list:
+    """Bumps UPDATE_DT on a slice of every source table, refreshes incrementally and compares with a full rebuild."""
+    conn = sqlite3.connect(db_path)
+    with conn:
+        for definition in refresher.definitions:
+            conn.execute(
+                f"UPDATE {definition.source_table} SET UPDATE_DT = '2100-01-01', "
+                f"{definition.measures[0]} = COALESCE({definition.measures[0]}, 0) + 1 WHERE rowid % 7 = 0"
+            )
+    conn.close()
+    report = refresher.refresh()
+    incremental = {d.name: backend.run(f"SELECT * FROM {d.name}") for d in refresher.definitions}
+    refresher.refresh(force_full=True)
+    problems = []
+    for definition in refresher.definitions:
+        mode = report[definition.name].get("mode", report[definition.name].get("error"))
+        full = backend.run(f"SELECT * FROM {definition.name}")
+        status = "ok" if same_rows(incremental[definition.name], full) else "MISMATCH"
+        print(f"  {definition.name:<32} {mode:<12} {len(full):>7} rows  {status}")
+        if status != "ok" or mode != "incremental":
+            problems.append(definition.name)
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000, help="rows per seeded table")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(GOLDEN_SET_PATH, "r", encoding="utf-8") as f:
+        golden = yaml.safe_load(f)
+    project, dataset = golden["project_id"], golden["dataset_id"]
+    schema_index = SchemaIndex.from_yaml_file(SCHEMA_PATH)
+    rewriter = SQLAliasRewriter(schema_index, alias_map, project, dataset, reserved_keywords)
+    validator = SQLValidator(schema_index)
+    join_planner = JoinPlanner(schema_index, project, dataset)  # golden cases with a wrong join key need its fix
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "rollups.sqlite3")
+        seed_sqlite_from_schema(schema_index, db_path, rows_per_table=args.rows)
+        backend = SQLiteBackend(db_path)
+        definitions, refresh = load_rollup_catalog(CATALOG_PATH, schema_index.column_types)
+        refresher = RollupRefresher(definitions, backend, schema_index.column_types, project, dataset, dataset,
+                                    os.path.join(workdir, "rollups_state.json"))
+        started = time.perf_counter()
+        refresher.refresh(force_full=True)
+        print(f"Built {len(definitions)} rollups in {time.perf_counter() - started:.2f}s ({args.rows:,} fact rows each)\n")
+        router = RollupRouter(refresher)
+        conn = sqlite3.connect(db_path)
+        app = load_app_pipeline(APP_PATH)
+        result_cache = QueryResultCache(os.path.join(workdir, "results"), 0, 0, app["RESULT_CACHE_FACT_TTL_SECONDS"],
+                                        app["RESULT_CACHE_DIMENSION_TTL_SECONDS"], app["RESULT_CACHE_TABLE_TTLS"])
+        interval_seconds = refresh.get("interval_seconds", 15 * 60)
+        register_rollup_ttls(result_cache, definitions, interval_seconds)
+        longest_ttl = 0.0
+
+        queries = {name: sql.format(project=project, dataset=dataset) for name, sql in KPI_QUERIES.items()}
+        queries.update({case["name"]: case["llm_sql"] for case in golden["questions"] if case.get("llm_sql")})
+        mismatches, speedups = [], []
+        print(f"{'query':<40} {'rollup':<30} {'rows read':>19} {'bytes read':>23} {'median ms':>19}")
+        for name, llm_sql in queries.items():
+            sql = validator.validate(join_planner.verify(rewriter.rewrite(llm_sql)).sql).sql
+            routed_sql, rollup = router.rewrite(sql)
+            if rollup is None:
+                print(f"{name:<40} {'-':<30} (reads the fact table)")
+                continue
+            before, after = backend.run(sql), backend.run(routed_sql)
+            if not same_rows(before, after):
+                mismatches.append(name)
+            ttl = result_cache.ttl_for(routed_sql)
+            longest_ttl = max(longest_ttl, ttl)
+            if ttl > interval_seconds:
+                mismatches.append(f"{name} (cached past the rollup refresh)")
+            rows_before, bytes_before = scan_size(conn, tables_read(sql))
+            rows_after, bytes_after = scan_size(conn, tables_read(routed_sql))
+            ms_before = 1000 * median_seconds(backend, sql, args.repeats)
+            ms_after = 1000 * median_seconds(backend, routed_sql, args.repeats)
+            speedups.append(ms_before / ms_after if ms_after else 0.0)
+            print(
+                f"{name:<40} {rollup:<30} {rows_before:>9,} -> {rows_after:<7,} {bytes_before:>11,} -> {bytes_after:<9,} "
+                f"{ms_before:>7.1f} -> {ms_after:<7.1f}{'' if name not in mismatches else '  MISMATCH'}"
+            )
+        conn.close()
+        stats = router.summary()
+        print(f"\n{stats['rewritten']} of {stats['checked']} queries routed to a rollup"
+              + (f", median speedup {statistics.median(speedups):.1f}x" if speedups else "")
+              + f"; cached for at most {longest_ttl:.0f}s (refresh every {interval_seconds}s)")
+
+        print("\nIncremental refresh vs. full rebuild:")
+        mismatches += check_incremental(refresher, backend, db_path)
+
+    if mismatches:
+        print(f"\nFAILED: {', '.join(mismatches)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
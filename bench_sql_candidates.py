@@ -0,0 +1,174 @@
+"""Latency of speculative SQL candidates against the sequential generate -> auto-cast -> Gemini-fix chain.
+
+Usage: python bench_sql_candidates.py [--failure-rates 0,0.2,0.4] [--trials N] [--llm-latency-ms MS]
+                                      [--query-latency-ms MS] [--dry-run-latency-ms MS]
+
+get_database_answer is loaded from newwneww.py as in bench_pipeline.py and asked every golden-set database
+question that has a recorded SQL, driven by:
+- an LLM stand-in whose latency varies around --llm-latency-ms (log-normal, as Gemini's does) and that answers each
+  SQL prompt with the recorded SQL, or with probability --failure-rate with a version of it selecting a column
+  that does not exist (independently per prompt variant); the fix prompt gets the recorded SQL;
+- SQLite over the seeded schema with --query-latency-ms per query and --dry-run-latency-ms per dry run (EXPLAIN).
+The questions of a trial are asked at the same time. Setups: sequential (SQL_CANDIDATES = 1), 2 and 3 candidates
+started together, and 3 candidates hedged (the others start only once the first fails its checks). Reports p50 /
+p95 / p99 latency per question, Gemini calls per question (the extra cost) and answers whose rows differ from the
+golden expected_sql; exits with status 1 if any answer is wrong.
+"""
+import argparse
+import contextvars
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import yaml
+
+from bench_pipeline import APP_PATH, GOLDEN_SET_PATH, SCHEMA_PATH, RecordedMessage, _normalized_rows, _percentile, load_app_pipeline
+from caches import RenderedPlotCache
+from join_planner import JoinPlanner
+from query_backends import SQLiteBackend, seed_sqlite_from_schema
+from schema_index import SchemaIndex
+from sql_candidates import SpeculativeSQL
+from sql_tools import SQLAliasRewriter, SQLValidator, alias_map, reserved_keywords
+
+# The question being answered; candidate threads run in a copy of the asking thread's context and see it too
+_asked = contextvars.ContextVar("asked")
+
+SETUPS = {  # name -> (candidates, hedge_after_seconds)
+    "sequential": (1, None),
+    "2 together": (2, 0.0),
+    "3 together": (3, 0.0),
+    "3 hedged": (3, None),
+}
+
+
+class FlakyLLM:
+    """Gemini stand-in: the recorded SQL, or (with probability `failure_rate` per question, variant and trial) a broken one."""
+
+    def __init__(self, recorded_sql: dict, latency_seconds: float):
+        self.recorded_sql = recorded_sql
+        self.latency_seconds = latency_seconds
+        self.failure_rate = 0.0
+        self.trial = 0
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def invoke(self, prompt: str):
+        question = _asked.get()
+        variant = prompt.rsplit("User Question:", 1)[0].rstrip("\n").rsplit("\n", 1)[-1]  # a variant's extra rule line
+        rng = random.Random(zlib.crc32(f"{self.trial}|{question}|{variant}|{'Broken SQL:' in prompt}".encode()))
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency_seconds * rng.lognormvariate(0, 0.35))
+        sql = self.recorded_sql[question]
+        if "Broken SQL:" not in prompt and rng.random() < self.failure_rate:
+            sql = re.sub(r"^SELECT\s+", "SELECT TOTAL_VALUE_USD, ", sql, count=1, flags=re.IGNORECASE)  # a made-up column
+        return RecordedMessage(sql)
+
+
+class StandInBigQuery(SQLiteBackend):
+    """SQLite with fixed delays for queries and dry runs."""
+
+    def __init__(self, db_path: str, latency_seconds: float, dry_run_latency_seconds: float):
+        super().__init__(db_path)
+        self.latency_seconds = latency_seconds
+        self.dry_run_latency_seconds = dry_run_latency_seconds
+
+    def run(self, sql: str):
+        time.sleep(self.latency_seconds)
+        return super().run(sql)
+
+    def dry_run_bytes(self, sql: str):
+        time.sleep(self.dry_run_latency_seconds)
+        return super().dry_run_bytes(sql)
+
+
+def run_trial(answer, cases: list) -> list[tuple[float, object]]:
+    """Asks every question at once; (seconds, DataFrame or None) per case."""
+    results = [None] * len(cases)
+
+    def ask(index: int):
+        _asked.set(cases[index]["question"])
+        started = time.perf_counter()
+        _, df, _, _ = answer(cases[index]["question"])
+        results[index] = (time.perf_counter() - started, df)
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(len(cases))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--failure-rates", default="0,0.2,0.4", help="comma-separated chance that a prompt gets broken SQL")
+    parser.add_argument("--trials", type=int, default=5)
+    parser.add_argument("--llm-latency-ms", type=float, default=800)
+    parser.add_argument("--query-latency-ms", type=float, default=300)
+    parser.add_argument("--dry-run-latency-ms", type=float, default=80)
+    parser.add_argument("--rows-per-table", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(GOLDEN_SET_PATH, "r", encoding="utf-8") as f:
+        golden = yaml.safe_load(f)
+    cases = [case for case in golden["questions"] if case["path"] == "database" and case.get("llm_sql")
+             and not case.get("retry_sql") and not case.get("inject_error") and not case.get("expect_not_available")]
+    project, dataset = golden["project_id"], golden["dataset_id"]
+    schema_index = SchemaIndex.from_yaml_file(SCHEMA_PATH)
+    validator = SQLValidator(schema_index)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, "bench.sqlite3")
+        seed_sqlite_from_schema(schema_index, db_path, rows_per_table=args.rows_per_table)
+        reference = SQLiteBackend(db_path)
+        expected = {case["question"]: _normalized_rows(reference.run(case["expected_sql"])) for case in cases}
+        app = load_app_pipeline(APP_PATH)
+        llm = FlakyLLM({case["question"]: case["llm_sql"] for case in cases}, args.llm_latency_ms / 1000)
+        app.update({
+            "PROJECT_ID": project,
+            "DATASET_ID": dataset,
+            "sql_rewriter": SQLAliasRewriter(schema_index, alias_map, project, dataset, reserved_keywords),
+            "join_planner": JoinPlanner(schema_index, project, dataset),
+            "result_cache": None,
+            "sql_flight": None,
+            "result_compactor": None,
+            "dimension_replica": None,
+            "rollup_router": None,
+            "query_backend": StandInBigQuery(db_path, args.query_latency_ms / 1000, args.dry_run_latency_ms / 1000),
+            "plot_cache": RenderedPlotCache(memory_cap_bytes=0),
+            "plot_result": lambda *args, **kwargs: None,
+        })
+
+        def answer(question):
+            return app["get_database_answer"](question, llm, schema_index.full_guide, schema_index, None, False, validator)
+
+        print(f"{len(cases)} questions x {args.trials} trials; LLM ~{args.llm_latency_ms:.0f} ms, query {args.query_latency_ms:.0f} ms, "
+              f"dry run {args.dry_run_latency_ms:.0f} ms\n")
+        print(f"{'failure':>7} {'setup':<11} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'LLM calls/q':>12} {'wrong':>6}")
+        wrong_total = 0
+        for failure_rate in [float(rate) for rate in args.failure_rates.split(",")]:
+            llm.failure_rate = failure_rate
+            for setup, (candidates, hedge) in SETUPS.items():
+                hints = app["SQL_CANDIDATE_HINTS"][:candidates]
+                app["sql_candidates"] = SpeculativeSQL(hints, hedge_after_seconds=hedge, max_workers=len(cases) * candidates) if candidates > 1 else None
+                llm.calls = 0
+                latencies, wrong = [], 0
+                for trial in range(args.trials):
+                    llm.trial = trial
+                    for case, (seconds, df) in zip(cases, run_trial(answer, cases)):
+                        latencies.append(seconds)
+                        wrong += df is None or _normalized_rows(df) != expected[case["question"]]
+                wrong_total += wrong
+                print(f"{failure_rate:>7.0%} {setup:<11} {1000 * _percentile(latencies, 50):>7.0f} {1000 * _percentile(latencies, 95):>7.0f} "
+                      f"{1000 * _percentile(latencies, 99):>7.0f} {llm.calls / len(latencies):>12.2f} {wrong:>6}")
+    return 1 if wrong_total else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Peak-load benchmark of the shared upstream limiter against a quota-limited stand-in for Vertex AI / BigQuery.
+
+Usage: python bench_upstream_limits.py [--sessions 8,32,64] [--calls-per-session N] [--quota-rps R] [--latency-ms MS]
+
+The stand-in upstream admits --quota-rps calls per second (token bucket, one second of burst) and answers the
+rest with a 429, like a Vertex AI or BigQuery quota. Light sessions make their calls one at a time; one heavy
+session makes the same number of calls from --heavy-threads threads at once (a question fanning out). Each
+session runs inside its own trace, which is the limiter's fairness key. Three setups are compared:
+- direct: every call goes straight to the upstream and a 429 reaches the user as an error;
+- client retries: every caller retries on its own with exponential backoff (what LangChain/google clients do);
+- limiter: all calls share one UpstreamLimiter, configured 50% above the quota so its adaptive rate has to
+  find the real one.
+Reports the share of calls that failed, 429s the upstream sent, and the p50/p95 latency of light and heavy sessions.
+Exits with status 1 if a call failed behind the limiter.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+
+import tracing
+from bench_pipeline import _percentile
+from upstream_limits import UpstreamLimiter, is_retryable
+
+
+class QuotaExceeded(RuntimeError):
+    code = 429
+
+
+class QuotaUpstream:
+    """Answers after `latency_seconds` while its per-second quota lasts; beyond it fails fast with a 429."""
+
+    def __init__(self, quota_rps: float, latency_seconds: float):
+        self.quota_rps = quota_rps
+        self.latency_seconds = latency_seconds
+        self._tokens = quota_rps
+        self._refilled_at = time.monotonic()
+        self._lock = threading.Lock()
+        self.rejections = 0
+
+    def call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.quota_rps, self._tokens + (now - self._refilled_at) * self.quota_rps)
+            self._refilled_at = now
+            admitted = self._tokens >= 1
+            if admitted:
+                self._tokens -= 1
+            else:
+                self.rejections += 1
+        if not admitted:
+            time.sleep(0.02)
+            raise QuotaExceeded("429 Resource exhausted: quota exceeded")
+        time.sleep(self.latency_seconds)
+        return "ok"
+
+
+def call_with_client_retries(fn, max_retries: int = 4):
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            time.sleep(random.uniform(0, min(8.0, 0.5 * 2 ** attempt)))
+
+
+def run(setup: str, sessions: int, calls_per_session: int, heavy_threads: int, quota_rps: float, latency_seconds: float) -> dict:
+    upstream = QuotaUpstream(quota_rps, latency_seconds)
+    limiter = UpstreamLimiter("bench", rate_per_second=1.5 * quota_rps, burst=max(1, int(quota_rps)),
+                              max_concurrency=64, max_wait_seconds=120) if setup == "limiter" else None
+    results = {"light": [], "heavy": []}
+    failures = []
+    lock = threading.Lock()
+
+    def one_call():
+        if setup == "direct":
+            return upstream.call()
+        if setup == "client retries":
+            return call_with_client_retries(upstream.call)
+        return limiter.call(upstream.call)
+
+    def worker(trace: tracing.Trace, kind: str, calls: int):
+        with trace.span("bench"):  # the trace id is the limiter's fairness key for this session
+            for _ in range(calls):
+                started = time.perf_counter()
+                try:
+                    one_call()
+                except Exception as e:
+                    with lock:
+                        failures.append(type(e).__name__)
+                    continue
+                with lock:
+                    results[kind].append(time.perf_counter() - started)
+
+    threads = []
+    heavy_trace = tracing.Trace("heavy session")
+    per_thread = max(1, calls_per_session // heavy_threads)
+    threads += [threading.Thread(target=worker, args=(heavy_trace, "heavy", per_thread)) for _ in range(heavy_threads)]
+    threads += [threading.Thread(target=worker, args=(tracing.Trace(f"session {i}"), "light", calls_per_session))
+                for i in range(sessions - 1)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    total = heavy_threads * per_thread + (sessions - 1) * calls_per_session
+
+    def ms(values, pct):
+        return f"{1000 * _percentile(values, pct):.0f}" if values else "-"
+
+    return {
+        "failed_pct": 100 * len(failures) / total,
+        "upstream_429": upstream.rejections,
+        "ok_per_s": (total - len(failures)) / wall,
+        "light_p50": ms(results["light"], 50), "light_p95": ms(results["light"], 95),
+        "heavy_p50": ms(results["heavy"], 50), "heavy_p95": ms(results["heavy"], 95),
+        "rate": limiter.summary()["rate"] if limiter is not None else None,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", default="8,32,64", help="comma-separated session counts (one of them heavy)")
+    parser.add_argument("--calls-per-session", type=int, default=8)
+    parser.add_argument("--heavy-threads", type=int, default=8)
+    parser.add_argument("--quota-rps", type=float, default=20.0)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    args = parser.parse_args()
+    random.seed(0)
+
+    print(f"Upstream quota {args.quota_rps:g} calls/s, {args.latency_ms:.0f} ms per call; {args.calls_per_session} calls per session\n")
+    print(f"{'sessions':>8} {'setup':<15} {'failed':>7} {'429s':>6} {'ok/s':>6} {'light p50/p95 ms':>18} {'heavy p50/p95 ms':>18}  limiter rate")
+    failed = False
+    for sessions in [int(n) for n in args.sessions.split(",")]:
+        for setup in ("direct", "client retries", "limiter"):
+            r = run(setup, sessions, args.calls_per_session, args.heavy_threads, args.quota_rps, args.latency_ms / 1000)
+            failed = failed or (setup == "limiter" and r["failed_pct"] > 0)
+            print(f"{sessions:>8} {setup:<15} {r['failed_pct']:>6.1f}% {r['upstream_429']:>6} {r['ok_per_s']:>6.1f} "
+                  f"{r['light_p50'] + ' / ' + r['light_p95']:>18} {r['heavy_p50'] + ' / ' + r['heavy_p95']:>18}"
+                  + (f"  {r['rate']:.1f}/s" if r["rate"] is not None else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,536 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import sqlparse
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # only CachedEmbeddings needs LangChain; the benches use these caches without it
+    Embeddings = object
+
+# --- Question normalization for the SQL cache ---
+# "top five suppliers by spend?" aur "Top 5 suppliers by spend" dono ka key same hona chahiye.
+NUMBER_WORDS = {
+    "one": "1", "two": "2", "three": "3", "four": "4", "five": "5", "six": "6", "seven": "7",
+    "eight": "8", "nine": "9", "ten": "10", "eleven": "11", "twelve": "12", "fifteen": "15",
+    "twenty": "20", "fifty": "50", "hundred": "100",
+}
+
+
+# Symbols change the answer ("spend > 1000" vs "spend < 1000"), so they become words instead of being dropped
+SYMBOL_WORDS = {
+    ">=": "at least", "<=": "at most", "!=": "not equal", "<>": "not equal", "=": "equal", ">": "greater than",
+    "<": "less than", "%": "percent", "+": "plus",
+}
+# Words that flip or bound a question; a similar-sounding cached question must have the same ones (and numbers)
+CONSTRAINT_WORDS = {
+    "not", "no", "without", "except", "excluding", "greater", "less", "more", "fewer", "least", "most", "equal",
+    "above", "below", "over", "under", "before", "after", "between", "percent", "plus", "top", "bottom",
+}
+_QUESTION_TOKEN_PATTERN = re.compile(r"(?<![a-z0-9.])-?\d+(?:\.\d+)?(?![a-z0-9])|[a-z0-9]+|>=|<=|!=|<>|[<>=%+]")
+_NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?")
+QUESTION_KEY_VERSION = 2  # bump when normalize_question changes
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"(?<=\d),(?=\d{3}\b)", "", question.lower())  # 1,000 -> 1000
+    words = _QUESTION_TOKEN_PATTERN.findall(question)
+    return " ".join(SYMBOL_WORDS.get(word) or NUMBER_WORDS.get(word, word) for word in words)
+
+
+def question_constraints(normalized_question: str) -> tuple:
+    """The numbers and comparison / negation words of a normalized question, in order."""
+    return tuple(word for word in normalized_question.split() if word in CONSTRAINT_WORDS or _NUMBER_PATTERN.fullmatch(word))
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SQLQueryCache:
+    """Persistent question -> final SQL cache with exact and embedding-similarity lookup.
+
+    Entries are stored in SQLite so they survive restarts and are shared by every session of the
+    process. The whole cache is dropped when the schema YAML hash changes, and the least recently
+    used entries are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, db_path: str, schema_hash: str, embed_fn=None, similarity_threshold: float = 0.95, max_entries: int = 1000):
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sql_cache ("
+            " normalized_question TEXT PRIMARY KEY, question TEXT, sql TEXT, embedding BLOB, last_used REAL)"
+        )
+        # Keys made by an older normalize_question (which dropped symbols) may mix up questions, so they go too
+        version = f"{schema_hash}:{QUESTION_KEY_VERSION}"
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'schema_hash'").fetchone()
+        if row is None or row[0] != version:
+            # Schema badla hai to purani SQL galat columns refer kar sakti hai
+            self._conn.execute("DELETE FROM sql_cache")
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_hash', ?)", (version,))
+        self._conn.commit()
+        self._load_embeddings()
+
+    def _load_embeddings(self):
+        self._keys = []
+        vectors = []
+        for key, blob in self._conn.execute("SELECT normalized_question, embedding FROM sql_cache WHERE embedding IS NOT NULL"):
+            self._keys.append(key)
+            vectors.append(np.frombuffer(blob, dtype=np.float32))
+        self._matrix = self._stack(vectors)
+
+    @staticmethod
+    def _stack(vectors: list) -> np.ndarray | None:
+        if not vectors or len({v.shape for v in vectors}) != 1:
+            return None
+        matrix = np.vstack(vectors)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def _embed(self, question: str) -> np.ndarray | None:
+        if self.embed_fn is None:
+            return None
+        try:
+            return np.asarray(self.embed_fn(question), dtype=np.float32)
+        except Exception:
+            return None  # Embedding service down: exact-match lookup still works
+
+    def _touch(self, key: str):
+        self._conn.execute("UPDATE sql_cache SET last_used = ? WHERE normalized_question = ?", (time.time(), key))
+        self._conn.commit()
+
+    def lookup(self, question: str) -> tuple[str | None, np.ndarray | None]:
+        """Returns (cached_sql or None, question embedding or None); pass the embedding back to `store` on a miss."""
+        key = normalize_question(question)
+        with self._lock:
+            self.stats["lookups"] += 1
+            row = self._conn.execute("SELECT sql FROM sql_cache WHERE normalized_question = ?", (key,)).fetchone()
+            if row:
+                self.stats["exact_hits"] += 1
+                self._touch(key)
+                return row[0], None
+
+        embedding = self._embed(question)
+        with self._lock:
+            if embedding is not None and self._matrix is not None and self._matrix.shape[1] == embedding.shape[0]:
+                norm = np.linalg.norm(embedding)
+                similarities = self._matrix @ (embedding / (norm if norm else 1))
+                best = int(np.argmax(similarities))
+                best_key = self._keys[best]
+                # "spend > 1000" and "spend < 1000" embed almost alike; their SQL must not be shared
+                if similarities[best] >= self.similarity_threshold and question_constraints(best_key) == question_constraints(key):
+                    row = self._conn.execute("SELECT sql FROM sql_cache WHERE normalized_question = ?", (best_key,)).fetchone()
+                    if row:
+                        self.stats["semantic_hits"] += 1
+                        self._touch(best_key)
+                        return row[0], embedding
+            self.stats["misses"] += 1
+        return None, embedding
+
+    def store(self, question: str, sql: str, embedding: np.ndarray | None = None):
+        key = normalize_question(question)
+        blob = embedding.astype(np.float32).tobytes() if embedding is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sql_cache (normalized_question, question, sql, embedding, last_used) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(normalized_question) DO UPDATE SET question = excluded.question, sql = excluded.sql, "
+                "embedding = COALESCE(excluded.embedding, sql_cache.embedding), last_used = excluded.last_used",
+                (key, question, sql, blob, time.time()),
+            )
+            self.stats["stores"] += 1
+            overflow = self._conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM sql_cache WHERE normalized_question IN "
+                    "(SELECT normalized_question FROM sql_cache ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.stats["evictions"] += overflow
+            self._conn.commit()
+            self._load_embeddings()
+
+    def invalidate(self, sql: str):
+        """Drops every entry that maps to this SQL, e.g. when it failed on execution after a cache hit."""
+        with self._lock:
+            self._conn.execute("DELETE FROM sql_cache WHERE sql = ?", (sql,))
+            self._conn.commit()
+            self._load_embeddings()
+
+    def hit_rate(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM sql_cache").fetchone()[0]
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        stats["hit_rate_pct"] = round(100.0 * hits / stats["lookups"], 1) if stats["lookups"] else 0.0
+        return stats
+
+
+# --- Embedding cache ---
+class CachedEmbeddings(Embeddings):
+    """Content-addressed cache in front of an Embeddings object, keyed on (model name, SHA-256 of the text).
+
+    Vectors are stored as float32 blobs in SQLite, so they are shared by every session and survive
+    restarts; beyond `max_entries` the least recently used vectors are evicted. Chroma, the retriever
+    and the SQL cache call it exactly like the wrapped object.
+    """
+
+    def __init__(self, embeddings: Embeddings, db_path: str, model_name: str | None = None, max_entries: int = 200000):
+        self.embeddings = embeddings
+        self.model_name = model_name or getattr(embeddings, "model_name", None) or type(embeddings).__name__
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "embed_seconds": 0.0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, last_used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def _key(self, text: str, kind: str) -> str:
+        # Vertex embeds queries and documents with different task types, so they get separate keys
+        return f"{self.model_name}:{kind}:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):  # SQLite bound-parameter limit
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+                self._conn.execute(f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [time.time(), *batch])
+            self._conn.commit()
+        return found
+
+    def _store(self, vectors: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in vectors.items()],
+            )
+            overflow = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+            if overflow > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self.stats["evictions"] += overflow
+            self._conn.commit()
+
+    def _embed_many(self, texts: list, embed_fn, kind: str) -> list:
+        keys = [self._key(text, kind) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(key_text for key_text in zip(keys, texts) if key_text[0] not in found))
+        if missing:
+            started = time.perf_counter()
+            vectors = embed_fn([text for _, text in missing])
+            elapsed = time.perf_counter() - started
+            computed = {key: list(vector) for (key, _), vector in zip(missing, vectors)}
+            self._store(computed)
+            found.update(computed)
+        else:
+            elapsed = 0.0
+        with self._lock:
+            self.stats["hits"] += len(texts) - len(missing)
+            self.stats["misses"] += len(missing)
+            self.stats["embed_seconds"] += elapsed
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed_many(list(texts), self.embeddings.embed_documents, "document")
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed_many([text], lambda batch: [self.embeddings.embed_query(batch[0])], "query")[0]
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate_pct"] = round(100.0 * stats["hits"] / lookups, 1) if lookups else 0.0
+        stats["avg_embed_ms"] = round(1000.0 * stats["embed_seconds"] / stats["misses"], 1) if stats["misses"] else 0.0
+        return stats
+
+
+# --- BigQuery result cache ---
+_TABLE_REFERENCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+`?([\w.-]+)`?", re.IGNORECASE)
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Uppercases keywords and function names and drops comments/whitespace so formatting-only differences share a key."""
+    statements = sqlparse.parse(sql.strip().rstrip(";"))
+    if not statements:
+        return ""
+    tokens = [t for t in statements[0].flatten() if not t.is_whitespace and t.ttype not in sqlparse.tokens.Comment]
+    parts = []
+    for i, token in enumerate(tokens):
+        value = token.value
+        next_value = tokens[i + 1].value if i + 1 < len(tokens) else ""
+        if token.is_keyword or (token.ttype in sqlparse.tokens.Name and next_value == "("):
+            value = value.upper()  # String literals and backtick-quoted names keep their case
+        parts.append(value)
+    return " ".join(parts)
+
+
+def referenced_tables(sql: str) -> set[str]:
+    return {match.split(".")[-1].upper() for match in _TABLE_REFERENCE_PATTERN.findall(sql)}
+
+
+class QueryResultCache:
+    """Two-tier cache of query results keyed on canonicalized SQL.
+
+    Tier 1 is an in-memory LRU bounded by `memory_cap_bytes`; entries pushed out of it (and every new
+    result) are written as Parquet under `directory`, bounded by `disk_cap_bytes`. An entry expires after
+    the smallest TTL of the tables it reads (`table_ttls`, else `fact_ttl` for *_F and `dimension_ttl` for others).
+    """
+
+    def __init__(self, directory: str, memory_cap_bytes: int, disk_cap_bytes: int,
+                 fact_ttl: float, dimension_ttl: float, table_ttls: dict | None = None):
+        self.directory = directory
+        self.memory_cap_bytes = memory_cap_bytes
+        self.disk_cap_bytes = disk_cap_bytes
+        self.fact_ttl = fact_ttl
+        self.dimension_ttl = dimension_ttl
+        self.table_ttls = {name.upper(): ttl for name, ttl in (table_ttls or {}).items()}
+        # Disk I/O never happens under _lock, so gets (memory hits above all) do not wait on Parquet or manifest writes
+        self._lock = threading.Lock()
+        self._manifest_file_lock = threading.Lock()  # one manifest write at a time, each of the latest manifest
+        self._memory = OrderedDict()  # key -> (DataFrame, expires_at, nbytes)
+        self._memory_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        try:
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                self._manifest = json.load(f)  # key -> {"expires_at", "nbytes", "last_used"}
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._manifest = {}
+        for name in os.listdir(directory):
+            if name.endswith(".parquet.tmp"):  # left by a process that stopped mid-write
+                self._remove_file(os.path.join(directory, name))
+
+    @staticmethod
+    def key_for(sql: str) -> str:
+        return hashlib.sha256(canonicalize_sql(sql).encode("utf-8")).hexdigest()
+
+    def table_ttl(self, table: str) -> float:
+        table = table.upper()
+        return self.table_ttls.get(table, self.fact_ttl if table.endswith("_F") else self.dimension_ttl)
+
+    def ttl_for(self, sql: str) -> float:
+        ttls = [self.table_ttl(table) for table in referenced_tables(sql)]
+        return min(ttls) if ttls else self.fact_ttl
+
+    def register_table_ttl(self, table: str, ttl: float):
+        """Sets the TTL of results that read `table`, e.g. a summary table rebuilt on its own schedule."""
+        self.table_ttls[table.upper()] = ttl
+
+    def _parquet_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def _save_manifest(self):
+        """Writes the manifest as it is now; call without holding _lock."""
+        with self._manifest_file_lock:
+            with self._lock:
+                manifest = json.dumps(self._manifest)
+            tmp_path = self._manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(manifest)
+            os.replace(tmp_path, self._manifest_path)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remember_in_memory(self, key: str, df: pd.DataFrame, expires_at: float, nbytes: int):
+        if key in self._memory:
+            self._memory_bytes -= self._memory.pop(key)[2]
+        self._memory[key] = (df, expires_at, nbytes)
+        self._memory_bytes += nbytes
+        while self._memory_bytes > self.memory_cap_bytes and self._memory:
+            _, (_, _, evicted_bytes) = self._memory.popitem(last=False)
+            self._memory_bytes -= evicted_bytes
+            self.stats["evictions"] += 1
+
+    def get(self, sql: str) -> pd.DataFrame | None:
+        key = self.key_for(sql)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                df, expires_at, nbytes = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return df.copy()
+                del self._memory[key]
+                self._memory_bytes -= nbytes
+            meta = self._manifest.get(key)
+            if meta is None:
+                self.stats["misses"] += 1
+                return None
+
+        df = None
+        if meta["expires_at"] > now:
+            try:
+                df = pd.read_parquet(self._parquet_path(key))
+            except Exception:
+                pass  # Corrupt/missing file: treat as a miss and drop it below
+        with self._lock:
+            if df is not None:
+                meta["last_used"] = now
+                self._remember_in_memory(key, df, meta["expires_at"], meta["nbytes"])
+                self.stats["disk_hits"] += 1
+                return df.copy()
+            self.stats["misses"] += 1
+            # Unless a put replaced the entry while the file was being read
+            dropped = self._manifest.get(key) is meta
+            if dropped:
+                del self._manifest[key]
+        if dropped:
+            self._remove_file(self._parquet_path(key))
+            self._save_manifest()
+        return None
+
+    def put(self, sql: str, df: pd.DataFrame):
+        key = self.key_for(sql)
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.memory_cap_bytes:
+            return  # Bahut bada result cache ko hi flush kar dega
+        expires_at = time.time() + self.ttl_for(sql)
+        copy = df.copy()
+        with self._lock:
+            self._remember_in_memory(key, copy, expires_at, nbytes)
+            self.stats["stores"] += 1
+
+        # Written to a temp file without the lock; the lock is taken only to move it into place
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".parquet.tmp")
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path, index=False)
+            size = os.path.getsize(tmp_path)
+        except Exception:
+            self._remove_file(tmp_path)
+            return  # Mixed-type object columns can fail to serialize; memory tier still holds it
+        evicted = []
+        with self._lock:
+            os.replace(tmp_path, self._parquet_path(key))
+            self._manifest[key] = {"expires_at": expires_at, "nbytes": size, "last_used": time.time()}
+            disk_bytes = sum(meta["nbytes"] for meta in self._manifest.values())
+            for old_key in sorted(self._manifest, key=lambda k: self._manifest[k]["last_used"]):
+                if disk_bytes <= self.disk_cap_bytes:
+                    break
+                disk_bytes -= self._manifest.pop(old_key)["nbytes"]
+                evicted.append(old_key)
+                self.stats["evictions"] += 1
+        for old_key in evicted:
+            self._remove_file(self._parquet_path(old_key))
+        self._save_manifest()
+
+    def record_bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_mb"] = round(self._memory_bytes / 1e6, 1)
+            stats["disk_entries"] = len(self._manifest)
+            stats["disk_mb"] = round(sum(meta["nbytes"] for meta in self._manifest.values()) / 1e6, 1)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate_pct"] = round(100.0 * (stats["memory_hits"] + stats["disk_hits"]) / lookups, 1) if lookups else 0.0
+        return stats
+
+
+# --- Rendered plot cache ---
+def dataframe_fingerprint(df: pd.DataFrame) -> str:
+    """Content hash of a DataFrame (values, index, column names and dtypes), cheap compared with rendering a plot."""
+    digest = hashlib.sha256()
+    digest.update(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode("utf-8"))
+    try:
+        digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    except TypeError:
+        digest.update(df.to_csv().encode("utf-8"))  # Unhashable cells (lists/dicts from BigQuery REPEATED fields)
+    return digest.hexdigest()
+
+
+class RenderedPlotCache:
+    """In-memory LRU of rendered PNG bytes keyed on (DataFrame fingerprint, x, y, chart type, title, profile).
+
+    Widget changes in the Dynamic Visualization section rerun the whole script, so the same chart is
+    requested again and again; only the first request pays for matplotlib.
+    """
+
+    def __init__(self, memory_cap_bytes: int):
+        self.memory_cap_bytes = memory_cap_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> PNG bytes (None when the chart could not be drawn)
+        self._bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "renders": 0, "evictions": 0, "render_seconds": 0.0, "saved_seconds": 0.0}
+        self._render_seconds = {}  # key -> how long the original render took
+
+    def get(self, key: tuple):
+        """Returns (found, png_bytes)."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["saved_seconds"] += self._render_seconds.get(key, 0.0)
+                return True, self._entries[key]
+            self.stats["misses"] += 1
+        return False, None
+
+    def put(self, key: tuple, png_bytes: bytes | None, render_seconds: float):
+        size = len(png_bytes or b"")
+        if size > self.memory_cap_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key) or b"")
+            self._entries[key] = png_bytes
+            self._render_seconds[key] = render_seconds
+            self._bytes += size
+            self.stats["renders"] += 1
+            self.stats["render_seconds"] += render_seconds
+            while self._bytes > self.memory_cap_bytes and self._entries:
+                old_key, old_bytes = self._entries.popitem(last=False)
+                self._render_seconds.pop(old_key, None)
+                self._bytes -= len(old_bytes or b"")
+                self.stats["evictions"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["memory_mb"] = round(self._bytes / 1e6, 2)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate_pct"] = round(100.0 * stats["hits"] / lookups, 1) if lookups else 0.0
+        stats["avg_render_ms"] = round(1000.0 * stats["render_seconds"] / stats["renders"], 1) if stats["renders"] else 0.0
+        return stats
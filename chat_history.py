@@ -0,0 +1,155 @@
+import os
+import shutil
+import threading
+import time
+import weakref
+from io import BytesIO
+
+import pandas as pd
+
+# Every live session's store, so the sidebar can show process-wide resident size
+_live_stores = weakref.WeakSet()
+_live_stores_lock = threading.Lock()
+
+
+def _payload_bytes(message: dict) -> int:
+    size = 0
+    df = message.get("dataframe_display")
+    if isinstance(df, pd.DataFrame):
+        size += int(df.memory_usage(deep=True).sum())
+    plot = message.get("plot_data_bytes")
+    if plot is not None:
+        size += plot.getbuffer().nbytes if isinstance(plot, BytesIO) else len(plot)
+    return size
+
+
+def sweep_stale_sessions(root: str, max_age_seconds: float) -> int:
+    """Deletes spill directories of sessions that have not written anything for `max_age_seconds`."""
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    cutoff = time.time() - max_age_seconds
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def total_resident_bytes() -> tuple[int, int]:
+    """(resident payload bytes across all live sessions, number of live sessions)."""
+    with _live_stores_lock:
+        stores = list(_live_stores)
+    return sum(store.resident_bytes for store in stores), len(stores)
+
+
+class ChatHistoryStore:
+    """Chat history for one session that keeps only recent DataFrame/plot payloads in RAM.
+
+    Messages are plain dicts (role, content, dataframe_display, plot_data_bytes, query_display).
+    Once more than `resident_turns` assistant turns hold payloads, or they exceed `memory_budget_bytes`,
+    the oldest payloads are written under `directory` (DataFrame as Parquet, plot as PNG) and the
+    dict keeps only the file paths. `dataframe()` / `plot_bytes()` read them back when history is drawn.
+    The newest turn always stays resident.
+    """
+
+    def __init__(self, directory: str, resident_turns: int = 5, memory_budget_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.resident_turns = resident_turns
+        self.memory_budget_bytes = memory_budget_bytes
+        self._messages = []
+        self._resident = []  # indexes of assistant messages whose payloads are in RAM, oldest first
+        self.resident_bytes = 0
+        self.stats = {"spilled_turns": 0, "spilled_bytes": 0, "disk_reads": 0, "spill_failures": 0}
+        with _live_stores_lock:
+            _live_stores.add(self)
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def append(self, message: dict):
+        self._messages.append(message)
+        size = _payload_bytes(message)
+        if size:
+            message["_payload_bytes"] = size
+            self._resident.append(len(self._messages) - 1)
+            self.resident_bytes += size
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        while len(self._resident) > 1 and (
+            len(self._resident) > self.resident_turns or self.resident_bytes > self.memory_budget_bytes
+        ):
+            self._spill(self._resident.pop(0))
+
+    def _spill(self, index: int):
+        message = self._messages[index]
+        os.makedirs(self.directory, exist_ok=True)
+        df = message.get("dataframe_display")
+        if isinstance(df, pd.DataFrame):
+            path = os.path.join(self.directory, f"turn_{index}.parquet")
+            try:
+                df.to_parquet(path, index=False)
+                message["dataframe_path"] = path
+            except Exception:
+                # Mixed-type object columns can fail to serialize; this history copy is only a convenience
+                self.stats["spill_failures"] += 1
+            message["dataframe_display"] = None
+        plot = message.get("plot_data_bytes")
+        if plot is not None:
+            path = os.path.join(self.directory, f"turn_{index}.png")
+            with open(path, "wb") as f:
+                f.write(plot.getvalue() if isinstance(plot, BytesIO) else plot)
+            message["plot_path"] = path
+            message["plot_data_bytes"] = None
+        size = message.pop("_payload_bytes", 0)
+        self.resident_bytes -= size
+        self.stats["spilled_turns"] += 1
+        self.stats["spilled_bytes"] += size
+
+    def dataframe(self, message: dict) -> pd.DataFrame | None:
+        if message.get("dataframe_display") is not None:
+            return message["dataframe_display"]
+        path = message.get("dataframe_path")
+        if not path:
+            return None
+        try:
+            self.stats["disk_reads"] += 1
+            return pd.read_parquet(path)
+        except Exception:
+            return None
+
+    def plot_bytes(self, message: dict) -> BytesIO | None:
+        plot = message.get("plot_data_bytes")
+        if plot is not None:
+            return plot
+        path = message.get("plot_path")
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as f:
+                self.stats["disk_reads"] += 1
+                return BytesIO(f.read())
+        except FileNotFoundError:
+            return None
+
+    def clear(self):
+        self._messages = []
+        self._resident = []
+        self.resident_bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def summary(self) -> dict:
+        stats = dict(self.stats)
+        stats["turns"] = len(self._messages)
+        stats["resident_turns"] = len(self._resident)
+        stats["resident_mb"] = round(self.resident_bytes / 1e6, 2)
+        stats["budget_mb"] = round(self.memory_budget_bytes / 1e6, 1)
+        return stats
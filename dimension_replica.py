@@ -0,0 +1,161 @@
+import re
+import threading
+import time
+
+import pandas as pd
+import pyarrow as pa
+
+import tracing
+from caches import referenced_tables
+from query_backends import QueryBackend
+
+# Same bridging as SQLiteBackend.translate, in DuckDB's dialect
+_QUALIFIED_TABLE_PATTERN = re.compile(r"`[\w-]+\.[\w-]+\.(\w+)`|\b[\w-]+\.[\w-]+\.(\w+)\b(?=\s)")
+_DUCKDB_CAST_TYPES = {"STRING": "VARCHAR", "INT64": "BIGINT", "FLOAT64": "DOUBLE", "BOOL": "BOOLEAN"}
+_CAST_TYPE_PATTERN = re.compile(r"\bAS\s+(STRING|INT64|FLOAT64|BOOL)\s*\)", re.IGNORECASE)
+_SAFE_CAST_PATTERN = re.compile(r"\bSAFE_CAST\s*\(", re.IGNORECASE)
+_WATERMARK_TABLE = "_replica_sync"
+
+
+class DimensionReplica(QueryBackend):
+    """Local DuckDB copy of small dimension tables, for queries that read nothing else.
+
+    `sync()` copies each table from `source` (the BigQuery backend) with CREATE OR REPLACE, so readers
+    see either the old or the new copy, and stamps its watermark (sync time, kept in the DuckDB file so
+    it survives restarts). `covers(sql)` is true only when every table the query reads is replicated and
+    was synced within `max_staleness_seconds`; everything else, and any query that fails here, goes to BigQuery.
+    """
+
+    name = "duckdb_replica"
+
+    def __init__(self, db_path: str, source: QueryBackend, project_id: str, dataset_id: str, tables: list[str],
+                 max_rows: int = 500000, max_staleness_seconds: float = 24 * 60 * 60):
+        super().__init__()
+        import duckdb  # optional: without it the app simply has no replica
+
+        self.source = source
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.tables = [table.upper() for table in tables]
+        self.max_rows = max_rows
+        self.max_staleness_seconds = max_staleness_seconds
+        self._conn = duckdb.connect(db_path)
+        self._conn.execute("CREATE MACRO IF NOT EXISTS SAFE_DIVIDE(a, b) AS CASE WHEN b = 0 THEN NULL ELSE a / b END")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {_WATERMARK_TABLE} (table_name VARCHAR PRIMARY KEY, synced_at DOUBLE, row_count BIGINT)")
+        self._local = threading.local()  # one cursor per thread; cursors share the database
+        self._sync_lock = threading.Lock()
+        self.watermarks = {
+            table: (synced_at, row_count)
+            for table, synced_at, row_count in self._conn.execute(f"SELECT * FROM {_WATERMARK_TABLE}").fetchall()
+            if table in self.tables
+        }
+        self.skipped = {}  # table -> reason it is not replicated (too large, sync error)
+        self.counters = {"served": 0, "fallbacks": 0, "syncs": 0}
+        self._stop = threading.Event()
+
+    def _cursor(self):
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._conn.cursor()
+            self._local.cursor = cursor
+        return cursor
+
+    # --- Sync ---
+    def sync(self, tables: list[str] | None = None) -> dict:
+        """Copies the tables from the source; returns {table: rows copied or the reason it was skipped}."""
+        report = {}
+        with self._sync_lock:
+            cursor = self._conn.cursor()
+            for table in tables or self.tables:
+                synced_at = time.time()
+                try:
+                    df = self.source.run(f"SELECT * FROM `{self.project_id}.{self.dataset_id}.{table}` LIMIT {self.max_rows + 1}")
+                    if len(df) > self.max_rows:
+                        # Not small enough to be worth keeping locally; drop any earlier copy so it is never served
+                        cursor.execute(f'DROP TABLE IF EXISTS "{table}"')
+                        cursor.execute(f"DELETE FROM {_WATERMARK_TABLE} WHERE table_name = ?", [table])
+                        with self._lock:
+                            self.watermarks.pop(table, None)
+                        self.skipped[table] = f"more than {self.max_rows:,} rows"
+                        report[table] = self.skipped[table]
+                        continue
+                    # Through Arrow, so db-dtypes DATE/TIME columns land as DuckDB DATE/TIME
+                    cursor.register("_incoming", pa.Table.from_pandas(df, preserve_index=False))
+                    try:
+                        cursor.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM _incoming')
+                    finally:
+                        cursor.unregister("_incoming")
+                    cursor.execute(f"INSERT OR REPLACE INTO {_WATERMARK_TABLE} VALUES (?, ?, ?)", [table, synced_at, len(df)])
+                except Exception as e:
+                    # The previous copy (if any) keeps serving until its watermark goes stale
+                    self.skipped[table] = f"sync failed: {e}"[:200]
+                    report[table] = self.skipped[table]
+                    continue
+                with self._lock:
+                    self.watermarks[table] = (synced_at, len(df))
+                self.skipped.pop(table, None)
+                report[table] = len(df)
+            with self._lock:
+                self.counters["syncs"] += 1
+        return report
+
+    def start(self, interval_seconds: float) -> threading.Thread:
+        """Runs sync() in a daemon thread now and then every `interval_seconds`. Until the first pass
+        finishes, tables whose persisted watermark is still fresh are served from the copy in the file."""
+        def _loop():
+            while not self._stop.is_set():
+                self.sync()
+                self._stop.wait(interval_seconds)
+
+        thread = threading.Thread(target=_loop, name="dimension-replica-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    # --- Routing ---
+    def staleness(self) -> dict:
+        """{table: seconds since its last successful sync} for the replicated tables."""
+        now = time.time()
+        with self._lock:
+            return {table: now - synced_at for table, (synced_at, _) in self.watermarks.items()}
+
+    def covers(self, sql: str) -> bool:
+        tables = referenced_tables(sql)
+        if not tables:
+            return False
+        staleness = self.staleness()
+        return all(table in staleness and staleness[table] <= self.max_staleness_seconds for table in tables)
+
+    @staticmethod
+    def translate(sql: str) -> str:
+        sql = _QUALIFIED_TABLE_PATTERN.sub(lambda m: m.group(1) or m.group(2), sql)
+        sql = _SAFE_CAST_PATTERN.sub("TRY_CAST(", sql)
+        return _CAST_TYPE_PATTERN.sub(lambda m: f"AS {_DUCKDB_CAST_TYPES[m.group(1).upper()]})", sql)
+
+    def run(self, sql: str) -> pd.DataFrame:
+        started = time.perf_counter()
+        df = self._cursor().execute(self.translate(sql)).df()
+        self._record("local", len(df), time.perf_counter() - started)
+        with self._lock:
+            self.counters["served"] += 1
+        staleness = self.staleness()
+        oldest = max((staleness.get(table, 0.0) for table in referenced_tables(sql)), default=0.0)
+        tracing.annotate(fetch_path=self.name, replica_staleness_s=round(oldest, 1))
+        return df
+
+    def record_fallback(self):
+        with self._lock:
+            self.counters["fallbacks"] += 1
+
+    def summary(self) -> dict:
+        stats = super().summary().get("local", {})
+        with self._lock:
+            stats.update(self.counters)
+        staleness = self.staleness()
+        stats["tables"] = len(staleness)
+        stats["fresh_tables"] = sum(1 for seconds in staleness.values() if seconds <= self.max_staleness_seconds)
+        stats["skipped_tables"] = len(self.skipped)
+        stats["max_staleness_minutes"] = round(max(staleness.values()) / 60, 1) if staleness else None
+        return stats
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+from report_index import KeyQuestionIndex, ReportRow, extract_report_rows
+
+MANIFEST_NAME = "ingest_manifest.json"
+MANIFEST_VERSION = 1
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def load_pages(doc_path: str) -> dict:
+    """Parses one document into pages. Runs in a worker process, so it only returns plain data."""
+    try:
+        if doc_path.lower().endswith(".pdf"):
+            from langchain_community.document_loaders import PyPDFLoader
+            loader = PyPDFLoader(doc_path)
+        elif doc_path.lower().endswith(".docx"):
+            from langchain_community.document_loaders import Docx2txtLoader
+            loader = Docx2txtLoader(doc_path)
+        elif doc_path.lower().endswith(".txt"):
+            from langchain_community.document_loaders import TextLoader
+            loader = TextLoader(doc_path)
+        else:
+            return {"path": doc_path, "error": "unsupported file type", "pages": []}
+        pages = [(page.page_content, page.metadata) for page in loader.load()]
+        return {"path": doc_path, "error": None, "pages": pages}
+    except Exception as e:
+        return {"path": doc_path, "error": str(e), "pages": []}
+
+
+@dataclass
+class IngestReport:
+    files_total: int = 0
+    files_parsed: int = 0
+    pages_changed: int = 0
+    chunks_added: int = 0
+    chunks_deleted: int = 0
+    chunks_unchanged: int = 0
+    seconds: float = 0.0
+    errors: list = field(default_factory=list)  # (path, message)
+    report_rows: list = field(default_factory=list)  # ReportRow from every document's report tables
+
+    @property
+    def chunks_per_second(self) -> float:
+        return round(self.chunks_added / self.seconds, 1) if self.seconds else 0.0
+
+    def describe(self) -> str:
+        if not self.files_parsed and not self.chunks_deleted:
+            return f"Document knowledge base up to date ({self.chunks_unchanged} chunks, {self.files_total} files unchanged)."
+        return (
+            f"Document knowledge base synced in {self.seconds:.1f}s: {self.files_parsed}/{self.files_total} files re-parsed, "
+            f"{self.pages_changed} pages changed, {self.chunks_added} chunks embedded ({self.chunks_per_second} chunks/s), "
+            f"{self.chunks_deleted} stale chunks removed, {self.chunks_unchanged} unchanged."
+        )
+
+
+class DocumentIngestor:
+    """Keeps a Chroma vector store in sync with a list of documents using content hashes.
+
+    The manifest (next to the Chroma files) records, per file, its SHA-256 and, per page, the page
+    text hash and the ids of the chunks it produced, plus the rows of any report tables in the file
+    (see report_index.extract_report_rows). Chunk ids are derived from the chunk text, so:
+    unchanged files are not parsed at all, unchanged pages of a changed file keep their chunks, only
+    chunks that did not exist before are embedded (in batches), and chunks no longer produced are deleted.
+    """
+
+    def __init__(self, vectorstore, persist_directory: str, chunk_size: int = 1000, chunk_overlap: int = 200,
+                 embed_batch_size: int = 64, max_workers: int | None = None):
+        self.vectorstore = vectorstore
+        from langchain.text_splitter import RecursiveCharacterTextSplitter  # heavy; only needed once documents are synced
+
+        self.manifest_path = os.path.join(persist_directory, MANIFEST_NAME)
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.embed_batch_size = embed_batch_size
+        self.max_workers = max_workers
+        self.splitter_signature = f"{chunk_size}/{chunk_overlap}"
+
+    # --- Manifest ---
+    def _load_manifest(self) -> dict | None:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("splitter") != self.splitter_signature:
+            return None  # Chunk boundaries changed: every chunk id is different anyway
+        return manifest
+
+    def _save_manifest(self, manifest: dict):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    # --- Parsing ---
+    def _parse(self, doc_paths: list) -> list[dict]:
+        if len(doc_paths) <= 1:
+            return [load_pages(path) for path in doc_paths]
+        workers = self.max_workers or min(len(doc_paths), os.cpu_count() or 1)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(load_pages, doc_paths))
+        except Exception:
+            # Process pools can be unavailable in restricted runtimes; parse serially instead
+            return [load_pages(path) for path in doc_paths]
+
+    def _chunk_page(self, doc_path: str, page_key: str, text: str, metadata: dict) -> list[tuple[str, str, dict]]:
+        chunks, seen = [], {}
+        for chunk_text in self.splitter.split_text(text):
+            digest = _sha256(f"{doc_path}\x00{page_key}\x00{chunk_text}".encode("utf-8"))[:32]
+            seen[digest] = seen.get(digest, 0) + 1
+            chunk_id = digest if seen[digest] == 1 else f"{digest}-{seen[digest]}"  # repeated text on one page
+            chunks.append((chunk_id, chunk_text, dict(metadata)))
+        return chunks
+
+    # --- Vector store writes ---
+    def _add(self, chunks: list[tuple[str, str, dict]]):
+        for start in range(0, len(chunks), self.embed_batch_size):
+            batch = chunks[start:start + self.embed_batch_size]
+            self.vectorstore.add_texts(
+                texts=[text for _, text, _ in batch],
+                metadatas=[metadata for _, _, metadata in batch],
+                ids=[chunk_id for chunk_id, _, _ in batch],
+            )
+
+    def _delete(self, chunk_ids: list):
+        for start in range(0, len(chunk_ids), 500):
+            self.vectorstore.delete(ids=chunk_ids[start:start + 500])
+
+    # --- Sync ---
+    def sync(self, doc_paths: list) -> IngestReport:
+        started = time.perf_counter()
+        report = IngestReport(files_total=len(doc_paths))
+        manifest = self._load_manifest()
+        if manifest is None:
+            # No usable manifest: the store's ids cannot be matched to content, so start it over once
+            existing_ids = self.vectorstore.get(include=[])["ids"]
+            self._delete(existing_ids)
+            report.chunks_deleted += len(existing_ids)
+            manifest = {"version": MANIFEST_VERSION, "splitter": self.splitter_signature, "files": {}}
+
+        old_files = manifest["files"]
+        new_files, to_parse = {}, []
+        for doc_path in doc_paths:
+            if not os.path.exists(doc_path):
+                report.errors.append((doc_path, "file not found"))
+                continue
+            with open(doc_path, "rb") as f:
+                file_hash = _sha256(f.read())
+            previous = old_files.get(doc_path)
+            # Entries written before report rows were extracted are re-parsed once (nothing is re-embedded)
+            if previous is not None and previous["sha256"] == file_hash and "report_rows" in previous:
+                new_files[doc_path] = previous
+                report.chunks_unchanged += sum(len(page["chunk_ids"]) for page in previous["pages"].values())
+            else:
+                to_parse.append((doc_path, file_hash))
+
+        to_add, to_delete = [], []
+        for (doc_path, file_hash), parsed in zip(to_parse, self._parse([path for path, _ in to_parse])):
+            previous_pages = old_files.get(doc_path, {}).get("pages", {})
+            if parsed["error"]:
+                report.errors.append((doc_path, parsed["error"]))
+                if doc_path in old_files:
+                    new_files[doc_path] = old_files[doc_path]  # keep serving the last good version
+                continue
+            report.files_parsed += 1
+            pages = {}
+            for position, (text, metadata) in enumerate(parsed["pages"]):
+                page_key = str(metadata.get("page", position))
+                page_hash = _sha256(text.encode("utf-8"))
+                previous_page = previous_pages.get(page_key)
+                if previous_page is not None and previous_page["hash"] == page_hash:
+                    pages[page_key] = previous_page
+                    report.chunks_unchanged += len(previous_page["chunk_ids"])
+                    continue
+                report.pages_changed += 1
+                chunks = self._chunk_page(doc_path, page_key, text, metadata)
+                previous_ids = set(previous_page["chunk_ids"]) if previous_page else set()
+                to_add.extend(chunk for chunk in chunks if chunk[0] not in previous_ids)
+                report.chunks_unchanged += sum(1 for chunk in chunks if chunk[0] in previous_ids)
+                pages[page_key] = {"hash": page_hash, "chunk_ids": [chunk[0] for chunk in chunks]}
+            rows = extract_report_rows(parsed["pages"], source=os.path.basename(doc_path))
+            new_files[doc_path] = {"sha256": file_hash, "pages": pages, "report_rows": [asdict(row) for row in rows]}
+
+        kept_ids = {chunk_id for info in new_files.values() for page in info["pages"].values() for chunk_id in page["chunk_ids"]}
+        for info in old_files.values():
+            for page in info["pages"].values():
+                to_delete.extend(chunk_id for chunk_id in page["chunk_ids"] if chunk_id not in kept_ids)
+
+        self._delete(to_delete)
+        self._add(to_add)
+        report.chunks_deleted += len(to_delete)
+        report.chunks_added = len(to_add)
+
+        manifest["files"] = new_files
+        self._save_manifest(manifest)
+        report.report_rows = [ReportRow(**row) for info in new_files.values() for row in info.get("report_rows", [])]
+        report.seconds = time.perf_counter() - started
+        return report
+
+
+class BackgroundDocumentStore:
+    """Opens the vector store and syncs the documents into it on a daemon thread.
+
+    `open_store()` returns the (empty or persisted) vector store; the remaining arguments go to DocumentIngestor.
+    Until `ready` is set, `vectorstore` is None and `key_question_index` is empty, so the app can take
+    questions while the documents load (database questions never wait for them).
+    """
+
+    def __init__(self, open_store, doc_paths: list, persist_directory: str, **ingestor_options):
+        self.vectorstore = None
+        self.key_question_index = KeyQuestionIndex([])
+        self.report = None
+        self.error = None
+        self.seconds = 0.0
+        self.finished_at = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(
+            target=self._load, args=(open_store, doc_paths, persist_directory, ingestor_options),
+            name="document-store-load", daemon=True,
+        )
+        self._thread.start()
+
+    def _load(self, open_store, doc_paths: list, persist_directory: str, ingestor_options: dict):
+        started = time.perf_counter()
+        try:
+            vectorstore = open_store()
+            self.vectorstore = vectorstore  # usable with the persisted chunks even if the sync below fails
+            self.report = DocumentIngestor(vectorstore, persist_directory, **ingestor_options).sync(doc_paths)
+            self.key_question_index = KeyQuestionIndex(self.report.report_rows)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.seconds = time.perf_counter() - started
+            self.finished_at = time.time()
+            self._ready.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        return self._ready.wait(timeout)
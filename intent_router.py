@@ -0,0 +1,134 @@
+import logging
+import re
+import threading
+from collections import Counter
+
+from schema_index import tokenize
+
+logger = logging.getLogger(__name__)
+
+ROUTE_DATABASE = "database"
+ROUTE_DOCUMENT = "document"
+ROUTE_BOTH = "both"
+
+# --- Phrasing cues (matched on the lowercased question) ---
+_ENTITIES = r"(month|year|quarter|week|day|date|supplier|vendor|buyer|requester|category|item|department|business unit|organization|region|status|type|po|invoice|requisition)s?"
+# Aggregations, groupings, rankings and time filters only make sense against the tables.
+_DATA_CUES = [
+    (re.compile(r"\b(how many|how much|number of|count of|total|sum of|average|avg|median)\b"), 2.5),
+    (re.compile(r"\b(top|bottom|first|last)\s+\d+\b"), 2.5),
+    (re.compile(r"\b(top|bottom|highest|lowest|largest|smallest|most|least|maximum|minimum)\b"), 1.5),
+    # "by the PO reports" is not a grouping, so no article between the preposition and the entity
+    (re.compile(rf"\b(by|per|for each|for|across|group(ed)? by|breakdown of|split by)\s+(each\s+)?{_ENTITIES}\b"), 2.5),
+    (re.compile(rf"\b(which|what)\s+{_ENTITIES}\s+(has|have|had|is|are|was|were)\b"), 1.5),
+    (re.compile(r"\b(trend|over time|monthly|yearly|quarterly|weekly|daily|year over year|yoy|compare|comparison)\b"), 1.5),
+    (re.compile(r"\b(in|for|during|since|before|after)\s+(19|20)\d\d\b|\b(last|this|previous|next)\s+(month|year|quarter|week)\b"), 2.0),
+    (re.compile(r"\b(show|list|display|plot|chart|graph)\b"), 1.0),
+    (re.compile(r"\b\d+(\.\d+)?\b"), 0.5),
+]
+# Definitions, explanations and questions about the solution itself.
+_DOCUMENT_CUES = [
+    (re.compile(r"\b(what is|what are|what does|explain|describe|tell me about)\b"), 1.5),
+    (re.compile(r"\b(definition|define|meaning|mean|means|purpose|overview|introduction|used for)\b"), 1.5),
+    (re.compile(r"\bhow (is|are|do|does)\b.*\b(calculated|computed|derived|defined|measured|determined)\b"), 3.0),
+    (re.compile(r"\b(logic|formula|methodology|architecture|logical model|subject area|solution|dashboard|reports?|kpis?|metrics?)\b"), 2.5),
+    (re.compile(r"\b(dilytics|document|documentation|guide|version)\b"), 2.0),
+]
+# "what is the total ..." is a data question: a data cue outweighs the generic "what is" opener
+_GENERIC_DOCUMENT_OPENERS = re.compile(r"^\s*(what is|what are)\b")
+# Common words that are in one vocabulary only by chance and say nothing about the intent
+_ROUTER_STOPWORDS = {
+    "many", "much", "there", "here", "have", "has", "had", "do", "does", "did", "was", "were", "can", "could",
+    "would", "should", "will", "i", "we", "you", "my", "our", "your", "about", "than", "then", "also", "any",
+    "some", "more", "other", "such", "only", "same", "when", "where", "why", "not", "no", "been", "being",
+    "these", "those", "their", "they", "them", "whose", "want", "need", "please", "contain", "available",
+}
+
+
+class IntentRouter:
+    """Decides, without an LLM, whether a question needs the database path, the document path or both.
+
+    Two signals are combined per side: phrasing cues (aggregations/time filters vs. definitions and
+    explanations) and vocabulary, i.e. question words that only the schema (column names, synonyms)
+    or only the document chunks use. Words both sides share ("requisition", "amount") count for neither.
+    A side is skipped only when the other side's score clears `min_score` and its own score stays under
+    `max_other_score`; anything ambiguous runs both paths, as before.
+    """
+
+    def __init__(self, schema_index, document_texts: list[str], min_score: float = 2.5, max_other_score: float = 1.0,
+                 min_document_frequency: int = 2):
+        self.schema_index = schema_index
+        self.min_score = min_score
+        self.max_other_score = max_other_score
+        # Column names, synonyms and table names; column descriptions are prose and would match anything
+        self.schema_vocabulary = set()
+        if schema_index is not None:
+            for table_name, table in schema_index.tables.items():
+                self.schema_vocabulary.update(tokenize(table_name))
+                for keyword in table["keywords"]:
+                    self.schema_vocabulary.update(tokenize(keyword))
+        self.schema_vocabulary -= _ROUTER_STOPWORDS
+        # Words seen in a single chunk are mostly noise (names, OCR fragments)
+        document_frequency = Counter(token for text in document_texts for token in set(tokenize(text)))
+        self.document_vocabulary = {
+            token for token, df in document_frequency.items() if df >= min_document_frequency and token not in _ROUTER_STOPWORDS
+        }
+        self._lock = threading.Lock()
+        self.stats = {"questions": 0, ROUTE_DATABASE: 0, ROUTE_DOCUMENT: 0, ROUTE_BOTH: 0}
+
+    @staticmethod
+    def _cue_score(cues, text: str) -> tuple[float, list, str]:
+        """(score, matched phrases, text with the matched phrases blanked out)."""
+        score, matched = 0.0, []
+        for pattern, weight in cues:
+            match = pattern.search(text)
+            if match:
+                score += weight
+                matched.append(match.group(0).strip())
+                text = pattern.sub(" ", text)
+        return score, matched, text
+
+    def score(self, question: str) -> dict:
+        text = question.lower()
+        if self.schema_index is not None:
+            explicit_table = any(name in question.upper() for name in self.schema_index.tables)
+        else:
+            explicit_table = False
+        data_cues, data_matched, remainder = self._cue_score(_DATA_CUES, text)
+        doc_cues, doc_matched, remainder = self._cue_score(_DOCUMENT_CUES, remainder)
+        if data_cues >= 2.0 and _GENERIC_DOCUMENT_OPENERS.match(text):
+            doc_cues = max(0.0, doc_cues - 1.5)
+        # Words already counted as a cue ("average", "trend", "report") are not counted again as vocabulary
+        tokens = set(tokenize(remainder))
+        schema_only = sorted(tokens & self.schema_vocabulary - self.document_vocabulary)
+        document_only = sorted(tokens & self.document_vocabulary - self.schema_vocabulary)
+        return {
+            ROUTE_DATABASE: data_cues + 1.0 * len(schema_only) + (3.0 if explicit_table else 0.0),
+            ROUTE_DOCUMENT: doc_cues + 1.0 * len(document_only),
+            "cues": {ROUTE_DATABASE: data_matched, ROUTE_DOCUMENT: doc_matched},
+            "vocabulary": {ROUTE_DATABASE: schema_only, ROUTE_DOCUMENT: document_only},
+        }
+
+    def route(self, question: str) -> str:
+        scores = self.score(question)
+        database, document = scores[ROUTE_DATABASE], scores[ROUTE_DOCUMENT]
+        if database >= self.min_score and document <= self.max_other_score:
+            decision = ROUTE_DATABASE
+        elif document >= self.min_score and database <= self.max_other_score:
+            decision = ROUTE_DOCUMENT
+        else:
+            decision = ROUTE_BOTH
+        with self._lock:
+            self.stats["questions"] += 1
+            self.stats[decision] += 1
+        logger.info("route=%s database=%.1f document=%.1f cues=%s vocabulary=%s question=%r",
+                    decision, database, document, scores["cues"], scores["vocabulary"], question)
+        return decision
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        # Each one-sided question saves one LLM call (SQL generation or the RAG answer)
+        stats["llm_calls_skipped"] = stats[ROUTE_DATABASE] + stats[ROUTE_DOCUMENT]
+        stats["one_sided_pct"] = round(100.0 * stats["llm_calls_skipped"] / stats["questions"], 1) if stats["questions"] else 0.0
+        return stats
@@ -0,0 +1,208 @@
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from schema_index import SchemaIndex, tokenize
+from sql_tools import _ALIAS_GROUP, _NOT_AN_ALIAS, apply_edits, mask_quoted
+
+_JOIN_TYPES = {"left_outer": "LEFT JOIN", "right_outer": "RIGHT JOIN", "full_outer": "FULL OUTER JOIN", "inner": "JOIN"}
+_JOIN_ON_PATTERN = re.compile(r"\bJOIN\s+(`[^`]+`|[\w.-]+)(?:\s+(?:AS\s+)?(\w+))?\s+ON\b", re.IGNORECASE)
+_TABLE_REFERENCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+(`[^`]+`|[\w.-]+)(?:\s+(?:AS\s+)?" + _ALIAS_GROUP + ")?", re.IGNORECASE)
+# Where an ON condition ends (at parenthesis depth 0)
+_CONDITION_END_PATTERN = re.compile(
+    r"[()]|\b(?:JOIN|LEFT|RIGHT|INNER|FULL|CROSS|WHERE|GROUP|ORDER|HAVING|LIMIT|QUALIFY|WINDOW|UNION|EXCEPT|INTERSECT)\b",
+    re.IGNORECASE,
+)
+_EQUALITY_PATTERN = re.compile(r"(?<![\w.`])(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)\b(?!\s*[.(])")
+# Words of a key column that say nothing about its role ("DW_ORDERED_ON_DT_KEY" -> "ordered")
+_ROLE_STOP_WORDS = {"dt", "date", "on"}
+
+
+@dataclass(frozen=True)
+class Relationship:
+    name: str
+    left_table: str  # the many side (a fact table in this schema)
+    left_column: str
+    right_table: str  # the one side (a dimension)
+    right_column: str
+    join_type: str = "left_outer"
+
+    def role(self) -> str:
+        words = [word for word in tokenize(self.left_column) if word not in _ROLE_STOP_WORDS]
+        return " ".join(words)
+
+
+@dataclass
+class JoinStep:
+    relationship: Relationship
+    alternatives: list = field(default_factory=list)  # other declared relationships between the same two tables
+
+
+@dataclass
+class JoinCheck:
+    sql: str
+    fixes: list = field(default_factory=list)
+    problems: list = field(default_factory=list)
+
+
+class JoinPlanner:
+    """Join graph compiled from the schema YAML `relationships`, for planning and checking the JOINs of generated SQL.
+
+    Every declared relationship is many-to-one from a fact to a dimension, so a plan is a star: the
+    question's main fact joined directly to each dimension it needs. Role-playing dimensions
+    (DIL_COMMON_DT_D as ordered / due / received date) have one relationship per role; the one whose key
+    column shares words with the question is planned and the others are listed as alternatives.
+    """
+
+    def __init__(self, schema_index: SchemaIndex, project_id: str, dataset_id: str):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.between = defaultdict(list)  # frozenset({table, table}) -> [Relationship]
+        self.dimensions_of = defaultdict(set)  # fact -> dimensions it has a relationship to
+        for rel in schema_index.relationships:
+            for left_column, right_column in rel["columns"]:
+                if not (left_column and right_column):
+                    continue
+                relationship = Relationship(
+                    rel["name"], rel["left_table"].upper(), left_column.upper(), rel["right_table"].upper(),
+                    right_column.upper(), rel.get("join_type") or "left_outer",
+                )
+                self.between[frozenset((relationship.left_table, relationship.right_table))].append(relationship)
+                self.dimensions_of[relationship.left_table].add(relationship.right_table)
+        self._lock = threading.Lock()
+        self.stats = {"planned": 0, "checked": 0, "joins_checked": 0, "joins_fixed": 0, "unplanned_joins": 0}
+
+    # --- Planning ---
+    def relationships(self, left: str, right: str) -> list[Relationship]:
+        return self.between.get(frozenset((left.upper(), right.upper())), [])
+
+    def plan(self, question: str, tables: list[str]) -> tuple[list[JoinStep], list[str]]:
+        """(join steps, notes) for the tables selected for the question, most relevant first."""
+        tables = [table.upper() for table in tables]
+        facts = [table for table in tables if table in self.dimensions_of]
+        question_tokens = set(tokenize(question))
+        steps, notes = [], []
+        for table in tables:
+            if table in self.dimensions_of:
+                continue
+            # Prefer the question's main fact; a dimension only another selected fact reaches is joined to that one
+            fact = next((f for f in facts if table in self.dimensions_of[f]), None)
+            if fact is None:
+                continue
+            candidates = self.relationships(fact, table)
+            default_key = f"DW_{table.removeprefix('DIL_').removesuffix('_D')}_KEY"  # DIL_COMMON_DT_D -> DW_COMMON_DT_KEY
+            best = max(candidates, key=lambda rel: (
+                len(question_tokens & set(rel.role().split())),  # "ordered" in the question -> DW_ORDERED_ON_DT_KEY
+                rel.left_column == default_key,
+                -candidates.index(rel),
+            ))
+            steps.append(JoinStep(best, [rel for rel in candidates if rel is not best]))
+        if len(facts) > 1:
+            notes.append(
+                f"{', '.join(facts)} have no relationship to each other: if the question needs more than one of them, "
+                f"aggregate each fact table separately and join the aggregated results on a shared dimension key."
+            )
+        with self._lock:
+            self.stats["planned"] += 1
+        return steps, notes
+
+    def join_clause(self, relationship: Relationship) -> str:
+        join = _JOIN_TYPES.get(relationship.join_type, "JOIN")
+        return (
+            f"{join} `{self.project_id}.{self.dataset_id}.{relationship.right_table}` ON "
+            f"{relationship.left_table}.{relationship.left_column} = {relationship.right_table}.{relationship.right_column}"
+        )
+
+    def prompt_section(self, question: str, tables: list[str]) -> str:
+        """The JOIN ... ON clauses to give the SQL prompt for these tables ("" when no join is needed)."""
+        steps, notes = self.plan(question, tables)
+        if not steps and not notes:
+            return ""
+        lines = ["Join paths (use exactly these JOIN ... ON conditions; never join tables on any other columns):"]
+        for step in steps:
+            line = f"- {self.join_clause(step.relationship)}"
+            if step.alternatives:
+                line += f"  -- {step.relationship.role()}; for another meaning join on " + ", ".join(
+                    f"{rel.left_table}.{rel.left_column} ({rel.role()})" for rel in step.alternatives
+                )
+            lines.append(line)
+        lines += [f"- {note}" for note in notes]
+        return "\n".join(lines) + "\n"
+
+    # --- Checking generated SQL ---
+    @staticmethod
+    def _scope(sql: str, masked: str) -> dict:
+        scope = {}
+        for match in _TABLE_REFERENCE_PATTERN.finditer(masked):
+            table = sql[match.start(1):match.end(1)].strip("`").split(".")[-1].upper()
+            scope[table] = table
+            if match.group(2) and match.group(2).upper() not in _NOT_AN_ALIAS:
+                scope[match.group(2).upper()] = table
+        return scope
+
+    @staticmethod
+    def _condition_end(masked: str, start: int) -> int:
+        depth = 0
+        for match in _CONDITION_END_PATTERN.finditer(masked, start):
+            token = match.group(0)
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                if depth == 0:
+                    return match.start()
+                depth -= 1
+            elif depth == 0:
+                return match.start()
+        return len(masked)
+
+    def verify(self, sql: str) -> JoinCheck:
+        """Checks every `JOIN ... ON a.X = b.Y` against the declared relationships and rewrites wrong key columns.
+
+        A wrong equality is replaced when the relationship it meant is unambiguous: the two tables have one
+        relationship, or several and one of the query's two columns matches exactly one of them. Joins between
+        tables with no declared relationship are reported, not changed.
+        """
+        masked = mask_quoted(sql)
+        scope = self._scope(sql, masked)
+        check = JoinCheck(sql=sql)
+        edits = []
+        joins = 0
+        for join in _JOIN_ON_PATTERN.finditer(masked):
+            joined_table = sql[join.start(1):join.end(1)].strip("`").split(".")[-1].upper()
+            end = self._condition_end(masked, join.end())
+            for equality in _EQUALITY_PATTERN.finditer(masked, join.end(), end):
+                q1, c1, q2, c2 = (equality.group(i) for i in range(1, 5))
+                t1, t2 = scope.get(q1.upper()), scope.get(q2.upper())
+                if t1 is None or t2 is None or t1 == t2 or joined_table not in (t1, t2):
+                    continue
+                joins += 1
+                declared = self.relationships(t1, t2)
+                if not declared:
+                    check.problems.append(f"{t1} and {t2} have no declared relationship ({equality.group(0)})")
+                    continue
+                used = {(t1, c1.upper()), (t2, c2.upper())}
+                if any(used == {(rel.left_table, rel.left_column), (rel.right_table, rel.right_column)} for rel in declared):
+                    continue
+                if len(declared) > 1:
+                    # Role-playing dimension: the fact-side key the query used says which role was meant
+                    declared = [rel for rel in declared if (rel.left_table, rel.left_column) in used]
+                if len(declared) != 1:
+                    check.problems.append(f"{equality.group(0)} matches none of the declared {t1} / {t2} relationships")
+                    continue
+                rel = declared[0]
+                left_q, right_q = (q1, q2) if t1 == rel.left_table else (q2, q1)
+                replacement = f"{left_q}.{rel.left_column} = {right_q}.{rel.right_column}"
+                edits.append((equality.start(), equality.end(), replacement))
+                check.fixes.append(f"{equality.group(0)} -> {replacement} ({rel.name})")
+        check.sql = apply_edits(sql, edits)
+        with self._lock:
+            self.stats["checked"] += 1
+            self.stats["joins_checked"] += joins
+            self.stats["joins_fixed"] += len(check.fixes)
+            self.stats["unplanned_joins"] += len(check.problems)
+        return check
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
@@ -1,22 +1,46 @@
+from __future__ import annotations  # type hints name lazily imported classes (ChatVertexAI, Chroma, plt)
+
+import time
+_SCRIPT_STARTED = time.time()  # the first run's value is the process' cold-start reference (initialize_startup_clock)
+
 import os
 import re
+import logging
 import pandas as pd
-from pandas_gbq import read_gbq
 from langchain_core.prompts import PromptTemplate
-from langchain_google_vertexai import ChatVertexAI, VertexAIEmbeddings
 import yaml
 import sqlparse
-import matplotlib.pyplot as plt
-import seaborn as sns
 import numpy as np
 from io import BytesIO
 import json
-
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from langchain_community.vectorstores import Chroma
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
+import threading
+import queue
+from dataclasses import dataclass
+from contextlib import nullcontext
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Heavy modules (langchain_google_vertexai, Chroma, matplotlib, seaborn, BigQuery) are imported on first use,
+# so a cold container reaches the login form without them
+from doc_ingest import BackgroundDocumentStore
+from report_index import KeyQuestionIndex
+from intent_router import IntentRouter, ROUTE_DATABASE, ROUTE_DOCUMENT, ROUTE_BOTH
+import tracing
+from tracing import Trace, TraceLog, TraceMetrics, start_metrics_server
+from schema_index import SchemaIndex
+from query_backends import QueryBackend, BigQueryBackend, SQLiteBackend
+from dimension_replica import DimensionReplica
+from rollups import RollupRefresher, RollupRouter, load_rollup_catalog, register_rollup_ttls
+from join_planner import JoinPlanner
+from sql_candidates import SpeculativeSQL
+from result_frames import ResultCompactor, drop_unused_categories, is_label_column, label_columns
+from answer_service import AnswerService, ServiceBusy, SingleFlight
+from upstream_limits import LimitedChatModel, LimitedEmbeddings, UpstreamLimiter
+from chat_history import ChatHistoryStore, sweep_stale_sessions, total_resident_bytes
+from caches import CachedEmbeddings, SQLQueryCache, QueryResultCache, RenderedPlotCache, canonicalize_sql, dataframe_fingerprint, file_sha256, normalize_question
+from sql_tools import SQLValidator, SQLValidationError, SQLAliasRewriter, alias_map, reserved_keywords, cap_rows, chart_aggregate_sql
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # --- Streamlit Page Configuration (Always at the very top) ---
 st.set_page_config(page_title="Dilytics Procurement Insights Chatbot", layout="wide")
@@ -25,8 +49,9 @@ st.set_page_config(page_title="Dilytics Procurement Insights Chatbot", layout="w
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = False
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+# st.session_state.messages (ChatHistoryStore) is created after the config section, it needs CACHE_DIRECTORY
 
 if "last_db_df" not in st.session_state:
     st.session_state.last_db_df = None
@@ -35,6 +60,9 @@ if "last_db_query" not in st.session_state:
 if "last_db_plot_question" not in st.session_state:
     st.session_state.last_db_plot_question = None
 
+if "bypass_result_cache" not in st.session_state:
+    st.session_state.bypass_result_cache = False
+
 if "plot_x_col" not in st.session_state:
     st.session_state.plot_x_col = None
 if "plot_y_col" not in st.session_state:
@@ -46,7 +74,6 @@ if "plot_chart_type" not in st.session_state:
 # --- IMPORTANT: Changes for Streamlit Cloud Deployment ---
 # Ab saari configurations Streamlit Secrets se load hongi.
 from google.oauth2 import service_account
-from google.cloud import bigquery
 import json
 import streamlit as st
 
@@ -66,7 +93,7 @@ try:
 
     # Service Account Credentials load
     credentials = service_account.Credentials.from_service_account_info(creds_info)
-    client = bigquery.Client(credentials=credentials, project=PROJECT_ID)
+    # bigquery.Client ek hi baar banta hai (initialize_query_backend), har rerun par nahi
 
     st.success(f"✅ Auth successful with service account: {creds_info['client_email']}")
 
@@ -94,77 +121,278 @@ DOCUMENT_PATHS = [
     "Dilytics Procuremnt Insights Mertics and Data Logic Draft A.pdf"
 ]
 PERSIST_DIRECTORY = "./chroma_db"
+DOC_EMBED_BATCH_SIZE = 64  # chunks per VertexAIEmbeddings call during ingestion
+DOC_PARSE_WORKERS = None  # worker processes for PDF parsing (None = one per document, up to CPU count)
+# Vector store background me login ke baad load hota hai; usse pehle aaya document question itna wait karta hai
+DOCUMENT_STORE_WAIT_SECONDS = 30
+# Questions matching a report's "Key Question Answered" this closely get its Description without a Gemini call
+KEY_QUESTION_MIN_CONFIDENCE = 0.75
 schema_file_path = "Full_Procurement_Schema.yaml"
 
+# --- Persistent caches ---
+CACHE_DIRECTORY = "./query_cache"
+SCHEMA_ARTIFACT_PATH = os.path.join(CACHE_DIRECTORY, "schema_index.pickle")  # compiled schema YAML, rebuilt when it changes
+SQL_CACHE_SIMILARITY_THRESHOLD = 0.95  # cosine similarity above which a past question's SQL is reused
+SQL_CACHE_MAX_ENTRIES = 1000
+EMBEDDING_CACHE_MAX_ENTRIES = 200000  # ~3 KB per 768-dim vector
+# BigQuery result cache: fact tables change through the day, dimensions rarely
+RESULT_CACHE_MEMORY_MB = 256
+RESULT_CACHE_DISK_MB = 2048
+RESULT_CACHE_FACT_TTL_SECONDS = 15 * 60
+RESULT_CACHE_DIMENSION_TTL_SECONDS = 6 * 60 * 60
+RESULT_CACHE_TABLE_TTLS = {
+    "DIL_PURCH_COST_F": 30 * 60,
+    "DIL_COMMON_DT_D": 24 * 60 * 60,
+}
+
+# --- Schema pruning: sirf question se related tables (aur unhe join karne wali tables) SQL prompt me jati hain ---
+SCHEMA_PRUNE_TOP_K = 4
+
+# --- Join planner: schema relationships se exact JOIN ... ON clauses prompt me, generated SQL ke joins check/fix ---
+JOIN_PLANNER_ENABLED = True
+
+# --- Pre-execution SQL validation ---
+# Unknown tables/columns go straight to the Gemini fix prompt instead of costing a failed BigQuery job.
+SQL_VALIDATOR_BLOCK_UNKNOWN_NAMES = True
+
+# --- Speculative SQL candidates: kai prompt variants se SQL ek saath likhwao, jo pehle checks pass kare wahi chalega ---
+# Up to SQL_CANDIDATES Gemini calls per new question instead of one; 1 keeps the sequential generate -> fix chain.
+SQL_CANDIDATES = 1
+SQL_CANDIDATE_HINTS = [
+    "",  # the unchanged prompt
+    "- Cast every numeric-looking STRING column with SAFE_CAST(column AS FLOAT64) before aggregating or comparing it.\n",
+    "- Write the simplest query that answers the question: only the tables it needs, joined on the JOIN conditions above.\n",
+]
+SQL_CANDIDATE_HEDGE_SECONDS = 0.0  # the other candidates start this long after the first; None = only once one fails its checks
+SQL_CANDIDATE_DRY_RUN = True  # a candidate must also pass a BigQuery dry run (not billed) to win
+
+# --- Query backend ---
+# "bigquery" in production; "sqlite" runs the generated SQL against LOCAL_QUERY_DB_PATH for local testing
+QUERY_BACKEND = os.environ.get("QUERY_BACKEND", "bigquery")
+LOCAL_QUERY_DB_PATH = os.environ.get("LOCAL_QUERY_DB_PATH", "./local_procurement.sqlite3")
+BQ_SMALL_RESULT_ROWS = 10000  # up to this many rows the query_and_wait response is read directly (REST)
+BQ_HTTP_POOL_SIZE = 32  # connections kept open to BigQuery; the answer paths and sessions share them
+
+# --- Dimension replica: chhoti dimension tables ki local DuckDB copy, sirf unhi tables wali queries ke liye ---
+DIMENSION_REPLICA_ENABLED = True
+DIMENSION_REPLICA_PATH = os.path.join(CACHE_DIRECTORY, "dimensions.duckdb")
+DIMENSION_REPLICA_TABLES = None  # None = every *_D table in the schema YAML
+DIMENSION_REPLICA_MAX_ROWS = 500000  # bigger dimension tables are not copied and stay on BigQuery
+DIMENSION_REPLICA_REFRESH_SECONDS = 60 * 60
+DIMENSION_REPLICA_MAX_STALENESS_SECONDS = 6 * 60 * 60  # older copies are not served (same as the dimension result TTL)
+
+# --- KPI rollups: metrics document ke standard questions pre-aggregated summary tables se ---
+# Catalog, refresh schedule and staleness limit live in ROLLUP_CATALOG_PATH (next to the schema YAML)
+ROLLUPS_ENABLED = True
+ROLLUP_CATALOG_PATH = "rollup_catalog.yaml"
+ROLLUP_DATASET_ID = os.environ.get("ROLLUP_DATASET_ID", DATASET_ID)  # where the rollup tables are written
+ROLLUP_STATE_PATH = os.path.join(CACHE_DIRECTORY, "rollups_state.json")
+
+# --- Chat history: sirf last few turns ke DataFrame/plot RAM me, baaki disk par ---
+CHAT_HISTORY_RESIDENT_TURNS = 5
+CHAT_HISTORY_MEMORY_BUDGET_MB = 64  # per session
+CHAT_HISTORY_SPILL_MAX_AGE_HOURS = 24  # spill folders of sessions idle longer than this are deleted
+
+# --- Plot rendering ---
+# Chat aur Dynamic Visualization me low-DPI preview dikhta hai; 300 DPI sirf download ke time render hota hai.
+PLOT_RENDER_PROFILES = {
+    "preview": {"dpi": 80, "bbox_inches": None},
+    "full": {"dpi": 300, "bbox_inches": "tight"},
+}
+PLOT_CACHE_MEMORY_MB = 64
+PLOT_MAX_PIE_SLICES = 10  # Max slices before grouping into 'Others' for pie charts
+PLOT_MAX_BAR_CATEGORIES = 15  # Max bars before grouping into 'Others'
+
+# --- Streaming ---
+STREAM_PREVIEW_ROWS = 20  # rows shown in the chat bubble as soon as the query returns
+
+# --- Result size caps ---
+# Raw tables are fetched only up to RESULT_ROW_CAP rows ("Fetch more rows" raises it); charts on a capped
+# result are aggregated in BigQuery instead of in pandas, so a huge fact table never lands in memory.
+RESULT_ROW_CAP = 5000
+RESULT_ROW_CAP_MAX = 200000
+RESULT_FETCH_MORE_FACTOR = 4
+
+# --- Result dtypes: fetch ke waqt ek baar compact dtypes (categorical / Arrow strings, chhote ints, parsed dates) ---
+RESULT_COMPACT_ENABLED = True
+RESULT_CATEGORY_MAX_RATIO = 0.5  # text columns with at most this share of distinct values become categorical
+
+@st.cache_resource
+def sweep_chat_history_spills() -> int:
+    # Runs once per process: cleans up spill folders left behind by sessions that ended without logout
+    return sweep_stale_sessions(os.path.join(CACHE_DIRECTORY, "sessions"), CHAT_HISTORY_SPILL_MAX_AGE_HOURS * 3600)
+
+sweep_chat_history_spills()
+
+if "messages" not in st.session_state:
+    st.session_state.messages = ChatHistoryStore(
+        os.path.join(CACHE_DIRECTORY, "sessions", st.session_state.session_id),
+        resident_turns=CHAT_HISTORY_RESIDENT_TURNS,
+        memory_budget_bytes=CHAT_HISTORY_MEMORY_BUDGET_MB * 1024 * 1024,
+    )
+
+# --- Intent routing: saaf DB-only ya doc-only sawal par dusra path (aur uski LLM call) skip hota hai ---
+INTENT_ROUTING_ENABLED = True
+INTENT_ROUTER_MIN_SCORE = 2.5  # a side is chosen alone only above this score...
+INTENT_ROUTER_MAX_OTHER_SCORE = 1.0  # ...and only while the other side stays at or below this one
+# Routing decisions are logged by the intent_router logger
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+# --- Answer path timeouts (seconds) ---
+# Database aur document paths parallel chalte hain; jo path apne timeout tak
+# khatam nahi hota uska result chhod diya jata hai aur dusre path ka answer dikhaya jata hai.
+DB_PATH_TIMEOUT_SECONDS = 120
+DOC_PATH_TIMEOUT_SECONDS = 60
+
+# --- Answer service: sab sessions ke questions ek shared queue aur fixed worker pool par ---
+# Same question already queued/running (kisi bhi session ka) => naya pipeline nahi, usi job ke events milte hain.
+ANSWER_SERVICE_ENABLED = True
+ANSWER_SERVICE_WORKERS = 8  # questions answered at the same time across all sessions
+ANSWER_SERVICE_MAX_QUEUED = 64  # beyond this, new questions get a "busy, ask again" reply instead of waiting
+SQL_SINGLE_FLIGHT_ENABLED = True  # identical SQL already executing is waited for, not sent to BigQuery again
+
+# --- Upstream limits: Vertex AI aur BigQuery calls ke liye process-wide token bucket + concurrency cap ---
+# Quota se upar ki calls 429 dekar fail hone ki jagah queue me wait karti hain (questions ke beech round-robin);
+# 429/503 par jittered exponential backoff ke saath retry. Rates apne project ke quota ke hisaab se set karein.
+UPSTREAM_LIMITS = {
+    "vertex_llm": {"rate_per_second": 5.0, "burst": 10, "max_concurrency": 8},
+    "vertex_embeddings": {"rate_per_second": 20.0, "burst": 40, "max_concurrency": 8},
+    "bigquery": {"rate_per_second": 10.0, "burst": 20, "max_concurrency": 16},
+}
+UPSTREAM_MAX_WAIT_SECONDS = 30  # a call still waiting after this fails with "at capacity" instead of queueing on
+UPSTREAM_MAX_RETRIES = 4
+UPSTREAM_BACKOFF_SECONDS = 0.5  # first retry waits up to this long, doubling per attempt (full jitter)
+UPSTREAM_MAX_BACKOFF_SECONDS = 8.0
+
+# --- Tracing: har sawal ke har stage ka time, tokens, bytes aur retry path ---
+TRACE_LOG_PATH = os.path.join(CACHE_DIRECTORY, "traces.jsonl")  # one JSON line per answered question
+TRACE_LOG_MAX_MB = 50  # rotated to traces.jsonl.1 past this size
+TRACE_METRICS_WINDOW = 1000  # recent spans per stage used for the p50/p95 latencies
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))  # Prometheus text at :METRICS_PORT/metrics; off unless set (e.g. 9464)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")  # loopback only; "0.0.0.0" lets a scraper on another host in
+
+@st.cache_resource
+def initialize_tracing() -> tuple[TraceLog, TraceMetrics]:
+    """Trace sinks shared by every session; the /metrics endpoint is started once per process."""
+    trace_metrics = TraceMetrics(window=TRACE_METRICS_WINDOW)
+    if METRICS_PORT:
+        try:
+            start_metrics_server(trace_metrics, METRICS_PORT, host=METRICS_HOST)
+        except OSError as e:
+            st.warning(f"⚠️ Metrics endpoint disabled, port {METRICS_PORT} is not available: {e}")
+    return TraceLog(TRACE_LOG_PATH, max_bytes=TRACE_LOG_MAX_MB * 1024 * 1024), trace_metrics
+
+trace_log, trace_metrics = initialize_tracing()
+
+@st.cache_resource
+def initialize_startup_clock() -> float:
+    """Wall-clock time of the process' first script run; cold-start milestones are measured from it."""
+    return _SCRIPT_STARTED
+
+startup_started_at = initialize_startup_clock()
+
+def record_startup(milestone: str, at: float | None = None):
+    seconds = (at or time.time()) - startup_started_at
+    if trace_metrics.record_startup(milestone, seconds):
+        logging.getLogger(__name__).info("Cold start: %s after %.2fs", milestone, seconds)
+
+@st.cache_resource
+def prewarm_imports() -> threading.Thread:
+    """Imports the heavy modules in the background while the login form is shown, so the first answer does not pay for them."""
+    def _import_all():
+        for module in ("langchain_google_vertexai", "langchain_community.vectorstores", "google.cloud.bigquery",
+                       "matplotlib.pyplot", "seaborn"):
+            try:
+                __import__(module)
+            except Exception as e:
+                logging.getLogger(__name__).warning("Prewarming %s failed: %s", module, e)
+
+    thread = threading.Thread(target=_import_all, name="prewarm-imports", daemon=True)
+    thread.start()
+    return thread
+
+# --- Authentication Logic (Updated to use secrets) ---
+def authenticate():
+    st.sidebar.title("Login")
+    username = st.sidebar.text_input("Username")
+    password = st.sidebar.text_input("Password", type="password")
+
+    if st.sidebar.button("Login"):
+        if username == st.secrets.get("login_username") and password == st.secrets.get("login_password"):
+            st.session_state.authenticated = True
+            st.rerun()
+        else:
+            st.sidebar.error("Invalid Username or Password")
+
+# --- Login gate: models, schema, caches and BigQuery are only initialized for a signed-in session ---
+if not st.session_state.authenticated:
+    st.title("📊 PROCUREMENT INSIGHTS CHATBOT")
+    st.markdown("---")
+    authenticate()
+    prewarm_imports()
+    record_startup("login_form")  # cold start to the first interactive render
+    st.stop()
+
 # --- Cached Resources for performance ---
+@st.cache_resource
+def initialize_upstream_limiters() -> dict[str, UpstreamLimiter]:
+    """One limiter per upstream, shared by every session, thread and background job; exported on /metrics."""
+    limiters = {
+        name: UpstreamLimiter(
+            name,
+            max_wait_seconds=UPSTREAM_MAX_WAIT_SECONDS,
+            max_retries=UPSTREAM_MAX_RETRIES,
+            base_backoff_seconds=UPSTREAM_BACKOFF_SECONDS,
+            max_backoff_seconds=UPSTREAM_MAX_BACKOFF_SECONDS,
+            **limits,
+        )
+        for name, limits in UPSTREAM_LIMITS.items()
+    }
+    for limiter in limiters.values():
+        trace_metrics.add_collector(limiter.prometheus_text)
+    return limiters
+
+upstream_limiters = initialize_upstream_limiters()
+
 @st.cache_resource(show_spinner="⏳ Initializing AI Models and Databases...")
 def initialize_resources():
-    """Initializes LLM, Embeddings, Document Vector Store, and Schema."""
+    """Initializes LLM, Embeddings and Schema. The document vector store loads in the background (initialize_document_store)."""
     try:
-        llm = ChatVertexAI(
-            model="gemini-2.0-flash-001",
-            project=PROJECT_ID,
-            location=LOCATION,
-            temperature=0.1
+        from langchain_google_vertexai import ChatVertexAI, VertexAIEmbeddings
+
+        # Retries are left to the shared upstream limiters (max_retries=0), so a 429 is not retried per session
+        llm = LimitedChatModel(
+            ChatVertexAI(
+                model="gemini-2.0-flash-001",
+                project=PROJECT_ID,
+                location=LOCATION,
+                temperature=0.1,
+                max_retries=0,
+            ),
+            upstream_limiters["vertex_llm"],
         )
-        embeddings = VertexAIEmbeddings(
+        # Every embed call (retriever, SQL cache, ingestion) goes through the persistent embedding cache
+        embeddings = CachedEmbeddings(
+            LimitedEmbeddings(
+                VertexAIEmbeddings(
+                    model_name="text-embedding-004",
+                    project=PROJECT_ID,
+                    location=LOCATION,
+                    max_retries=0,
+                ),
+                upstream_limiters["vertex_embeddings"],
+            ),
+            os.path.join(CACHE_DIRECTORY, "embeddings.sqlite3"),
             model_name="text-embedding-004",
-            project=PROJECT_ID,
-            location=LOCATION
+            max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
         )
 
-        vectorstore = None
-        if os.path.exists(PERSIST_DIRECTORY) and os.listdir(PERSIST_DIRECTORY):
-            st.info("📦 Loading existing document knowledge base...")
-            vectorstore = Chroma(persist_directory=PERSIST_DIRECTORY, embedding_function=embeddings)
-        else:
-            st.info("Creating new document knowledge base from scratch...")
-            all_documents = []
-            for doc_path in DOCUMENT_PATHS:
-                try:
-                    if doc_path.lower().endswith(".pdf"):
-                        loader = PyPDFLoader(doc_path)
-                    elif doc_path.lower().endswith(".docx"):
-                        loader = Docx2txtLoader(doc_path)
-                    elif doc_path.lower().endswith(".txt"):
-                        loader = TextLoader(doc_path)
-                    else:
-                        st.warning(f"⏭️ Skipping unsupported file: {os.path.basename(doc_path)}")
-                        continue
-                    pages = loader.load()
-                    all_documents.extend(pages)
-                except Exception as e:
-                    st.error(f"❌ Error loading {os.path.basename(doc_path)}: {e}")
-
-            if not all_documents:
-                st.warning("⚠️ No documents loaded for RAG. Document chatbot might not work.")
-            else:
-                text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-                docs = text_splitter.split_documents(all_documents)
-                try:
-                    vectorstore = Chroma.from_documents(docs, embeddings, persist_directory=PERSIST_DIRECTORY)
-                    vectorstore.persist()
-                    st.success(f"📁 Document knowledge base saved to: {os.path.abspath(PERSIST_DIRECTORY)}")
-                except Exception as e:
-                    st.error(f"❌ Vector store creation failed: {e}")
-
         SCHEMA_GUIDE = ""
+        schema_index = None
         try:
-            with open(schema_file_path, 'r', encoding='utf-8') as f:
-                schema_yaml = yaml.safe_load(f)
-            for table in schema_yaml.get("tables", []):
-                table_name = table.get("name")
-                dimensions = table.get("dimensions", [])
-                facts = table.get("facts", [])
-                time_dimensions = table.get("time_dimensions", [])
-                all_fields = dimensions + facts + time_dimensions
-                column_names = [field.get("name") for field in all_fields if field.get("name")]
-                synonyms = []
-                for field in all_fields:
-                    synonyms.extend(field.get("synonyms", []))
-                all_keywords = sorted(set(column_names + synonyms))
-                if table_name and all_keywords:
-                    SCHEMA_GUIDE += f"\n- {table_name} (Columns: {', '.join(all_keywords)})"
+            # Compiled index from SCHEMA_ARTIFACT_PATH; the YAML is only parsed when it has changed
+            schema_index = SchemaIndex.load(schema_file_path, SCHEMA_ARTIFACT_PATH)
+            SCHEMA_GUIDE = schema_index.full_guide
         except FileNotFoundError:
             st.error(f"❌ YAML schema file not found at: {schema_file_path}. Please check path.")
             SCHEMA_GUIDE = "No schema loaded. Please check the 'schema_file_path'."
@@ -173,31 +401,274 @@ def initialize_resources():
             SCHEMA_GUIDE = "Error loading schema. Check YAML format."
 
         st.success("✅ All resources loaded successfully!")
-        return llm, embeddings, vectorstore, SCHEMA_GUIDE
+        return llm, embeddings, SCHEMA_GUIDE, schema_index
 
     except Exception as e:
         st.error(f"Initialization failed: {e}")
         st.stop()
         return None, None, None, None
 
-llm, embeddings, vectorstore, SCHEMA_GUIDE = initialize_resources()
-
-alias_map = {
-    "DIL_SUPPLIERS_D": "sup",
-    "DIL_PURCH_SCHEDULE_LINE_F": "psl",
-    "DIL_PURCH_COST_F": "pc",
-    "DIL_PURCHASE_ORDER_D": "po",
-    "DIL_SUPPLIER_SITE_D": "site",
-    "DIL_ITEMS_D": "itm",
-    "DIL_CURRENCY_D": "cur",
-    "DIL_ORG_D": "org"
-}
+llm, embeddings, SCHEMA_GUIDE, schema_index = initialize_resources()
+
+@st.cache_resource
+def initialize_document_store(_embeddings: CachedEmbeddings) -> BackgroundDocumentStore:
+    """Opens Chroma and syncs the documents on a background thread, so the first page renders without waiting for it."""
+    def open_store():
+        from langchain_community.vectorstores import Chroma
+        # Existing store is opened as-is; only new/changed document chunks are parsed and embedded
+        return Chroma(persist_directory=PERSIST_DIRECTORY, embedding_function=_embeddings)
+
+    return BackgroundDocumentStore(
+        open_store,
+        DOCUMENT_PATHS,
+        PERSIST_DIRECTORY,
+        embed_batch_size=DOC_EMBED_BATCH_SIZE,
+        max_workers=DOC_PARSE_WORKERS,
+    )
 
-reserved_keywords = {
-    "select", "from", "where", "group", "order", "limit",
-    "join", "union", "on", "inner", "outer", "as", "and", "or",
-    "left", "right", "full", "by", "asc", "desc", "count", "sum", "avg", "min", "max"
-}
+document_store = initialize_document_store(embeddings)
+
+@st.cache_resource
+def initialize_sql_cache(_embeddings: VertexAIEmbeddings) -> SQLQueryCache | None:
+    """Question -> SQL cache shared by all sessions; it is emptied whenever the schema YAML changes."""
+    try:
+        return SQLQueryCache(
+            os.path.join(CACHE_DIRECTORY, "sql_cache.sqlite3"),
+            schema_hash=file_sha256(schema_file_path),
+            embed_fn=_embeddings.embed_query if _embeddings is not None else None,
+            similarity_threshold=SQL_CACHE_SIMILARITY_THRESHOLD,
+            max_entries=SQL_CACHE_MAX_ENTRIES,
+        )
+    except Exception as e:
+        st.warning(f"⚠️ SQL cache disabled: {e}")
+        return None
+
+sql_cache = initialize_sql_cache(embeddings)
+
+@st.cache_resource
+def initialize_result_cache() -> QueryResultCache | None:
+    """BigQuery result cache shared by all sessions (in-memory LRU + Parquet files on disk)."""
+    try:
+        return QueryResultCache(
+            os.path.join(CACHE_DIRECTORY, "results"),
+            memory_cap_bytes=RESULT_CACHE_MEMORY_MB * 1024 * 1024,
+            disk_cap_bytes=RESULT_CACHE_DISK_MB * 1024 * 1024,
+            fact_ttl=RESULT_CACHE_FACT_TTL_SECONDS,
+            dimension_ttl=RESULT_CACHE_DIMENSION_TTL_SECONDS,
+            table_ttls=RESULT_CACHE_TABLE_TTLS,
+        )
+    except Exception as e:
+        st.warning(f"⚠️ Result cache disabled: {e}")
+        return None
+
+result_cache = initialize_result_cache()
+
+@st.cache_resource
+def initialize_sql_validator(_schema_index: SchemaIndex | None) -> SQLValidator | None:
+    return SQLValidator(_schema_index) if _schema_index is not None else None
+
+sql_validator = initialize_sql_validator(schema_index)
+
+@st.cache_resource
+def initialize_plot_cache() -> RenderedPlotCache:
+    return RenderedPlotCache(memory_cap_bytes=PLOT_CACHE_MEMORY_MB * 1024 * 1024)
+
+plot_cache = initialize_plot_cache()
+
+@st.cache_resource
+def initialize_result_compactor(_schema_index: SchemaIndex | None) -> ResultCompactor | None:
+    """Column types from the schema YAML, used to parse DATE columns once when a result is fetched."""
+    if not RESULT_COMPACT_ENABLED:
+        return None
+    return ResultCompactor.from_schema_index(_schema_index, category_max_ratio=RESULT_CATEGORY_MAX_RATIO)
+
+result_compactor = initialize_result_compactor(schema_index)
+
+@st.cache_resource
+def initialize_answer_service() -> AnswerService | None:
+    """Worker pool shared by every session; the sessions submit questions and stream the events back."""
+    if not ANSWER_SERVICE_ENABLED:
+        return None
+    return AnswerService(max_concurrency=ANSWER_SERVICE_WORKERS, max_queued=ANSWER_SERVICE_MAX_QUEUED)
+
+answer_service = initialize_answer_service()
+
+@st.cache_resource
+def initialize_sql_flight() -> SingleFlight | None:
+    return SingleFlight() if SQL_SINGLE_FLIGHT_ENABLED else None
+
+sql_flight = initialize_sql_flight()
+
+@st.cache_resource
+def initialize_sql_candidates() -> SpeculativeSQL | None:
+    if SQL_CANDIDATES <= 1:
+        return None
+    hints = SQL_CANDIDATE_HINTS[:SQL_CANDIDATES]
+    return SpeculativeSQL(hints, hedge_after_seconds=SQL_CANDIDATE_HEDGE_SECONDS, max_workers=ANSWER_SERVICE_WORKERS * len(hints))
+
+sql_candidates = initialize_sql_candidates()
+
+@st.cache_resource
+def initialize_query_backend(_credentials) -> QueryBackend:
+    """One BigQuery client (with a pooled HTTP session) and Storage Read client shared by every session."""
+    if QUERY_BACKEND == "sqlite":
+        return SQLiteBackend(LOCAL_QUERY_DB_PATH)
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+
+    from google.cloud import bigquery
+
+    http_session = AuthorizedSession(_credentials)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=BQ_HTTP_POOL_SIZE, pool_maxsize=BQ_HTTP_POOL_SIZE)
+    http_session.mount("https://", adapter)
+    bq_client = bigquery.Client(credentials=_credentials, project=PROJECT_ID, _http=http_session)
+    try:
+        from google.cloud import bigquery_storage
+        storage_client = bigquery_storage.BigQueryReadClient(credentials=_credentials)
+    except Exception as e:
+        st.warning(f"⚠️ BigQuery Storage Read API unavailable, large results will download over REST: {e}")
+        storage_client = None
+    return BigQueryBackend(bq_client, storage_client, small_result_rows=BQ_SMALL_RESULT_ROWS, limiter=upstream_limiters["bigquery"])
+
+query_backend = initialize_query_backend(credentials)
+
+@st.cache_resource
+def initialize_dimension_replica(_query_backend: QueryBackend, _schema_index: SchemaIndex | None) -> DimensionReplica | None:
+    """DuckDB copy of the dimension tables, re-synced from BigQuery in a background thread."""
+    if not DIMENSION_REPLICA_ENABLED or not isinstance(_query_backend, BigQueryBackend) or _schema_index is None:
+        return None
+    tables = DIMENSION_REPLICA_TABLES or [name for name in _schema_index.tables if name.upper().endswith("_D")]
+    try:
+        replica = DimensionReplica(
+            DIMENSION_REPLICA_PATH,
+            _query_backend,
+            PROJECT_ID,
+            DATASET_ID,
+            tables,
+            max_rows=DIMENSION_REPLICA_MAX_ROWS,
+            max_staleness_seconds=DIMENSION_REPLICA_MAX_STALENESS_SECONDS,
+        )
+    except Exception as e:
+        st.warning(f"⚠️ Dimension replica disabled, every query goes to BigQuery: {e}")
+        return None
+    replica.start(DIMENSION_REPLICA_REFRESH_SECONDS)
+    return replica
+
+dimension_replica = initialize_dimension_replica(query_backend, schema_index)
+
+@st.cache_resource
+def initialize_rollups(_query_backend: QueryBackend, _schema_index: SchemaIndex | None, _result_cache: QueryResultCache | None) -> RollupRouter | None:
+    """Rollup tables from the catalog, refreshed in a background thread, and the router that reads them."""
+    if not ROLLUPS_ENABLED or _schema_index is None:
+        return None
+    try:
+        definitions, refresh = load_rollup_catalog(ROLLUP_CATALOG_PATH, _schema_index.column_types)
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        refresher = RollupRefresher(
+            definitions,
+            _query_backend,
+            _schema_index.column_types,
+            PROJECT_ID,
+            DATASET_ID,
+            ROLLUP_DATASET_ID,
+            ROLLUP_STATE_PATH,
+            full_refresh_seconds=refresh.get("full_refresh_seconds", 24 * 60 * 60),
+            max_staleness_seconds=refresh.get("max_staleness_seconds", 60 * 60),
+        )
+    except Exception as e:
+        st.warning(f"⚠️ KPI rollups disabled, every query reads the fact tables: {e}")
+        return None
+    interval_seconds = refresh.get("interval_seconds", 15 * 60)
+    if _result_cache is not None:
+        register_rollup_ttls(_result_cache, definitions, interval_seconds)
+    refresher.start(interval_seconds)
+    return RollupRouter(refresher)
+
+rollup_router = initialize_rollups(query_backend, schema_index, result_cache)
+
+@st.cache_resource
+def initialize_join_planner(_schema_index: SchemaIndex | None) -> JoinPlanner | None:
+    """Join graph over the schema YAML relationships: planned JOINs for the prompt, checked JOINs for the generated SQL."""
+    if not JOIN_PLANNER_ENABLED or _schema_index is None:
+        return None
+    try:
+        return JoinPlanner(_schema_index, PROJECT_ID, DATASET_ID)
+    except Exception as e:
+        st.warning(f"⚠️ Join planner disabled, generated joins will not be checked: {e}")
+        return None
+
+join_planner = initialize_join_planner(schema_index)
+
+@st.cache_resource
+def initialize_intent_router(_schema_index: SchemaIndex | None, _vectorstore: Chroma | None) -> IntentRouter | None:
+    """Router vocabularies: schema column names/synonyms vs. the words of the document chunks."""
+    if not INTENT_ROUTING_ENABLED or _schema_index is None or _vectorstore is None:
+        return None
+    try:
+        document_texts = _vectorstore.get(include=["documents"])["documents"]
+    except Exception as e:
+        st.warning(f"⚠️ Intent routing disabled, both answer paths will run for every question: {e}")
+        return None
+    return IntentRouter(
+        _schema_index,
+        document_texts,
+        min_score=INTENT_ROUTER_MIN_SCORE,
+        max_other_score=INTENT_ROUTER_MAX_OTHER_SCORE,
+    )
+
+def document_resources() -> tuple[Chroma | None, KeyQuestionIndex, IntentRouter | None]:
+    """Vector store, key-question index and intent router; None / empty until the background document load finishes."""
+    if not document_store.ready:
+        return None, document_store.key_question_index, None
+    return document_store.vectorstore, document_store.key_question_index, initialize_intent_router(schema_index, document_store.vectorstore)
+
+vectorstore, key_question_index, intent_router = document_resources()
+
+# --- Query execution (through the result cache) ---
+def run_bigquery(sql_query: str, bypass_cache: bool = False) -> pd.DataFrame:
+    """Runs the query on BigQuery unless an unexpired result for the same canonical SQL is cached."""
+    with tracing.span("query.execute", backend=query_backend.name) as span:
+        if result_cache is not None:
+            if bypass_cache:
+                result_cache.record_bypass()
+            else:
+                cached_df = result_cache.get(sql_query)
+                if cached_df is not None:
+                    span.set(cache_hit=True, rows=len(cached_df))
+                    return cached_df
+        if sql_flight is None:
+            return _run_uncached(sql_query, span)
+        # The same SQL already executing for another question or session is waited for instead of run twice
+        df, shared = sql_flight.do(canonicalize_sql(sql_query), lambda: _run_uncached(sql_query, span))
+        span.set(coalesced=shared)
+        return df.copy() if shared else df
+
+def _run_uncached(sql_query: str, span) -> pd.DataFrame:
+    # Queries reading only fresh replicated dimension tables are answered locally; BigQuery stays the fallback
+    if dimension_replica is not None and dimension_replica.covers(sql_query):
+        try:
+            df = dimension_replica.run(sql_query)
+        except Exception as e:
+            dimension_replica.record_fallback()
+            span.set(replica_error=str(e)[:200])
+        else:
+            span.set(cache_hit=False, backend=dimension_replica.name, rows=len(df))
+            return result_compactor.compact(df) if result_compactor is not None else df
+    df = query_backend.run(sql_query)
+    span.set(cache_hit=False, rows=len(df))
+    # Compact dtypes once here, so the result cache, the chat history and every chart share the small frame
+    if result_compactor is not None:
+        df = result_compactor.compact(df)
+    if result_cache is not None:
+        result_cache.put(sql_query, df)
+    return df
+
+sql_rewriter = SQLAliasRewriter(schema_index, alias_map, PROJECT_ID, DATASET_ID, reserved_keywords)
+
+# --- SQL Aliasing and Formatting ---
+def apply_table_aliases(sql_query: str) -> str:
+    """Qualifies table names with PROJECT_ID.DATASET_ID and applies alias_map aliases to tables and columns."""
+    return sql_rewriter.rewrite(sql_query)
 
 # --- auto_cast_fix function ---
 def auto_cast_fix(sql_query, error_msg):
@@ -235,18 +706,104 @@ def auto_cast_fix(sql_query, error_msg):
     return sql_query
 
 # --- Helper to save plots to bytes ---
-def _save_plot_to_bytes(fig: plt.Figure) -> BytesIO:
+def _save_plot_to_bytes(fig: plt.Figure, profile: str = "full") -> BytesIO:
+    import matplotlib.pyplot as plt
+
     buf = BytesIO()
-    fig.savefig(buf, format="png", bbox_inches='tight', pad_inches=0.1, dpi=300) # Increased DPI for better quality
+    render = PLOT_RENDER_PROFILES[profile]
+    # The tight-bbox pass re-draws the figure to measure it, so the preview profile skips it (tight_layout already ran)
+    if render["bbox_inches"]:
+        fig.savefig(buf, format="png", bbox_inches=render["bbox_inches"], pad_inches=0.1, dpi=render["dpi"])
+    else:
+        fig.savefig(buf, format="png", dpi=render["dpi"])
     buf.seek(0)
     plt.close(fig)
     return buf
 
-# --- generate_plot_from_df (Revised for readability) ---
-def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type: str, title: str = "Visualization") -> BytesIO | None:
-    # Configurable limits for plot categories
-    MAX_PIE_SLICES = 10  # Max slices before grouping into 'Others' for pie charts
-    MAX_BAR_CATEGORIES = 15 # Max categories to display on bar chart before considering truncation (less aggressive than pie)
+# --- Row-capped execution and chart aggregation pushdown ---
+def run_capped_query(sql_query: str, bypass_cache: bool = False, row_limit: int = RESULT_ROW_CAP) -> pd.DataFrame:
+    """Fetches at most `row_limit` rows; df.attrs records the uncapped SQL and whether rows were left behind.
+
+    A query a KPI rollup can answer exactly is rewritten to read the rollup; if that fails it runs on the fact table.
+    """
+    df = None
+    if rollup_router is not None:
+        with tracing.span("rollup.route") as span:
+            routed_sql, rollup_name = rollup_router.rewrite(sql_query)
+            span.set(rollup=rollup_name)
+        if rollup_name is not None:
+            try:
+                df = run_bigquery(cap_rows(routed_sql, row_limit + 1), bypass_cache=bypass_cache)
+                sql_query = routed_sql  # chart aggregation pushdown reads the rollup too
+            except Exception as e:
+                logging.getLogger(__name__).warning("Rollup %s query failed, reading the fact table: %s", rollup_name, e)
+                rollup_router.record_fallback()
+    if df is None:
+        df = run_bigquery(cap_rows(sql_query, row_limit + 1), bypass_cache=bypass_cache)  # +1 row tells us it was cut
+    truncated = len(df) > row_limit
+    if truncated:
+        df = drop_unused_categories(df.iloc[:row_limit])
+    df.attrs.update({"source_sql": sql_query, "row_limit": row_limit, "truncated": truncated, "bypass_cache": bypass_cache})
+    return df
+
+def chart_frame(df: pd.DataFrame, x_col: str, y_col: str | None, chart_type: str) -> tuple[pd.DataFrame, str | None, str]:
+    """Returns (frame, y_col, chart_type) to draw. For a capped result the grouping / top-N / Others folding
+    runs in BigQuery over all rows; the pandas code in _render_plot_from_df then has nothing left to fold."""
+    if not df.attrs.get("truncated") or x_col not in df.columns:
+        return df, y_col, chart_type
+    if y_col and (y_col not in df.columns or not pd.api.types.is_numeric_dtype(df[y_col])):
+        y_col = None
+    top_n = PLOT_MAX_PIE_SLICES - 1 if chart_type == "pie" else PLOT_MAX_BAR_CATEGORIES  # the counts _fold_others keeps
+    aggregate_sql = chart_aggregate_sql(df.attrs["source_sql"], x_col, y_col, chart_type, top_n)
+    if aggregate_sql is None:
+        return df, y_col, chart_type  # scatter / histogram draw from the capped rows
+    try:
+        aggregated = run_bigquery(aggregate_sql, bypass_cache=df.attrs.get("bypass_cache", False))
+    except Exception:
+        return df, y_col, chart_type
+    if chart_type == "countplot":
+        return aggregated, "Count", "bar"  # already counted, so draw the counts as bars
+    return aggregated, y_col, chart_type
+
+def plot_result(df: pd.DataFrame, x_col: str, y_col: str | None, chart_type: str, title: str = "Visualization", profile: str = "preview") -> BytesIO | None:
+    frame, y_col, chart_type = chart_frame(df, x_col, y_col, chart_type)
+    return generate_plot_from_df(frame, x_col, y_col, chart_type, title=title, profile=profile)
+
+# --- generate_plot_from_df (cached; renders through _render_plot_from_df on a miss) ---
+def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type: str, title: str = "Visualization", profile: str = "preview") -> BytesIO | None:
+    """Returns the chart as PNG, reusing an earlier render of the same data, columns, chart type, title and profile."""
+    with tracing.span("plot", chart_type=chart_type, rows=len(df)) as span:
+        # Only the plotted columns decide the chart; hashing the other columns of a wide result is wasted work
+        plotted = list(dict.fromkeys(c for c in [x_col, y_col] if c and c in df.columns))
+        key = (dataframe_fingerprint(df[plotted]), x_col, y_col, chart_type, title, profile)
+        found, png_bytes = plot_cache.get(key)
+        span.set(cache_hit=found)
+        if not found:
+            started = time.perf_counter()
+            buf = _render_plot_from_df(df, x_col, y_col, chart_type, title, profile)
+            png_bytes = buf.getvalue() if buf is not None else None
+            if png_bytes is not None:
+                plot_cache.put(key, png_bytes, time.perf_counter() - started)
+    return BytesIO(png_bytes) if png_bytes is not None else None
+
+def _fold_others(df_sorted: pd.DataFrame, x_col: str, value_col: str, keep: int) -> pd.DataFrame:
+    """Keeps the first `keep` categories of a frame sorted by value and sums the rest into one trailing 'Others'
+    row. An 'Others' row chart_frame's pushdown already folded is added to it rather than ranked as a category,
+    so a capped result draws the same chart as the full one."""
+    is_others = df_sorted[x_col].astype(str) == 'Others'
+    named = df_sorted[~is_others]
+    other_sum = df_sorted.loc[is_others, value_col].sum() + named.iloc[keep:][value_col].sum()
+    df_display = named.head(keep)
+    if other_sum > 0:
+        df_display = pd.concat([df_display, pd.DataFrame({x_col: ['Others'], value_col: [other_sum]})])
+    return df_display
+
+def _render_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type: str, title: str = "Visualization", profile: str = "preview") -> BytesIO | None:
+    import matplotlib.pyplot as plt  # first plot pays the import (prewarmed on the login page)
+    import seaborn as sns
+
+    MAX_PIE_SLICES = PLOT_MAX_PIE_SLICES
+    MAX_BAR_CATEGORIES = PLOT_MAX_BAR_CATEGORIES
 
     if df.empty or x_col not in df.columns:
         return None
@@ -258,30 +815,31 @@ def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type:
     plot_generated = False
 
     try:
-        # Convert date-like columns for better plotting if needed
-        cols_to_check = [c for c in [x_col, y_col] if c and c in df.columns]
+        # Only the plotted columns are kept, so nothing below (sort_values, groupby) touches the rest of a wide
+        # result. ISO dates were parsed at fetch time; other text in date-like columns ('2024-01', object, Arrow
+        # string or categorical) is parsed here.
+        cols_to_check = list(dict.fromkeys(c for c in [x_col, y_col] if c and c in df.columns))
+        df = df[cols_to_check]
+        parsed = {}
         for col in cols_to_check:
-            if any(k in col.lower() for k in ['date', 'time', 'month', 'year', 'dt']):
+            if any(k in col.lower() for k in ['date', 'time', 'month', 'year', 'dt']) and is_label_column(df[col]) and not pd.api.types.is_numeric_dtype(df[col]):
                 try:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
+                    parsed[col] = pd.to_datetime(df[col], errors='coerce')
                 except Exception:
                     pass # Ignore if conversion fails
+        if parsed:
+            df = df.assign(**parsed)
 
         if chart_type == 'bar':
             if y_col and pd.api.types.is_numeric_dtype(df[y_col]):
-                df_grouped = df.groupby(x_col)[y_col].sum().reset_index()
+                df_grouped = df.groupby(x_col, observed=True)[y_col].sum().reset_index()
                 df_sorted = df_grouped.sort_values(by=y_col, ascending=False)
 
                 # Handle too many categories for bar chart
-                if len(df_sorted) > MAX_BAR_CATEGORIES:
-                    df_display = df_sorted.head(MAX_BAR_CATEGORIES)
-                    other_sum = df_sorted.iloc[MAX_BAR_CATEGORIES:][y_col].sum()
-                    if other_sum > 0:
-                        df_display = pd.concat([df_display, pd.DataFrame({x_col: ['Others'], y_col: [other_sum]})])
-                else:
-                    df_display = df_sorted
+                df_display = _fold_others(df_sorted, x_col, y_col, MAX_BAR_CATEGORIES)
 
-                sns.barplot(x=df_display[x_col], y=df_display[y_col], ax=ax)
+                # As text, so bars keep the sorted order and a categorical x does not bring its unused categories
+                sns.barplot(x=df_display[x_col].astype(str), y=df_display[y_col], ax=ax)
                 ax.set_ylabel(y_col.replace('_', ' ').title())
                 plot_generated = True
             elif pd.api.types.is_numeric_dtype(df[x_col]) and not y_col:
@@ -298,7 +856,7 @@ def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type:
                 else:
                     df_display = df_counts_sorted
 
-                sns.barplot(x=df_display[x_col], y=df_display['Count'], ax=ax)
+                sns.barplot(x=df_display[x_col].astype(str), y=df_display['Count'], ax=ax)
                 ax.set_ylabel('Count')
                 plot_generated = True
 
@@ -315,24 +873,14 @@ def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type:
                 plot_generated = True
         elif chart_type == 'pie' and y_col: # Pie chart uses x_col for labels, y_col for values
             if pd.api.types.is_numeric_dtype(df[y_col]) and (df[y_col] >= 0).all():
-                pie_data = df.groupby(x_col)[y_col].sum().reset_index()
+                pie_data = df.groupby(x_col, observed=True)[y_col].sum().reset_index()
                 pie_data = pie_data.sort_values(by=y_col, ascending=False) # Sort for consistent "Others" grouping
 
-                # Implement "Top N + Others" for pie charts
-                if len(pie_data) > MAX_PIE_SLICES:
-                    top_n_data = pie_data.head(MAX_PIE_SLICES - 1) # One slice reserved for 'Others'
-                    other_sum = pie_data.iloc[MAX_PIE_SLICES - 1:][y_col].sum()
-                    
-                    if other_sum > 0:
-                        labels = top_n_data[x_col].tolist() + ['Others']
-                        sizes = top_n_data[y_col].tolist() + [other_sum]
-                    else: # If sum of others is 0, just use top_n_data
-                        labels = top_n_data[x_col].tolist()
-                        sizes = top_n_data[y_col].tolist()
-                else:
-                    labels = pie_data[x_col]
-                    sizes = pie_data[y_col]
-                    
+                # Implement "Top N + Others" for pie charts, one slice reserved for 'Others'
+                pie_data = _fold_others(pie_data, x_col, y_col, MAX_PIE_SLICES - 1)
+                labels = pie_data[x_col].astype(str).tolist()
+                sizes = pie_data[y_col].tolist()
+
                 # Check if all sizes are zero to prevent error
                 if sum(sizes) == 0:
                     plt.close(fig)
@@ -352,7 +900,7 @@ def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type:
                 ax.set_ylabel('Frequency')
                 plot_generated = True
         elif chart_type == 'countplot': # Count plots only need one categorical column (x_col)
-            if pd.api.types.is_object_dtype(df[x_col]) or pd.api.types.is_categorical_dtype(df[x_col]):
+            if is_label_column(df[x_col]):
                 df_counts = df[x_col].value_counts().reset_index()
                 df_counts.columns = [x_col, 'Count']
                 df_counts_sorted = df_counts.sort_values(by='Count', ascending=False)
@@ -374,24 +922,58 @@ def generate_plot_from_df(df: pd.DataFrame, x_col: str, y_col: str, chart_type:
             ax.set_title(title, fontsize=14)
             ax.set_xlabel(x_col.replace('_', ' ').title(), fontsize=12)
             # Rotate X-axis labels for better readability, but only if they are not dates or numbers already handled by seaborn
-            if chart_type in ['bar', 'countplot'] and (pd.api.types.is_object_dtype(df[x_col]) or pd.api.types.is_categorical_dtype(df[x_col])):
+            if chart_type in ['bar', 'countplot'] and is_label_column(df[x_col]):
                 plt.xticks(rotation=45, ha='right', fontsize=10)
             else:
                 plt.xticks(fontsize=10) # Keep default rotation for numeric/datetime if not bar/countplot
             plt.yticks(fontsize=10) # Set fontsize for y-ticks too
             plt.tight_layout()
-            return _save_plot_to_bytes(fig)
+            return _save_plot_to_bytes(fig, profile)
         else:
             plt.close(fig)
             return None
 
     except Exception as e:
         plt.close(fig)
-        st.error(f"Error generating plot: {e}") # Log error to Streamlit
+        logging.getLogger(__name__).warning("Error generating plot: %s", e)
+        st.error(f"Error generating plot: {e}") # Log error to Streamlit (no-op on answer service workers)
         return None
 
+# --- Cooperative cancellation for answer paths ---
+PATH_CANCELLED_TEXT = "This step was cancelled because it exceeded its time limit."
+
+@dataclass
+class AnswerEvent:
+    """One step of an answer as it happens: path is "database", "document" or "pipeline".
+
+    Progress kinds: doc_token, sql, rows (first page), plot (PNG bytes). Each path then ends with
+    done (payload = the path's return value) or timeout; the pipeline sends route (and queued while the
+    question waits for an answer service worker) and ends with response.
+    """
+    path: str
+    kind: str
+    payload: object = None
+
+def _emit(emit, kind: str, payload):
+    if emit is not None:
+        emit(kind, payload)
+
+def _path_cancelled(cancel_event: threading.Event | None) -> bool:
+    # Worker threads ko force-kill nahi kar sakte, isliye har mehenga step (BigQuery job, LLM retry)
+    # shuru karne se pehle ye flag check hota hai.
+    return cancel_event is not None and cancel_event.is_set()
+
 # --- get_document_answer function ---
-def get_document_answer(question: str, vectorstore: Chroma, llm: ChatVertexAI) -> str:
+def get_document_answer(question: str, vectorstore: Chroma, llm: ChatVertexAI, cancel_event: threading.Event | None = None, emit=None, key_question_index: KeyQuestionIndex | None = None) -> str:
+    # A question that is one of the reports' "Key Questions Answered" is answered from the table row directly
+    if key_question_index is not None:
+        with tracing.span("key_question.lookup") as span:
+            direct_answer = key_question_index.answer(question, KEY_QUESTION_MIN_CONFIDENCE)
+            span.set(cache_hit=bool(direct_answer))
+        if direct_answer:
+            _emit(emit, "doc_token", direct_answer)
+            return direct_answer
+
     if not vectorstore:
         return "Sorry, the document knowledge base is not set up correctly."
 
@@ -415,36 +997,153 @@ def get_document_answer(question: str, vectorstore: Chroma, llm: ChatVertexAI) -
     QA_CHAIN_PROMPT = PromptTemplate.from_template(qa_prompt_template)
 
     try:
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
-        document_qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=False,
-            chain_type_kwargs={"prompt": QA_CHAIN_PROMPT}
-        )
-        result = document_qa_chain.invoke({"query": question})
-        return result["result"]
+        # Same as RetrievalQA "stuff" chain (top-5 chunks joined into the prompt), but the answer is
+        # streamed so each token can be shown in the chat bubble as it arrives.
+        with tracing.span("rag.retrieve") as span:
+            retriever = vectorstore.as_retriever(search_kwargs={"k": 5})
+            source_docs = retriever.invoke(question)
+            span.set(rows=len(source_docs))
+        if _path_cancelled(cancel_event):
+            return PATH_CANCELLED_TEXT
+        prompt_text = QA_CHAIN_PROMPT.format(context="\n\n".join(doc.page_content for doc in source_docs), question=question)
+        answer_parts = []
+        with tracing.span("llm.answer") as span:
+            started = time.perf_counter()
+            streamed = None  # chunks added together carry the summed usage_metadata
+            for chunk in llm.stream(prompt_text):
+                streamed = chunk if streamed is None else streamed + chunk
+                if _path_cancelled(cancel_event):
+                    return "".join(answer_parts) + f"\n\n{PATH_CANCELLED_TEXT}"
+                if chunk.content:
+                    if not answer_parts:
+                        span.set(first_token_ms=round(1000 * (time.perf_counter() - started), 1))
+                    answer_parts.append(chunk.content)
+                    _emit(emit, "doc_token", chunk.content)
+            span.set(**tracing.token_usage(streamed))
+        return "".join(answer_parts)
     except Exception as e:
         return f"Error from document chatbot: {e}"
 
+# --- SQL generation: one prompt -> aliased, JOIN-checked, validated SQL ---
+def generate_sql(llm: ChatVertexAI, prompt_text: str, sql_validator: SQLValidator | None = None) -> tuple[str, object] | None:
+    """(SQL, validation) for one SQL prompt: aliased, JOIN-checked and validated. None if Gemini says the data is not available."""
+    with tracing.span("llm.sql") as span:
+        llm_response = llm.invoke(prompt_text)
+        span.set(**tracing.token_usage(llm_response))
+    sql_query = llm_response.content.strip()
+
+    # Clean up unwanted markdown code blocks
+    if "```" in sql_query:
+        sql_query = sql_query.split("```")[1].replace("sql", "").strip()
+
+    if "sorry" in sql_query.lower() or "not available" in sql_query.lower():
+        return None
+
+    validation = None
+    with tracing.span("sql.rewrite") as span:
+        sql_query = apply_table_aliases(sql_query)
+
+        # Put JOIN ... ON conditions back on the declared key columns (e.g. the right role of DIL_COMMON_DT_D)
+        if join_planner is not None:
+            join_check = join_planner.verify(sql_query)
+            sql_query = join_check.sql
+            span.set(joins_fixed=len(join_check.fixes), unplanned_joins=len(join_check.problems))
+
+        # Check names and types against the schema YAML and insert CASTs before the first BigQuery job
+        if sql_validator is not None:
+            validation = sql_validator.validate(sql_query)
+            sql_query = validation.sql
+            span.set(casts_added=len(validation.fixes), unknown_names=len(validation.errors))
+    return sql_query, validation
+
+def check_sql_candidate(index: int, generated: tuple[str, object] | None) -> tuple[str, object] | None:
+    """Accepts a speculative candidate that passes validation and (SQL_CANDIDATE_DRY_RUN) a dry run; raises otherwise."""
+    if generated is None:
+        if index == 0:
+            return None  # the unchanged prompt says the data is not available: that is the answer
+        raise ValueError("This prompt variant found no answer in the schema.")
+    sql_query, validation = generated
+    if validation is not None and validation.errors and SQL_VALIDATOR_BLOCK_UNKNOWN_NAMES:
+        raise SQLValidationError("Schema validation failed before execution: " + " ".join(validation.errors))
+    if SQL_CANDIDATE_DRY_RUN:
+        with tracing.span("query.dry_run") as span:
+            span.set(bytes_processed=query_backend.dry_run_bytes(sql_query))
+    return generated
+
+# --- Default chart and response text of a database answer ---
+def default_chart(df: pd.DataFrame) -> tuple[str | None, str | None, str | None]:
+    """(x, y, chart type) drawn for a database answer: a date or label against the first number, else one column."""
+    numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
+    object_cols = label_columns(df)
+    datetime_cols = df.select_dtypes(include=['datetime64', 'datetime64[ns]']).columns.tolist()
+    if len(datetime_cols) > 0 and len(numeric_cols) > 0:
+        return datetime_cols[0], numeric_cols[0], 'line'
+    if len(object_cols) > 0 and len(numeric_cols) > 0:
+        return object_cols[0], numeric_cols[0], 'bar'
+    if len(numeric_cols) > 0:
+        return numeric_cols[0], None, 'histogram'
+    if len(object_cols) > 0:
+        return object_cols[0], None, 'countplot'
+    return None, None, None
+
+def present_database_result(question: str, df: pd.DataFrame, emit=None, fixed_by: str | None = None) -> tuple[str, BytesIO | None]:
+    """Streams the rows and default chart of a non-empty result and returns (response text, plot).
+
+    `fixed_by` ("auto-fixed" / "Gemini-fixed") marks an answer that came from a retried query."""
+    _emit(emit, "rows", df.head(STREAM_PREVIEW_ROWS))
+
+    # Default plot generation logic (used for chat history)
+    plot_bytes = None
+    default_x, default_y, default_chart_type = default_chart(df)
+    if default_x and default_chart_type:
+        title = question if fixed_by is None else f"{question} ({fixed_by.title()})"
+        plot_bytes = plot_result(df, default_x, default_y, default_chart_type, title=title)
+        if plot_bytes is not None:
+            _emit(emit, "plot", plot_bytes.getvalue())
+
+    suffix = "" if fixed_by is None else f" ({fixed_by})"
+    if len(df.columns) == 1 and len(df) == 1:
+        subject = question.lower().replace('what is the ', '').replace('show me the ', '').replace('tell me the ', '')
+        return f"The {subject} is: **{df.iloc[0, 0]}**{suffix}", plot_bytes
+    if fixed_by is None:
+        return "Here are the key insights from the database:\n", plot_bytes
+    return f"Here are the results from the database{suffix}:\n", plot_bytes
+
 # --- get_database_answer function (Modified to return data, plot_bytes, and query string) ---
-def get_database_answer(question: str, llm: ChatVertexAI, schema_guide: str) -> tuple[str, pd.DataFrame | None, BytesIO | None, str | None]:
+def get_database_answer(question: str, llm: ChatVertexAI, schema_guide: str, schema_index: SchemaIndex | None = None, sql_cache: SQLQueryCache | None = None, bypass_result_cache: bool = False, sql_validator: SQLValidator | None = None, cancel_event: threading.Event | None = None, emit=None) -> tuple[str, pd.DataFrame | None, BytesIO | None, str | None]:
     sql_query = ""
+    validation = None
     df = None
     plot_bytes = None
     database_response_text = ""
     generated_sql_display = None
 
+    # Exact or near-identical questions answered before skip the SQL-generation LLM call
+    cached_sql, question_embedding = None, None
+    if sql_cache is not None:
+        with tracing.span("sql_cache.lookup") as span:
+            cached_sql, question_embedding = sql_cache.lookup(question)
+            span.set(cache_hit=bool(cached_sql))
+
+    # Send only the slice of the schema relevant to this question (full guide if nothing matched)
+    join_guide = ""
+    if schema_index is not None and not cached_sql:
+        with tracing.span("schema.prune") as span:
+            schema_guide, pruned_tables = schema_index.prune_guide(question, SCHEMA_PRUNE_TOP_K)
+            # The exact JOIN ... ON conditions between the selected tables, from the declared relationships
+            if join_planner is not None and pruned_tables:
+                join_guide = join_planner.prompt_section(question, pruned_tables)
+                span.set(tables=len(pruned_tables), join_guide=bool(join_guide))
+
     sql_prompt = PromptTemplate(
-        input_variables=["question"],
+        input_variables=["question", "extra_rules"],
         template=f"""
 You are an expert BigQuery SQL generator specifically for procurement data.
 Your goal is to translate user questions into valid and efficient BigQuery SQL queries.
 
 Here are the available tables and their relevant columns from the procurement domain:
 {schema_guide}
-
+{join_guide}
 ⚠️ Strict Rules for SQL Generation:
 - **Always use fully qualified table names in the `FROM` and `JOIN` clauses, e.g., `project.dataset.table`.** The system will handle aliasing automatically.
 - **Do NOT assign aliases yourself (e.g., `FROM table AS alias`).** The system will handle aliases.
@@ -459,7 +1158,7 @@ Here are the available tables and their relevant columns from the procurement do
 please always make the string comparison case-insensitive using UPPER(column) = 'value'.
 - Generate a BigQuery SQL that compares text values in a case-insensitive way when using the WHERE clause.
 - dil_approval_status_d.DESCRIPTION column has data like - "Document has been Approved" and "Document has been Cancelled" dont use upper case for it
-User Question: {{question}}
+{{extra_rules}}User Question: {{question}}
 """
     )
 
@@ -529,191 +1228,134 @@ Error Message:
     )
 
     try:
-        prompt_text = sql_prompt.format(question=question)
-        sql_query = llm.invoke(prompt_text).content.strip()
-
-        # Clean up unwanted markdown code blocks
-        if "```" in sql_query:
-            sql_query = sql_query.split("```")[1].replace("sql", "").strip()
-
-        if "sorry" in sql_query.lower() or "not available" in sql_query.lower():
-            database_response_text = "Sorry, I don't have enough data in the database to answer that specifically."
-            return database_response_text, df, plot_bytes, None
-
-        # --- SQL Aliasing and Formatting ---
-        # 1. Remove any aliases LLM might have added initially (e.g., table AS alias)
-        sql_query = re.sub(
-            r'\b((?:\w+\.)?\w+)\s+AS\s+(\w+)(?=\s|,|$)',
-            lambda m: m.group(1), # Keep only the table name
-            sql_query,
-            flags=re.IGNORECASE
-        )
-
-        final_table_aliases = {}
-        # Pattern to find FROM/JOIN clauses and extract table name and potential alias
-        table_alias_extraction_pattern = re.compile(
-            r'(FROM|INNER\s+JOIN|LEFT\s+JOIN|RIGHT\s+JOIN|FULL\s+JOIN|JOIN)\s+(`?[\w.]+`?)\s*(?:AS\s+)?(\w+)?(?=\s|$)',
-            re.IGNORECASE
-        )
-
-        # First pass: Identify base table names and assign aliases
-        for match in table_alias_extraction_pattern.finditer(sql_query):
-            raw_table_name = match.group(2).strip('`')
-            base_table_name = raw_table_name.split('.')[-1]
-            default_alias = alias_map.get(base_table_name, base_table_name.lower())
-            if default_alias in reserved_keywords: # Prevent alias being a reserved keyword
-                default_alias += "_t"
-            final_table_aliases[base_table_name] = default_alias
-        
-        # Second pass: Replace full table paths with aliases
-        def replace_table_with_alias(match):
-            raw_table_name = match.group(2).strip('`')
-            base_table_name = raw_table_name.split('.')[-1]
-            full_table_path = f"{PROJECT_ID}.{DATASET_ID}.{base_table_name}"
-            alias = final_table_aliases[base_table_name]
-            return f"{match.group(1)} `{full_table_path}` {alias}"
-
-        sql_query = table_alias_extraction_pattern.sub(replace_table_with_alias, sql_query)
-
-        # Third pass: Prepend aliases to column names
-        # This pattern looks for column names (word characters) optionally preceded by a dot
-        # that are NOT already preceded by an alias or full table path
-        for base_table_name, alias in final_table_aliases.items():
-            # This regex needs to be more careful to only prepend aliases where necessary
-            # It targets column names that are not already aliased (e.g., `column_name` or `table.column_name`)
-            # and are present in the table
-            column_ref_pattern = re.compile(
-                rf"(?<![\w.`'])(?!\b{re.escape(alias)}\.)(?:\b{re.escape(base_table_name)}\.|\b)(?P<column>\w+)\b",
-                re.IGNORECASE
-            )
-            
-            # Use schema to check if column exists in table (more robust)
-            # For simplicity here, we assume if column name appears without alias, it belongs to this table
-            # A more robust solution would cross-reference with schema_yaml
-            
-            # Simple replacement for now, assumes no ambiguity unless already aliased
-            sql_query = re.sub(column_ref_pattern, lambda m: f"{alias}.{m.group('column')}" if not m.group(0).startswith(f"{alias}.") else m.group(0), sql_query)
-
-        # Ensure "FROM project.dataset.table" is correctly aliased, even if not matched by group above
-        for base_table, alias in final_table_aliases.items():
-            full_path = f"{PROJECT_ID}.{DATASET_ID}.{base_table}"
-            # This covers cases where `project.dataset.table` might appear without an AS clause
-            sql_query = re.sub(rf'`{re.escape(full_path)}`(?!\s+{re.escape(alias)}\b)', f'`{full_path}` {alias}', sql_query, flags=re.IGNORECASE)
-
+        if cached_sql:
+            sql_query = cached_sql
+        elif sql_candidates is not None:
+            # Several prompt variants at once; the first candidate that passes validation and the dry run is executed
+            with tracing.span("sql.candidates") as span:
+                winner, outcomes = sql_candidates.race(
+                    lambda hint: generate_sql(llm, sql_prompt.format(question=question, extra_rules=hint), sql_validator),
+                    check_sql_candidate,
+                    cancel_event,
+                )
+                span.set(candidates=len(outcomes), winner=winner.index if winner is not None else None)
+            if _path_cancelled(cancel_event):
+                return PATH_CANCELLED_TEXT, None, None, None
+            if winner is None:
+                # None passed: the unchanged prompt's SQL and error go down the usual auto-cast / Gemini-fix chain
+                first = outcomes[0]
+                if first.generated is not None:
+                    sql_query, validation = first.generated
+                raise first.error
+            if winner.result is None:
+                database_response_text = "Sorry, I don't have enough data in the database to answer that specifically."
+                return database_response_text, df, plot_bytes, None
+            sql_query, validation = winner.result
+            tracing.annotate(sql_candidate=winner.index)
+        else:
+            generated = generate_sql(llm, sql_prompt.format(question=question, extra_rules=""), sql_validator)
+            if generated is None:
+                database_response_text = "Sorry, I don't have enough data in the database to answer that specifically."
+                return database_response_text, df, plot_bytes, None
+            sql_query, validation = generated
+            if validation is not None and validation.errors and SQL_VALIDATOR_BLOCK_UNKNOWN_NAMES:
+                raise SQLValidationError("Schema validation failed before execution: " + " ".join(validation.errors))
 
         generated_sql_display = sqlparse.format(sql_query, reindent=True, keyword_case='upper')
+        _emit(emit, "sql", generated_sql_display)
 
-        df = read_gbq(sql_query, project_id=PROJECT_ID)
+        if _path_cancelled(cancel_event):
+            return PATH_CANCELLED_TEXT, None, None, generated_sql_display
+
+        df = run_capped_query(sql_query, bypass_cache=bypass_result_cache)
+        tracing.annotate(retry_path="none", rows=len(df))
+        if sql_cache is not None:
+            sql_cache.store(question, sql_query, question_embedding)
+        if validation is not None:
+            sql_validator.record_first_execution(validation, succeeded=True)
 
         if df.empty:
             database_response_text += "No relevant data found for your query in the database."
             return database_response_text, df, plot_bytes, generated_sql_display
 
-        # Default plot generation logic (used for chat history)
-        numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-        object_cols = df.select_dtypes(include='object').columns.tolist()
-        datetime_cols = df.select_dtypes(include=['datetime64', 'datetime64[ns]']).columns.tolist()
-
-        default_x = None
-        default_y = None
-        default_chart_type = None
-
-        if len(datetime_cols) > 0 and len(numeric_cols) > 0:
-            default_x = datetime_cols[0]
-            default_y = numeric_cols[0]
-            default_chart_type = 'line'
-        elif len(object_cols) > 0 and len(numeric_cols) > 0:
-            default_x = object_cols[0]
-            default_y = numeric_cols[0]
-            default_chart_type = 'bar'
-        elif len(numeric_cols) > 0:
-            default_x = numeric_cols[0]
-            default_chart_type = 'histogram'
-        elif len(object_cols) > 0:
-            default_x = object_cols[0]
-            default_chart_type = 'countplot'
-
-        if default_x and default_chart_type:
-            plot_bytes = generate_plot_from_df(df.copy(), default_x, default_y, default_chart_type, title=question)
-
-        if len(df.columns) == 1 and len(df) == 1:
-            database_response_text = f"The {question.lower().replace('what is the ', '').replace('show me the ', '').replace('tell me the ', '')} is: **{df.iloc[0, 0]}**"
-        else:
-            database_response_text = f"Here are the key insights from the database:\n"
+        database_response_text, plot_bytes = present_database_result(question, df, emit)
 
     except Exception as e:
         error_msg = str(e)
         database_response_text = f"An error occurred fetching data from the database: {error_msg}\n"
 
+        # A cached SQL that no longer runs must not be served again
+        if cached_sql and sql_cache is not None:
+            sql_cache.invalidate(cached_sql)
+        if validation is not None and not validation.errors:
+            sql_validator.record_first_execution(validation, succeeded=False)
+
         needs_auto_cast_handling = (
             ("no matching signature for operator =" in error_msg.lower() and ("float64, string" in error_msg.lower() or "int64, string" in error_msg.lower()))
             or ("no matching signature for aggregate function sum" in error_msg.lower() and "string" in error_msg.lower())
         )
 
+        if _path_cancelled(cancel_event):
+            return database_response_text + PATH_CANCELLED_TEXT, None, None, generated_sql_display
+
         # Attempt auto-cast fix first
         if needs_auto_cast_handling:
+            tracing.annotate(retry_path="auto_cast")
             try:
-                cast_sql = auto_cast_fix(sql_query, error_msg)
+                with tracing.span("sql.auto_cast"):
+                    cast_sql = auto_cast_fix(sql_query, error_msg)
                 generated_sql_display = sqlparse.format(cast_sql, reindent=True, keyword_case='upper')
+                _emit(emit, "sql", generated_sql_display)
 
-                df = read_gbq(cast_sql, project_id=PROJECT_ID)
+                df = run_capped_query(cast_sql, bypass_cache=bypass_result_cache)
+                tracing.annotate(rows=len(df))
+                if sql_cache is not None:
+                    sql_cache.store(question, cast_sql, question_embedding)
 
                 if df.empty:
                     database_response_text += "No data found for your query in the database after auto-fix attempt."
                     return database_response_text, df, plot_bytes, generated_sql_display
 
-                numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-                object_cols = df.select_dtypes(include='object').columns.tolist()
-                datetime_cols = df.select_dtypes(include=['datetime64', 'datetime64[ns]']).columns.tolist()
-                default_x, default_y, default_chart_type = None, None, None
-                if len(datetime_cols) > 0 and len(numeric_cols) > 0: default_x, default_y, default_chart_type = datetime_cols[0], numeric_cols[0], 'line'
-                elif len(object_cols) > 0 and len(numeric_cols) > 0: default_x, default_y, default_chart_type = object_cols[0], numeric_cols[0], 'bar'
-                elif len(numeric_cols) > 0: default_x, default_chart_type = numeric_cols[0], 'histogram'
-                elif len(object_cols) > 0: default_x, default_chart_type = object_cols[0], 'countplot'
-
-                if default_x and default_chart_type:
-                    plot_bytes = generate_plot_from_df(df.copy(), default_x, default_y, default_chart_type, title=question + " (Auto-Fixed)")
-
-                if len(df.columns) == 1 and len(df) == 1:
-                    database_response_text = f"The {question.lower().replace('what is the ', '').replace('show me the ', '').replace('tell me the ', '')} is: **{df.iloc[0, 0]}** (auto-fixed)"
-                else:
-                    database_response_text = f"Here are the results from the database (auto-fixed):\n"
+                database_response_text, plot_bytes = present_database_result(question, df, emit, fixed_by="auto-fixed")
                 return database_response_text, df, plot_bytes, generated_sql_display
 
             except Exception as e3:
                 database_response_text += f"Auto-cast retry failed: {e3}\n"
         
+        if _path_cancelled(cancel_event):
+            return database_response_text + PATH_CANCELLED_TEXT, None, None, generated_sql_display
+
         # Then attempt LLM-based retry
         retry_sql_prompt = retry_prompt.format(sql=sql_query, error_message=error_msg)
+        tracing.annotate(retry_path="gemini_fix")
         try:
-            fixed_sql = llm.invoke(retry_sql_prompt).content.strip()
+            with tracing.span("llm.sql_fix") as span:
+                llm_response = llm.invoke(retry_sql_prompt)
+                span.set(**tracing.token_usage(llm_response))
+            fixed_sql = llm_response.content.strip()
             if "```" in fixed_sql:
                 fixed_sql = fixed_sql.split("```")[1].replace("sql", "").strip()
+            if join_planner is not None:
+                fixed_sql = join_planner.verify(fixed_sql).sql
+            if sql_validator is not None:
+                fixed_sql = sql_validator.validate(fixed_sql).sql
 
             generated_sql_display = sqlparse.format(fixed_sql, reindent=True, keyword_case='upper')
+            _emit(emit, "sql", generated_sql_display)
+
+            if _path_cancelled(cancel_event):
+                return database_response_text + PATH_CANCELLED_TEXT, None, None, generated_sql_display
 
-            df = read_gbq(fixed_sql, project_id=PROJECT_ID)
+            df = run_capped_query(fixed_sql, bypass_cache=bypass_result_cache)
+            tracing.annotate(rows=len(df))
+            if sql_cache is not None:
+                sql_cache.store(question, fixed_sql, question_embedding)
 
             if df.empty:
                 database_response_text += "No data found for your query in the database after Gemini-fix attempt."
                 return database_response_text, df, plot_bytes, generated_sql_display
 
-            numeric_cols = df.select_dtypes(include=np.number).columns.tolist()
-            object_cols = df.select_dtypes(include='object').columns.tolist()
-            datetime_cols = df.select_dtypes(include=['datetime64', 'datetime64[ns]']).columns.tolist()
-            default_x, default_y, default_chart_type = None, None, None
-            if len(datetime_cols) > 0 and len(numeric_cols) > 0: default_x, default_y, default_chart_type = datetime_cols[0], numeric_cols[0], 'line'
-            elif len(object_cols) > 0 and len(numeric_cols) > 0: default_x, default_y, default_chart_type = object_cols[0], numeric_cols[0], 'bar'
-            elif len(numeric_cols) > 0: default_x, default_chart_type = numeric_cols[0], 'histogram'
-            elif len(object_cols) > 0: default_x, default_chart_type = object_cols[0], 'countplot'
-
-            if default_x and default_chart_type:
-                plot_bytes = generate_plot_from_df(df.copy(), default_x, default_y, default_chart_type, title=question + " (Gemini-Fixed)")
-
-            if len(df.columns) == 1 and len(df) == 1:
-                database_response_text = f"The {question.lower().replace('what is the ', '').replace('show me the ', '').replace('tell me the ', '')} is: **{df.iloc[0, 0]}** (Gemini-fixed)"
-            else:
-                database_response_text = f"Here are the results from the database (Gemini-fixed):\n"
+            database_response_text, plot_bytes = present_database_result(question, df, emit, fixed_by="Gemini-fixed")
             return database_response_text, df, plot_bytes, generated_sql_display
 
         except Exception as e2:
@@ -724,8 +1366,76 @@ Error Message:
     return database_response_text, df, plot_bytes, generated_sql_display
 
 
+# --- Parallel execution of the database and document answer paths ---
+def run_answer_paths(paths: dict, timeouts: dict, trace: Trace | None = None):
+    """Runs each answer path in its own worker thread and yields AnswerEvents as they happen.
+
+    `paths` maps a path name to a callable that accepts `cancel_event` and `emit` keyword arguments;
+    `emit(kind, payload)` queues a progress event. Every path ends with a "done" event (payload = its
+    return value) or, if it exceeds its entry in `timeouts`, a "timeout" event after it is cancelled.
+    With a `trace`, each path runs inside a "path.<name>" span that its stages' spans nest under.
+    """
+    script_ctx = get_script_run_ctx()
+    cancel_events = {name: threading.Event() for name in paths}
+    events = queue.Queue()
+
+    def _run_with_script_ctx(name):
+        # st.error/st.warning calls inside the paths need the Streamlit script context on this thread
+        if script_ctx is not None:
+            add_script_run_ctx(threading.current_thread(), script_ctx)
+        try:
+            with trace.span(f"path.{name}") if trace is not None else nullcontext():
+                result = paths[name](cancel_event=cancel_events[name], emit=lambda kind, payload: events.put(AnswerEvent(name, kind, payload)))
+        except Exception as e:
+            events.put(AnswerEvent(name, "error", e))
+        else:
+            events.put(AnswerEvent(name, "done", result))
+
+    executor = ThreadPoolExecutor(max_workers=len(paths), thread_name_prefix="answer-path")
+    started_at = time.monotonic()
+    for name in paths:
+        executor.submit(_run_with_script_ctx, name)
+    deadlines = {name: started_at + timeouts[name] for name in paths}
+    pending = set(paths)
+    try:
+        while pending:
+            next_deadline = min(deadlines[name] for name in pending)
+            try:
+                event = events.get(timeout=max(0.0, next_deadline - time.monotonic()))
+            except queue.Empty:
+                event = None
+            if event is not None and event.path in pending:  # late events from a timed-out path are dropped
+                if event.kind == "error":
+                    raise event.payload
+                if event.kind == "done":
+                    pending.discard(event.path)
+                yield event
+            now = time.monotonic()
+            for name in sorted(pending):
+                if now >= deadlines[name]:
+                    cancel_events[name].set()
+                    pending.discard(name)
+                    yield AnswerEvent(name, "timeout")
+    finally:
+        # Timed-out paths keep their thread until the current blocking call returns,
+        # but the cancel flag stops them before the next BigQuery job or LLM call.
+        for event in cancel_events.values():
+            event.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+
 # --- Main Chatbot Orchestration Function ---
-def process_user_question(question: str, doc_vectorstore: Chroma, llm_model: ChatVertexAI, schema_guide: str) -> dict:
+def process_user_question(question: str, doc_vectorstore: Chroma, llm_model: ChatVertexAI, schema_guide: str, schema_index: SchemaIndex | None = None, sql_cache: SQLQueryCache | None = None, bypass_result_cache: bool = False, sql_validator: SQLValidator | None = None) -> dict:
+    """Runs stream_user_question to completion and returns only the final response elements."""
+    response_elements = None
+    for event in stream_user_question(question, doc_vectorstore, llm_model, schema_guide, schema_index, sql_cache, bypass_result_cache, sql_validator):
+        if event.kind == "response":
+            response_elements = event.payload
+    return response_elements
+
+def stream_user_question(question: str, doc_vectorstore: Chroma, llm_model: ChatVertexAI, schema_guide: str, schema_index: SchemaIndex | None = None, sql_cache: SQLQueryCache | None = None, bypass_result_cache: bool = False, sql_validator: SQLValidator | None = None):
+    """Generator of AnswerEvents: progress from both paths as it arrives, then one "response" event
+    carrying the combined response elements (text, query_display, dataframe_display, plot_data_bytes, trace)."""
+    trace = Trace(question)
     response_elements = {
         "text": "",
         "query_display": None,
@@ -734,44 +1444,64 @@ def process_user_question(question: str, doc_vectorstore: Chroma, llm_model: Cha
         "source_info": [] # To store details about where answers came from
     }
 
-    db_response_text, db_dataframe, db_plot_bytes, generated_sql = get_database_answer(question, llm_model, schema_guide)
-    doc_answer_text = get_document_answer(question, doc_vectorstore, llm_model)
+    db_response_text, db_dataframe, db_plot_bytes, generated_sql = "", None, None, None
+    doc_answer_text = ""
 
+    answer_paths = {
+        "database": lambda cancel_event, emit: get_database_answer(question, llm_model, schema_guide, schema_index, sql_cache, bypass_result_cache, sql_validator, cancel_event=cancel_event, emit=emit),
+        "document": lambda cancel_event, emit: get_document_answer(question, doc_vectorstore, llm_model, cancel_event=cancel_event, emit=emit, key_question_index=key_question_index),
+    }
+    path_timeouts = {"database": DB_PATH_TIMEOUT_SECONDS, "document": DOC_PATH_TIMEOUT_SECONDS}
+
+    # Clearly one-sided questions skip the other path (and its LLM call / BigQuery job) entirely
+    with trace.span("route"):
+        route = intent_router.route(question) if intent_router is not None else ROUTE_BOTH
+    trace.attributes["route"] = route
+    if route != ROUTE_BOTH:
+        answer_paths = {route: answer_paths[route]}
+    yield AnswerEvent("pipeline", "route", route)
+
+    for event in run_answer_paths(answer_paths, path_timeouts, trace):
+        if event.kind not in ("done", "timeout"):
+            yield event  # doc_token / sql / rows / plot go straight to the chat bubble
+        elif event.path == "database":
+            if event.kind == "timeout":
+                trace.attributes.setdefault("timeouts", []).append(event.path)
+                db_response_text = f"The database query did not finish within {DB_PATH_TIMEOUT_SECONDS} seconds and was cancelled."
+            else:
+                db_response_text, db_dataframe, db_plot_bytes, generated_sql = event.payload
+        else:
+            if event.kind == "timeout":
+                trace.attributes.setdefault("timeouts", []).append(event.path)
+                doc_answer_text = f"The document search did not finish within {DOC_PATH_TIMEOUT_SECONDS} seconds and was cancelled."
+            else:
+                doc_answer_text = event.payload
+
+    # Session state is not touched here: this may run on an answer service worker for several sessions at once.
+    # remember_database_result() updates it on the script thread of each session that asked.
     final_response_text = ""
     
     # --- Combine Database and Document Answers ---
-    if db_dataframe is not None and not db_dataframe.empty:
+    if route == ROUTE_DOCUMENT:
+        pass # Database path was not run for this question
+    elif db_dataframe is not None and not db_dataframe.empty:
         final_response_text += f"**Database Insights:**\n{db_response_text}\n\n"
         response_elements["plot_data_bytes"] = db_plot_bytes
         response_elements["query_display"] = generated_sql
         response_elements["source_info"].append("database")
-        
-        # Store for dynamic visualization section (for the current query)
-        st.session_state.last_db_df = db_dataframe
-        st.session_state.last_db_query = generated_sql
-        st.session_state.last_db_plot_question = question # Store question for plot title
-        
-        # Reset plot controls to default for new query
-        st.session_state.plot_x_col = None
-        st.session_state.plot_y_col = None
-        st.session_state.plot_chart_type = None
     elif db_response_text and "Sorry, I don't have enough data" not in db_response_text:
         # If DB query ran but returned no data or general error without specific "sorry"
         final_response_text += f"**Database Attempt:**\n{db_response_text}\n\n"
         response_elements["query_display"] = generated_sql
         response_elements["source_info"].append("database_attempt")
-        st.session_state.last_db_df = None # Ensure no stale data
-        st.session_state.last_db_query = None
-        st.session_state.last_db_plot_question = None
     else:
         final_response_text += "**Database Attempt:** No direct data found or an error occurred.\n\n"
         response_elements["query_display"] = generated_sql if generated_sql else "N/A"
-        st.session_state.last_db_df = None # Ensure no stale data
-        st.session_state.last_db_query = None
-        st.session_state.last_db_plot_question = None
 
 
-    if "Sorry, I don't have enough information" not in doc_answer_text:
+    if route == ROUTE_DATABASE:
+        pass # Document path was not run for this question
+    elif "Sorry, I don't have enough information" not in doc_answer_text:
         final_response_text += f"**Document-Based Information:**\n{doc_answer_text}\n\n"
         response_elements["source_info"].append("document")
     else:
@@ -787,35 +1517,89 @@ def process_user_question(question: str, doc_vectorstore: Chroma, llm_model: Cha
     # Store the actual dataframe in session state for dynamic plotting below the chat
     # response_elements["dataframe_display"] is kept for consistency but won't be displayed in chat bubbles
     response_elements["dataframe_display"] = db_dataframe
-    
-    return response_elements
 
-# --- Authentication Logic (Updated to use secrets) ---
-def authenticate():
-    st.sidebar.title("Login")
-    username = st.sidebar.text_input("Username")
-    password = st.sidebar.text_input("Password", type="password")
+    trace.finish()
+    trace.attributes["sources"] = response_elements["source_info"]
+    trace_metrics.observe(trace)
+    try:
+        trace_log.write(trace)
+    except OSError as e:
+        logging.getLogger(__name__).warning("Could not append to the trace log: %s", e)
+    response_elements["trace"] = trace.as_dict()
 
-    if st.sidebar.button("Login"):
-        if username == st.secrets.get("login_username") and password == st.secrets.get("login_password"):
-            st.session_state.authenticated = True
-            st.rerun()
-        else:
-            st.sidebar.error("Invalid Username or Password")
+    yield AnswerEvent("pipeline", "response", response_elements)
+
+def submit_user_question(question: str, doc_vectorstore: Chroma, llm_model: ChatVertexAI, schema_guide: str, schema_index: SchemaIndex | None = None, sql_cache: SQLQueryCache | None = None, bypass_result_cache: bool = False, sql_validator: SQLValidator | None = None):
+    """The AnswerEvents of stream_user_question, produced on the shared answer service when it is enabled.
+
+    A question another session is already getting answered (same words, same cache bypass) joins that job.
+    When the queue is full the only event is a "response" saying so.
+    """
+    run = lambda: stream_user_question(question, doc_vectorstore, llm_model, schema_guide, schema_index, sql_cache, bypass_result_cache, sql_validator)
+    if answer_service is None:
+        yield from run()
+        return
+    try:
+        job = answer_service.submit((normalize_question(question), bypass_result_cache, doc_vectorstore is not None), run)
+    except ServiceBusy as e:
+        yield AnswerEvent("pipeline", "response", {
+            "text": f"Too many questions are being answered right now. {e}",
+            "query_display": None, "dataframe_display": None, "plot_data_bytes": None, "source_info": ["busy"], "trace": None,
+        })
+        return
+    if not job.started:
+        yield AnswerEvent("pipeline", "queued")
+    yield from job.events()
+
+def remember_database_result(question: str, response_elements: dict):
+    """Keeps the answer's rows for the results and visualization section below the chat (script thread only)."""
+    db_dataframe = response_elements["dataframe_display"]
+    if db_dataframe is not None and not db_dataframe.empty:
+        st.session_state.last_db_df = db_dataframe
+        st.session_state.last_db_query = response_elements["query_display"]
+        st.session_state.last_db_plot_question = question # Store question for plot title
+
+        # Reset plot controls to default for new query
+        st.session_state.plot_x_col = None
+        st.session_state.plot_y_col = None
+        st.session_state.plot_chart_type = None
+    else:
+        st.session_state.last_db_df = None # Ensure no stale data
+        st.session_state.last_db_query = None
+        st.session_state.last_db_plot_question = None
+
+# --- Per-answer performance breakdown ---
+TRACE_DISPLAY_COLUMNS = ["stage", "start_ms", "duration_ms", "prompt_tokens", "completion_tokens", "bytes_processed",
+                         "cache_hit", "rows", "retry_path", "upstream_wait_ms", "error"]
+
+def show_trace(trace: dict):
+    """Expander with one row per span of the answer's trace; child stages are indented under their path."""
+    spans = trace.get("spans") or []
+    with st.expander(f"⏱️ Performance ({trace['duration_ms'] / 1000:.2f}s, route: {trace.get('route', ROUTE_BOTH)})"):
+        if not spans:
+            st.caption("No stages were recorded for this answer.")
+            return
+        parents = {span["span_id"]: span["parent"] for span in spans}
+        rows = []
+        for span in spans:
+            depth, parent = 0, span["parent"]
+            while parent is not None:
+                depth, parent = depth + 1, parents.get(parent)
+            rows.append({**span, "stage": "\u2003" * depth + span["name"]})
+        frame = pd.DataFrame(rows)
+        st.dataframe(frame[[column for column in TRACE_DISPLAY_COLUMNS if column in frame.columns]], use_container_width=True, hide_index=True)
 
 # --- Streamlit App UI ---
 st.title("📊 PROCUREMENT INSIGHTS CHATBOT")
 st.markdown("---")
 
 
-# Main application logic for authenticated users
-if not st.session_state.authenticated:
-    authenticate()
-else:
+# Main application logic (sessions that are not signed in stopped at the login gate above)
+if st.session_state.authenticated:
     st.sidebar.success("Logged in as DILPYTHONPRO")
     if st.sidebar.button("Logout"):
         st.session_state.authenticated = False
-        st.session_state.messages = [] # Clear chat on logout
+        st.session_state.messages.clear() # Clear chat (and its spilled payloads) on logout
         st.session_state.last_db_df = None # Clear current data on logout
         st.session_state.last_db_query = None
         st.session_state.plot_x_col = None
@@ -823,6 +1607,166 @@ else:
         st.session_state.plot_chart_type = None
         st.rerun()
 
+    if not document_store.ready:
+        st.sidebar.info("📦 Loading the document knowledge base in the background...")
+    elif document_store.error:
+        st.sidebar.error(f"❌ Document knowledge base sync failed: {document_store.error}")
+    else:
+        record_startup("documents_loaded", at=document_store.finished_at)
+        ingest_report = document_store.report
+        for doc_path, message in ingest_report.errors:
+            st.sidebar.warning(f"⚠️ Could not load {os.path.basename(doc_path)}: {message}")
+        if not ingest_report.chunks_added and not ingest_report.chunks_unchanged:
+            st.sidebar.warning("⚠️ No documents loaded for RAG. Document chatbot might not work.")
+        st.sidebar.caption(f"📦 {ingest_report.describe()}")
+
+    st.sidebar.checkbox(
+        "Bypass result cache (always query BigQuery)",
+        key="bypass_result_cache",
+        help="Fresh results are still written back to the cache."
+    )
+
+    # --- Performance stats for this server process ---
+    with st.sidebar.expander("⚙️ Performance Stats"):
+        if schema_index is not None:
+            prune = schema_index.prompt_reduction()
+            st.markdown(
+                f"**Schema pruning:** {prune['questions']} SQL prompts, "
+                f"{prune['reduction_pct']}% smaller schema section "
+                f"(~{prune['approx_tokens_saved']:,} tokens saved, {prune['fallbacks']} full-schema fallbacks)"
+            )
+        if sql_cache is not None:
+            cache_stats = sql_cache.hit_rate()
+            st.markdown(
+                f"**SQL cache:** {cache_stats['hit_rate_pct']}% hit rate over {cache_stats['lookups']} questions "
+                f"({cache_stats['exact_hits']} exact, {cache_stats['semantic_hits']} similar, {cache_stats['entries']} cached)"
+            )
+        if result_cache is not None:
+            result_stats = result_cache.summary()
+            st.markdown(
+                f"**Result cache:** {result_stats['hit_rate_pct']}% hit rate "
+                f"({result_stats['memory_hits']} memory, {result_stats['disk_hits']} disk, {result_stats['misses']} BigQuery, "
+                f"{result_stats['bypassed']} bypassed); {result_stats['memory_mb']} MB in memory, {result_stats['disk_mb']} MB on disk"
+            )
+        if sql_validator is not None:
+            validator_stats = sql_validator.summary()
+            st.markdown(
+                f"**SQL validator:** {validator_stats['validated']} checked, {validator_stats['fixed']} auto-cast, "
+                f"{validator_stats['blocked']} sent straight to Gemini fix; "
+                f"retries prevented: {validator_stats['fixed_first_try_ok']} "
+                f"(fixed queries that still failed: {validator_stats['fixed_first_try_failed']})"
+            )
+        if key_question_index is not None:
+            key_question_stats = key_question_index.summary()
+            st.markdown(
+                f"**Key-question lookup:** {key_question_stats['hits']} of {key_question_stats['lookups']} document questions "
+                f"answered without Gemini ({key_question_stats['rows']} reports, {key_question_stats['key_questions']} key questions indexed)"
+            )
+        if intent_router is not None:
+            route_stats = intent_router.summary()
+            st.markdown(
+                f"**Intent routing:** {route_stats['one_sided_pct']}% of {route_stats['questions']} questions ran one path "
+                f"({route_stats[ROUTE_DATABASE]} database-only, {route_stats[ROUTE_DOCUMENT]} document-only, "
+                f"{route_stats[ROUTE_BOTH]} both); {route_stats['llm_calls_skipped']} LLM calls skipped"
+            )
+        if isinstance(embeddings, CachedEmbeddings):
+            embedding_stats = embeddings.summary()
+            st.markdown(
+                f"**Embedding cache:** {embedding_stats['hit_rate_pct']}% hit rate ({embedding_stats['hits']} reused, "
+                f"{embedding_stats['misses']} computed at ~{embedding_stats['avg_embed_ms']} ms each, {embedding_stats['entries']:,} stored)"
+            )
+        if dimension_replica is not None:
+            replica_stats = dimension_replica.summary()
+            st.markdown(
+                f"**Dimension replica (DuckDB):** {replica_stats['served']} queries answered locally"
+                + (f" (avg {replica_stats['avg_ms']} ms)" if replica_stats.get("queries") else "")
+                + f", {replica_stats['fallbacks']} fell back to BigQuery; {replica_stats['fresh_tables']} of "
+                f"{replica_stats['tables']} tables fresh, oldest synced {replica_stats['max_staleness_minutes']} min ago"
+                + (f", {replica_stats['skipped_tables']} not replicated" if replica_stats["skipped_tables"] else "")
+            )
+        if rollup_router is not None:
+            rollup_stats = rollup_router.summary()
+            st.markdown(
+                f"**KPI rollups:** {rollup_stats['rewritten']} of {rollup_stats['checked']} queries "
+                f"({rollup_stats['rewrite_pct']}%) read a rollup, {rollup_stats['fallbacks']} fell back to the fact table; "
+                f"{rollup_stats['ready']} of {rollup_stats['rollups']} rollups fresh"
+            )
+        if answer_service is not None:
+            service_stats = answer_service.summary()
+            st.markdown(
+                f"**Answer service:** {service_stats['running']} of {service_stats['workers']} workers busy, "
+                f"{service_stats['queued']} queued; {service_stats['coalesced']} of {service_stats['submitted']} questions "
+                f"joined one already in flight, {service_stats['rejected']} turned away; "
+                f"avg queue wait {service_stats['avg_wait_ms']} ms, p95 answer {service_stats['p95_ms']} ms"
+            )
+        for limiter in upstream_limiters.values():
+            limit_stats = limiter.summary()
+            if limit_stats["calls"] or limit_stats["rejected"]:
+                st.markdown(
+                    f"**Upstream {limiter.name}:** {limit_stats['calls']} calls, queue wait avg {limit_stats['avg_wait_ms']} ms "
+                    f"(p95 {limit_stats['p95_wait_ms']} ms); {limit_stats['throttled']} throttled, {limit_stats['retries']} retried, "
+                    f"{limit_stats['rejected']} rejected; rate {limit_stats['rate']}/{limit_stats['configured_rate']} per s"
+                )
+        if sql_flight is not None:
+            flight_stats = sql_flight.summary()
+            st.markdown(f"**SQL single-flight:** {flight_stats['coalesced']} of {flight_stats['calls']} executions waited for an identical running query")
+        if sql_candidates is not None:
+            candidate_stats = sql_candidates.summary()
+            st.markdown(
+                f"**SQL candidates:** {candidate_stats['races']} questions raced {candidate_stats['candidates']} prompt variants, "
+                f"wins by variant {candidate_stats['wins']}, {candidate_stats['no_valid']} with no valid candidate; "
+                f"{candidate_stats['discarded']} extra Gemini calls; avg {candidate_stats['avg_ms']} ms (p95 {candidate_stats['p95_ms']} ms)"
+            )
+        if join_planner is not None:
+            join_stats = join_planner.summary()
+            st.markdown(
+                f"**Join planner:** {join_stats['planned']} prompts with planned joins; "
+                f"{join_stats['joins_fixed']} of {join_stats['joins_checked']} generated joins fixed, "
+                f"{join_stats['unplanned_joins']} on undeclared relationships"
+            )
+        if result_compactor is not None:
+            compact_stats = result_compactor.summary()
+            if compact_stats["frames"]:
+                st.markdown(
+                    f"**Result dtypes:** {compact_stats['frames']} results compacted, "
+                    f"{compact_stats['bytes_before'] / 1e6:.1f} MB -> {compact_stats['bytes_after'] / 1e6:.1f} MB "
+                    f"({compact_stats['saved_pct']}% saved), avg {compact_stats['avg_ms']} ms"
+                )
+        backend_stats = query_backend.summary()
+        if backend_stats:
+            st.markdown(
+                f"**Query backend ({query_backend.name}):** "
+                + "; ".join(
+                    f"{path}: {entry['queries']} queries, avg {entry['avg_ms']} ms (max {entry['max_ms']} ms), ~{entry['avg_rows']:,} rows"
+                    for path, entry in backend_stats.items()
+                )
+            )
+        history_stats = st.session_state.messages.summary()
+        process_resident_bytes, live_sessions = total_resident_bytes()
+        st.markdown(
+            f"**Chat history:** {history_stats['resident_mb']} / {history_stats['budget_mb']} MB resident "
+            f"({history_stats['resident_turns']} turns in RAM, {history_stats['spilled_turns']} spilled to disk); "
+            f"all sessions: {process_resident_bytes / 1e6:.1f} MB across {live_sessions}"
+        )
+        stage_stats = trace_metrics.summary()
+        if stage_stats:
+            st.markdown(
+                "**Stage latency (p50 / p95):** "
+                + "; ".join(f"{stage}: {entry['p50_ms']} / {entry['p95_ms']} ms" for stage, entry in list(stage_stats.items())[:8])
+                + (f" — Prometheus metrics on port {METRICS_PORT}" if METRICS_PORT else "")
+            )
+        startup_stats = trace_metrics.startup_summary()
+        if startup_stats:
+            st.markdown(
+                "**Cold start:** " + ", ".join(f"{milestone.replace('_', ' ')} after {seconds}s" for milestone, seconds in startup_stats.items())
+                + (f" (document load took {document_store.seconds:.1f}s in the background)" if document_store.ready else "")
+            )
+        plot_stats = plot_cache.summary()
+        st.markdown(
+            f"**Plot cache:** {plot_stats['hit_rate_pct']}% hit rate ({plot_stats['hits']} reused, {plot_stats['renders']} rendered, "
+            f"avg render {plot_stats['avg_render_ms']} ms, ~{plot_stats['saved_seconds']:.1f}s saved); {plot_stats['memory_mb']} MB"
+        )
+
     # Display chat messages from history on app rerun
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
@@ -830,17 +1774,22 @@ else:
             if message["role"] == "assistant":
                 # Removed: st.dataframe(message["dataframe_display"].head(5))
                 
-                # Display Plot for history (default generated plot)
-                if message["plot_data_bytes"] is not None:
+                # Display Plot for history (default generated plot); older turns are read back from disk
+                history_plot_bytes = st.session_state.messages.plot_bytes(message)
+                if history_plot_bytes is not None:
                     st.markdown("Associated Plot:")
-                    st.image(message["plot_data_bytes"], use_column_width=True)
+                    st.image(history_plot_bytes, use_column_width=True)
                 # Display Query/Details in an expander for history
                 if message["query_display"] is not None:
                     with st.expander("View Query/Details"):
                         # Heuristic to guess if it's SQL for syntax highlighting
                         lang = "sql" if "SELECT" in message["query_display"].upper() and "FROM" in message["query_display"].upper() else "markdown"
                         st.code(message["query_display"], language=lang)
+                if message.get("trace"):
+                    show_trace(message["trace"])
+
 
+    record_startup("app_ready")  # first signed-in page with the chat input
 
     # React to user input
     if prompt := st.chat_input("Ask your question about procurement (e.g., 'What is the total value of approved purchase orders last month?' or 'What is the overview of the solution?'):"):
@@ -851,22 +1800,59 @@ else:
 
         # Get chatbot response
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response_elements = process_user_question(prompt, vectorstore, llm, SCHEMA_GUIDE)
-            
-                # Display the main text response in the current chat bubble
-                st.markdown(response_elements["text"])
-
-                # Display Plot in current chat bubble (if available)
-                if response_elements["plot_data_bytes"] is not None:
-                    st.markdown("Associated Plot:")
-                    st.image(response_elements["plot_data_bytes"], use_column_width=True)
-
-                # Display Query in current chat bubble (if available)
-                if response_elements["query_display"] is not None:
-                    with st.expander("View Query/Details"):
-                        lang = "sql" if "SELECT" in response_elements["query_display"].upper() and "FROM" in response_elements["query_display"].upper() else "markdown"
-                        st.code(response_elements["query_display"], language=lang)
+            # Live preview: each piece is drawn as soon as its event arrives, then replaced by the final answer below
+            live_preview = st.empty()
+            with live_preview.container():
+                status_slot = st.empty()
+                sql_slot = st.empty()
+                rows_slot = st.empty()
+                plot_slot = st.empty()
+                doc_slot = st.empty()
+            if not document_store.ready:
+                status_slot.markdown("_Loading the document knowledge base..._")
+                document_store.wait(DOCUMENT_STORE_WAIT_SECONDS)
+                vectorstore, key_question_index, intent_router = document_resources()
+            status_slot.markdown("_Thinking..._")
+            streamed_doc_text = ""
+            response_elements = None
+            for event in submit_user_question(prompt, vectorstore, llm, SCHEMA_GUIDE, schema_index, sql_cache, st.session_state.bypass_result_cache, sql_validator):
+                if event.kind == "queued":
+                    status_slot.markdown("_Waiting for a free answer worker..._")
+                elif event.kind == "route":
+                    if event.payload != ROUTE_BOTH:
+                        status_slot.markdown(f"_Answering from the {event.payload} only..._")
+                elif event.kind == "doc_token":
+                    streamed_doc_text += event.payload
+                    doc_slot.markdown(f"**Document-Based Information:**\n{streamed_doc_text}▌")
+                elif event.kind == "sql":
+                    status_slot.markdown("_Running the database query..._")
+                    sql_slot.code(event.payload, language="sql")
+                elif event.kind == "rows":
+                    status_slot.markdown(f"_First {len(event.payload)} rows:_")
+                    rows_slot.dataframe(event.payload, use_container_width=True)
+                elif event.kind == "plot":
+                    plot_slot.image(event.payload, use_column_width=True)
+                elif event.kind == "response":
+                    response_elements = event.payload
+            live_preview.empty()
+            remember_database_result(prompt, response_elements)
+
+            # Display the main text response in the current chat bubble
+            st.markdown(response_elements["text"])
+
+            # Display Plot in current chat bubble (if available)
+            if response_elements["plot_data_bytes"] is not None:
+                st.markdown("Associated Plot:")
+                st.image(response_elements["plot_data_bytes"], use_column_width=True)
+
+            # Display Query in current chat bubble (if available)
+            if response_elements["query_display"] is not None:
+                with st.expander("View Query/Details"):
+                    lang = "sql" if "SELECT" in response_elements["query_display"].upper() and "FROM" in response_elements["query_display"].upper() else "markdown"
+                    st.code(response_elements["query_display"], language=lang)
+
+            if response_elements["trace"]:
+                show_trace(response_elements["trace"])
 
             # Store the full response elements to chat history for redraw on rerun
             # dataframe_display is stored, but not explicitly rendered in chat bubbles
@@ -875,7 +1861,8 @@ else:
                 "content": response_elements["text"],
                 "dataframe_display": response_elements["dataframe_display"], # Still store for dynamic section below
                 "plot_data_bytes": response_elements["plot_data_bytes"],
-                "query_display": response_elements["query_display"]
+                "query_display": response_elements["query_display"],
+                "trace": response_elements["trace"]
             })
         # Important: Rerun the script to ensure the "Current Query Results" section updates
         # and new selectbox states are picked up correctly for dynamic plotting.
@@ -891,6 +1878,17 @@ else:
         # Display the full DataFrame
         st.markdown("#### Raw Query Results:")
         st.dataframe(st.session_state.last_db_df, use_container_width=True)
+        result_attrs = st.session_state.last_db_df.attrs
+        if result_attrs.get("truncated"):
+            st.caption(f"Showing the first {result_attrs['row_limit']:,} rows; charts below are aggregated over all rows in BigQuery.")
+            next_limit = min(result_attrs["row_limit"] * RESULT_FETCH_MORE_FACTOR, RESULT_ROW_CAP_MAX)
+            if next_limit > result_attrs["row_limit"] and st.button(f"Fetch more rows (up to {next_limit:,})", key="fetch_more_rows"):
+                try:
+                    st.session_state.last_db_df = run_capped_query(result_attrs["source_sql"], result_attrs.get("bypass_cache", False), row_limit=next_limit)
+                except Exception as e:
+                    st.error(f"Could not fetch more rows: {e}")
+                else:
+                    st.rerun()
 
         # Show SQL query in expander
         if st.session_state.last_db_query:
@@ -940,7 +1938,7 @@ else:
         # Generate and display the dynamic plot based on user selections
         if st.session_state.plot_chart_type and st.session_state.plot_x_col:
             plot_title = st.session_state.last_db_plot_question if st.session_state.last_db_plot_question else "Dynamic Plot"
-            current_plot_bytes = generate_plot_from_df(
+            current_plot_bytes = plot_result(
                 df_for_plot, 
                 st.session_state.plot_x_col, 
                 st.session_state.plot_y_col, # Pass Y-axis even if not used by all chart types
@@ -949,6 +1947,24 @@ else:
             )
             if current_plot_bytes:
                 st.image(current_plot_bytes, use_column_width=True)
+                # Full-resolution PNG is rendered only when the user asks for it (and then cached like the preview)
+                if st.button("Prepare full-resolution PNG", key="prepare_full_plot"):
+                    full_plot_bytes = plot_result(
+                        df_for_plot,
+                        st.session_state.plot_x_col,
+                        st.session_state.plot_y_col,
+                        st.session_state.plot_chart_type,
+                        title=plot_title,
+                        profile="full"
+                    )
+                    if full_plot_bytes:
+                        st.download_button(
+                            "⬇️ Download PNG (300 DPI)",
+                            data=full_plot_bytes.getvalue(),
+                            file_name=f"{st.session_state.plot_chart_type}_{st.session_state.plot_x_col}.png",
+                            mime="image/png",
+                            key="download_full_plot"
+                        )
             else:
                 st.warning(f"Could not generate {st.session_state.plot_chart_type} chart with selected columns. Please check column types and chart compatibility.")
         else:
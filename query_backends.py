@@ -0,0 +1,255 @@
+import random
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+import tracing
+from schema_index import bigquery_type
+
+
+class QueryBackend:
+    """Runs one SQL query and returns a DataFrame. `run_bigquery` only talks to this interface,
+    so a local engine can stand in for BigQuery when testing without GCP access."""
+
+    name = "base"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats = {}  # path -> {"queries", "rows", "seconds", "max_seconds"}
+
+    def run(self, sql: str) -> pd.DataFrame:
+        raise NotImplementedError
+
+    def execute(self, statements: list[str]) -> int | None:
+        """Runs DDL/DML statements as one transaction; returns the bytes processed when the engine reports them."""
+        raise NotImplementedError
+
+    def dry_run_bytes(self, sql: str) -> int | None:
+        """Checks the query without running it; returns the bytes it would scan when the engine reports them."""
+        raise NotImplementedError
+
+    def _record(self, path: str, rows: int, seconds: float):
+        with self._lock:
+            entry = self.stats.setdefault(path, {"queries": 0, "rows": 0, "seconds": 0.0, "max_seconds": 0.0})
+            entry["queries"] += 1
+            entry["rows"] += rows
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+    def summary(self) -> dict:
+        """Per fetch path: query count, average rows and average/max wall time in ms."""
+        with self._lock:
+            stats = {path: dict(entry) for path, entry in self.stats.items()}
+        for entry in stats.values():
+            entry["avg_rows"] = entry["rows"] // entry["queries"]
+            entry["avg_ms"] = round(1000.0 * entry["seconds"] / entry["queries"], 1)
+            entry["max_ms"] = round(1000.0 * entry["max_seconds"], 1)
+        return stats
+
+
+class BigQueryBackend(QueryBackend):
+    """Shared-client BigQuery backend.
+
+    Every query is submitted with `query_and_wait` (jobs.query fast path, first page of rows comes back
+    with the job). Results up to `small_result_rows` are read from that response over REST; larger results
+    are downloaded as Arrow through the BigQuery Storage Read API when a read client is available.
+    """
+
+    name = "bigquery"
+
+    def __init__(self, client, storage_client=None, small_result_rows: int = 10000, limiter=None):
+        super().__init__()
+        self.client = client
+        self.storage_client = storage_client
+        self.small_result_rows = small_result_rows
+        self.limiter = limiter  # upstream_limits.UpstreamLimiter shared with every other BigQuery caller
+
+    def _query_and_wait(self, sql: str):
+        if self.limiter is None:
+            return self.client.query_and_wait(sql)
+        return self.limiter.call(self.client.query_and_wait, sql)
+
+    def run(self, sql: str) -> pd.DataFrame:
+        import pyarrow as pa
+
+        started = time.perf_counter()
+        rows = self._query_and_wait(sql)
+        total_rows = rows.total_rows or 0
+        if total_rows <= self.small_result_rows or self.storage_client is None:
+            path = "rest_small" if total_rows <= self.small_result_rows else "rest_large"
+            table = rows.to_arrow(create_bqstorage_client=False)
+        else:
+            path = "storage_arrow"
+            table = rows.to_arrow(bqstorage_client=self.storage_client)
+        # db-dtypes keeps DATE/TIME columns as pandas extension types instead of object columns, and STRING
+        # columns stay in Arrow buffers instead of becoming one Python str per cell
+        df = table.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}.get)
+        self._record(path, len(df), time.perf_counter() - started)
+        # Job statistics come back with the query_and_wait response (absent on older client versions)
+        tracing.annotate(fetch_path=path, bytes_processed=getattr(rows, "total_bytes_processed", None),
+                         bigquery_cache_hit=getattr(rows, "cache_hit", None))
+        return df
+
+    def execute(self, statements: list[str]) -> int | None:
+        if len(statements) == 1:
+            script = statements[0]
+        else:
+            script = "BEGIN TRANSACTION;\n" + ";\n".join(statements) + ";\nCOMMIT TRANSACTION;"
+        rows = self._query_and_wait(script)
+        return getattr(rows, "total_bytes_processed", None)
+
+    def dry_run_bytes(self, sql: str) -> int | None:
+        """Bytes the query would scan, from a free dry run (nothing is executed or billed)."""
+        from google.cloud import bigquery
+
+        job_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False)
+        if self.limiter is None:
+            return self.client.query(sql, job_config=job_config).total_bytes_processed
+        return self.limiter.call(self.client.query, sql, job_config=job_config).total_bytes_processed
+
+
+# `project.dataset.TABLE` (backticked or not) -> TABLE, since a local database has no projects/datasets
+_QUALIFIED_TABLE_PATTERN = re.compile(r"`[\w-]+\.[\w-]+\.(\w+)`|\b[\w-]+\.[\w-]+\.(\w+)\b(?=\s)")
+# CAST(x AS STRING) would get NUMERIC affinity in SQLite and turn labels into 0
+_BIGQUERY_CAST_TYPES = {"STRING": "TEXT", "INT64": "INTEGER", "FLOAT64": "REAL", "BOOL": "INTEGER"}
+_CAST_TYPE_PATTERN = re.compile(r"\bAS\s+(STRING|INT64|FLOAT64|BOOL)\s*\)", re.IGNORECASE)
+# SQLValidator inserts SAFE_CAST; SQLite's CAST never raises either (unparseable text becomes 0, not NULL)
+_SAFE_CAST_PATTERN = re.compile(r"\bSAFE_CAST\s*\(", re.IGNORECASE)
+
+
+def _safe_divide(numerator, denominator):
+    if numerator is None or denominator in (None, 0):
+        return None
+    return numerator / denominator
+
+
+class SQLiteBackend(QueryBackend):
+    """Local stand-in that runs the generated SQL against a SQLite file holding the schema's tables.
+
+    Only the BigQuery-isms the prompt commonly produces are bridged (qualified table names, CAST type
+    names, SAFE_CAST, SAFE_DIVIDE); anything else fails here the same way an invalid query would fail on BigQuery.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str):
+        super().__init__()
+        self.db_path = db_path
+        self._local = threading.local()  # sqlite3 connections cannot be shared across threads
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path)
+            conn.create_function("SAFE_DIVIDE", 2, _safe_divide, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def translate(sql: str) -> str:
+        sql = _QUALIFIED_TABLE_PATTERN.sub(lambda m: m.group(1) or m.group(2), sql)
+        sql = _SAFE_CAST_PATTERN.sub("CAST(", sql)
+        return _CAST_TYPE_PATTERN.sub(lambda m: f"AS {_BIGQUERY_CAST_TYPES[m.group(1).upper()]})", sql)
+
+    def run(self, sql: str) -> pd.DataFrame:
+        started = time.perf_counter()
+        df = pd.read_sql_query(self.translate(sql), self._connection())
+        self._record("local", len(df), time.perf_counter() - started)
+        tracing.annotate(fetch_path="local")
+        return df
+
+    def dry_run_bytes(self, sql: str) -> int | None:
+        # EXPLAIN compiles the statement (table and column names, syntax) without reading a row
+        self._connection().execute("EXPLAIN " + self.translate(sql)).fetchall()
+        return None
+
+    def execute(self, statements: list[str]) -> int | None:
+        conn = self._connection()
+        with conn:  # one transaction, rolled back if any statement fails
+            for statement in statements:
+                conn.execute(self.translate(statement))
+        return None
+
+
+_SQLITE_COLUMN_TYPES = {"INT64": "INTEGER", "FLOAT64": "REAL", "BOOL": "INTEGER"}
+
+
+def _sample_value(value, bq_type: str):
+    if value is None:
+        return None
+    try:
+        if bq_type == "INT64":
+            return int(float(value))
+        if bq_type == "FLOAT64":
+            return float(value)
+        if bq_type == "BOOL":
+            return int(str(value).strip().lower() in ("true", "1", "y", "yes"))
+    except ValueError:
+        return None
+    return str(value)
+
+
+def seed_sqlite_from_schema(schema_index, db_path: str, rows_per_table: int = 200, seed: int = 0) -> dict:
+    """Creates every schema table in a SQLite file and fills it with rows drawn from the YAML `sample_values`.
+
+    Values are picked with a seeded RNG, so the same seed always produces the same database. Key columns on
+    the right side of a relationship get one distinct value per row (samples first, then synthetic ids), and
+    the foreign keys pointing at them draw from those values, so joins along the schema relationships match.
+    Returns {table: row count}.
+    """
+    rng = random.Random(seed)
+    join_keys = {}  # (table, COLUMN) -> distinct key values of a relationship's right side
+    foreign_keys = {}  # (table, COLUMN) -> (right table, RIGHT_COLUMN)
+    for rel in schema_index.relationships:
+        for left_column, right_column in rel["columns"]:
+            if left_column and right_column:
+                join_keys[(rel["right_table"], right_column.upper())] = None
+                foreign_keys[(rel["left_table"], left_column.upper())] = (rel["right_table"], right_column.upper())
+
+    table_values = {}
+    for table_name, table in schema_index.tables.items():
+        columns = {}
+        for column, field in table["columns"].items():
+            bq_type = schema_index.column_types[table_name][column.upper()]
+            samples = [_sample_value(v, bq_type) for v in field.get("sample_values") or []]
+            columns[column] = (bq_type, [v for v in samples if v is not None])
+        table_values[table_name] = columns
+        for column, (bq_type, samples) in columns.items():
+            if (table_name, column.upper()) in join_keys:
+                distinct = list(dict.fromkeys(samples))
+                next_id = max([v for v in distinct if isinstance(v, int)], default=0) + 1
+                while len(distinct) < rows_per_table:
+                    distinct.append(next_id if bq_type != "STRING" else str(next_id))
+                    next_id += 1
+                join_keys[(table_name, column.upper())] = distinct[:rows_per_table]
+
+    counts = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        for table_name, columns in table_values.items():
+            names = list(columns)
+            conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+            conn.execute(f'CREATE TABLE "{table_name}" (' + ", ".join(
+                f'"{name}" {_SQLITE_COLUMN_TYPES.get(columns[name][0], "TEXT")}' for name in names) + ")")
+            rows = []
+            for row_number in range(rows_per_table):
+                row = []
+                for name in names:
+                    bq_type, samples = columns[name]
+                    key = (table_name, name.upper())
+                    if join_keys.get(key):
+                        row.append(join_keys[key][row_number])
+                    elif key in foreign_keys and join_keys.get(foreign_keys[key]):
+                        row.append(rng.choice(join_keys[foreign_keys[key]]))
+                    else:
+                        row.append(rng.choice(samples) if samples else None)
+                rows.append(row)
+            conn.executemany(f'INSERT INTO "{table_name}" VALUES ({", ".join("?" * len(names))})', rows)
+            counts[table_name] = len(rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return counts
@@ -0,0 +1,211 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+
+from schema_index import tokenize
+
+# --- Extraction of the "S. No. | Report Name | Description | Key Questions Answered" tables ---
+_REPORTS_HEADING = re.compile(r"^\d+\.3\s+Reports\b")
+# "4 Purchase Orders" / "4.1 Description" headings end a reports table
+_SECTION_HEADING = re.compile(r"^\d(?:\.\d+)?\s+[A-Z]")
+_ROW_START = re.compile(r"^(\d{1,2})\.\s*(.*)$")
+_DESCRIPTION_START = re.compile(r"^(This|These|The)\b")
+# Running page header/footer; the header can be glued to the end of the last line of the previous page
+_PAGE_HEADER = re.compile(r"\s*DiLytics [\w ]+ Solution Overview\s*$")
+_PAGE_FOOTER = re.compile(r"^Page \d+ of \d+$")
+_END_MARKER = re.compile(r"\s*-{5,}.*$")  # "----- End of Document -----"
+_BULLET = "▪"
+
+
+@dataclass
+class ReportRow:
+    report_name: str
+    description: str
+    key_questions: list = field(default_factory=list)
+    source: str = ""
+    page: int = 0
+
+
+def _join(lines: list) -> str:
+    # PDF lines break mid-word at hyphens ("pre-\napproved"); keep the hyphen, drop the space
+    text = ""
+    for line in lines:
+        if text.endswith("-"):
+            text += line
+        else:
+            text = f"{text} {line}" if text else line
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def extract_report_rows(pages: list, source: str = "") -> list[ReportRow]:
+    """Parses report tables out of extracted page texts ([(text, metadata)] as produced by the loaders).
+
+    Rows are recognised by their running S. No. (1., 2., ... restarting under every "N.3 Reports"
+    heading), the description by its "This/These/The ..." opening and key questions by the ▪ bullets.
+    """
+    rows, in_reports, expected, current = [], False, 1, None
+    in_table_header = False  # the column header repeats on every page, sometimes one word per line
+    name_lines, description_lines, question_lines, questions = [], [], [], []
+
+    def finish():
+        if current is None:
+            return
+        if question_lines:
+            questions.append(_join(question_lines))
+        name, description = _join(name_lines), _join(description_lines)
+        if name and description and questions:
+            rows.append(ReportRow(name, description, list(questions), source, current))
+
+    for position, (text, metadata) in enumerate(pages):
+        page_number = int(metadata.get("page", position)) + 1
+        for raw_line in text.splitlines():
+            line = _END_MARKER.sub("", _PAGE_HEADER.sub("", raw_line)).strip()
+            if not line or _PAGE_FOOTER.match(line):
+                continue
+            if line == "S." or line.startswith("S. No."):
+                in_table_header = True
+            if in_table_header:
+                in_table_header = not line.endswith("Answered")
+                continue
+            if _REPORTS_HEADING.match(line):
+                finish()
+                in_reports, expected, current = True, 1, None
+                continue
+            if not in_reports:
+                continue
+            if _SECTION_HEADING.match(line):
+                finish()
+                in_reports, current = False, None
+                continue
+            row_match = _ROW_START.match(line)
+            if row_match and int(row_match.group(1)) == expected:
+                finish()
+                current, expected = page_number, expected + 1
+                name_lines, description_lines, question_lines, questions = [], [], [], []
+                line = row_match.group(2).strip()
+                if not line:
+                    continue
+            if current is None:
+                continue
+            if line.startswith(_BULLET):
+                if question_lines:
+                    questions.append(_join(question_lines))
+                question_lines = [line.lstrip(_BULLET).strip()]
+            elif question_lines:
+                question_lines.append(line)
+            elif description_lines or _DESCRIPTION_START.match(line):
+                description_lines.append(line)
+            else:
+                name_lines.append(line)
+    finish()
+    return rows
+
+
+# --- BM25 over key questions ---
+class BM25Index:
+    """Okapi BM25 over small documents (one key question each), using the schema tokenizer."""
+
+    def __init__(self, documents: list[str], k1: float = 1.5, b: float = 0.75):
+        self.k1, self.b = k1, b
+        self.doc_terms = [Counter(tokenize(doc)) for doc in documents]
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+        document_frequency = Counter(term for terms in self.doc_terms for term in terms)
+        count = len(documents)
+        self.idf = {term: math.log(1 + (count - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+        self.postings = {}
+        for index, terms in enumerate(self.doc_terms):
+            for term in terms:
+                self.postings.setdefault(term, []).append(index)
+
+    def _term_score(self, term: str, index: int) -> float:
+        frequency = self.doc_terms[index][term]
+        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / (self.avg_length or 1))
+        return self.idf.get(term, 0.0) * frequency * (self.k1 + 1) / (frequency + norm)
+
+    def score(self, query: str) -> dict:
+        scores = {}
+        for term in set(tokenize(query)):
+            for index in self.postings.get(term, ()):
+                scores[index] = scores.get(index, 0.0) + self._term_score(term, index)
+        return scores
+
+    def self_score(self, index: int) -> float:
+        return sum(self._term_score(term, index) for term in self.doc_terms[index])
+
+
+class KeyQuestionIndex:
+    """Key Question Answered -> report row lookup that needs no LLM call.
+
+    Confidence is the harmonic mean of two coverages: the question's BM25 score against a key question
+    relative to that key question's score against itself (how much of the key question is asked), and
+    the IDF share of the question's own terms that appear in the key question (how little else is asked).
+    A data question like "total PO amount for supplier ACME in 2023" therefore stays below the threshold
+    even though it covers "What is the total PO amount?".
+    """
+
+    def __init__(self, rows: list[ReportRow]):
+        self.rows = rows
+        self.entries = [(row_index, question) for row_index, row in enumerate(rows) for question in row.key_questions]
+        self.bm25 = BM25Index([question for _, question in self.entries])
+        self._self_scores = [self.bm25.self_score(i) for i in range(len(self.entries))]
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0}
+
+    @classmethod
+    def load(cls, path: str) -> "KeyQuestionIndex":
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls([ReportRow(**row) for row in json.load(f)])
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            return cls([])
+
+    @staticmethod
+    def save(rows: list[ReportRow], path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump([asdict(row) for row in rows], f)
+        os.replace(tmp_path, path)
+
+    def best_match(self, question: str) -> tuple[ReportRow | None, str | None, float]:
+        """(row, matched key question, confidence) for the best-scoring key question."""
+        best_index, best_confidence = None, 0.0
+        question_terms = set(tokenize(question))
+        unseen_idf = max(self.bm25.idf.values(), default=1.0)  # words no key question uses weigh the most
+        question_weight = sum(self.bm25.idf.get(term, unseen_idf) for term in question_terms)
+        for index, score in self.bm25.score(question).items():
+            key_coverage = score / self._self_scores[index] if self._self_scores[index] else 0.0
+            shared = question_terms & self.bm25.doc_terms[index].keys()
+            question_coverage = sum(self.bm25.idf[term] for term in shared) / question_weight if question_weight else 0.0
+            if not key_coverage or not question_coverage:
+                continue
+            confidence = 2 * key_coverage * question_coverage / (key_coverage + question_coverage)
+            if confidence > best_confidence:
+                best_index, best_confidence = index, confidence
+        if best_index is None:
+            return None, None, 0.0
+        row_index, key_question = self.entries[best_index]
+        return self.rows[row_index], key_question, round(best_confidence, 3)
+
+    def answer(self, question: str, min_confidence: float) -> str | None:
+        row, key_question, confidence = self.best_match(question)
+        hit = row is not None and confidence >= min_confidence
+        with self._lock:
+            self.stats["lookups"] += 1
+            self.stats["hits"] += int(hit)
+        if not hit:
+            return None
+        return f"**{row.report_name}**: {row.description}\n\n_Answers: {key_question}_"
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        stats["rows"] = len(self.rows)
+        stats["key_questions"] = len(self.entries)
+        stats["hit_rate_pct"] = round(100.0 * stats["hits"] / stats["lookups"], 1) if stats["lookups"] else 0.0
+        return stats
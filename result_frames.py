@@ -0,0 +1,130 @@
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema_index import SchemaIndex
+
+ARROW_STRING = pd.StringDtype("pyarrow")
+_DATE_TYPES = {"DATE", "DATETIME", "TIMESTAMP"}
+_SMALL_INTS = (np.int8, np.int16, np.int32)
+# Text that is unambiguously a date: '2024-01-31', '2024-01-31 08:15:00' (FORMAT_DATE output, dates read as text)
+_ISO_DATE_PATTERN = r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?"
+
+
+def is_label_column(series: pd.Series) -> bool:
+    """Text columns (object, Arrow string or categorical), the ones charts use for labels and categories."""
+    return pd.api.types.is_object_dtype(series.dtype) or isinstance(series.dtype, (pd.CategoricalDtype, pd.StringDtype))
+
+
+def label_columns(df: pd.DataFrame) -> list:
+    return [column for index, column in enumerate(df.columns) if is_label_column(df.iloc[:, index])]
+
+
+def drop_unused_categories(df: pd.DataFrame) -> pd.DataFrame:
+    """Categories no row uses any more (after rows were cut off) are removed, so value_counts does not list them."""
+    categorical = [index for index, dtype in enumerate(df.dtypes) if isinstance(dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return df
+    df = df.copy(deep=False)
+    for index in categorical:
+        df.isetitem(index, df.iloc[:, index].cat.remove_unused_categories())
+    return df
+
+
+class ResultCompactor:
+    """Converts a query result to compact dtypes once, when it is fetched, so every later copy, cache entry and chart is smaller.
+
+    - text becomes categorical when at most `category_max_ratio` of its values are distinct, else an Arrow string;
+    - NUMERIC values (Decimal objects) become float64; integers the smallest type in which a sum over the whole
+      column still fits (pandas sums int8 in int8);
+    - columns the schema declares DATE / DATETIME / TIMESTAMP, date objects and text holding only ISO dates
+      become datetime64, unless a value would not parse; charts then never parse dates themselves.
+    Floats stay float64: amounts added up in float32 would lose cents.
+    """
+
+    def __init__(self, column_types: dict | None = None, category_max_ratio: float = 0.5):
+        self.column_types = column_types or {}  # COLUMN -> BigQuery type
+        self.category_max_ratio = category_max_ratio
+        self._lock = threading.Lock()
+        self.stats = {"frames": 0, "bytes_before": 0, "bytes_after": 0, "seconds": 0.0}
+
+    @classmethod
+    def from_schema_index(cls, schema_index: SchemaIndex | None, category_max_ratio: float = 0.5) -> "ResultCompactor":
+        """Types of the schema's column names; a name declared with different types in two tables is left out."""
+        column_types, conflicting = {}, set()
+        for types in (schema_index.column_types.values() if schema_index is not None else []):
+            for column, bq_type in types.items():
+                if column_types.setdefault(column, bq_type) != bq_type:
+                    conflicting.add(column)
+        for column in conflicting:
+            del column_types[column]
+        return cls(column_types, category_max_ratio)
+
+    def _text(self, series: pd.Series) -> pd.Series:
+        if len(series) and series.nunique(dropna=True) <= self.category_max_ratio * len(series):
+            return series.astype("category")
+        return series.astype(ARROW_STRING) if pd.api.types.is_object_dtype(series.dtype) else series
+
+    @staticmethod
+    def _iso_dates(series: pd.Series) -> bool:
+        values = series.dropna()
+        if values.empty or not isinstance(values.iloc[0], str) or not re.fullmatch(_ISO_DATE_PATTERN, values.iloc[0]):
+            return False  # the first value decides for almost every column, without a pass over all of them
+        return bool(values.str.fullmatch(_ISO_DATE_PATTERN).all())
+
+    @staticmethod
+    def _integers(series: pd.Series) -> pd.Series:
+        if series.empty:
+            return series
+        bound = max(abs(int(series.min())), abs(int(series.max()))) * len(series)
+        for small in _SMALL_INTS:
+            if bound <= np.iinfo(small).max:
+                return series.astype(small)
+        return series
+
+    def _column(self, series: pd.Series, declared: str | None) -> pd.Series:
+        dtype = series.dtype
+        if dtype == np.int64:
+            return self._integers(series)
+        if isinstance(dtype, pd.StringDtype):
+            kind = "string"
+        elif dtype.name == "dbdate":
+            kind = "date"
+        elif pd.api.types.is_object_dtype(dtype):
+            kind = pd.api.types.infer_dtype(series, skipna=True)
+        else:
+            return series
+        if declared in _DATE_TYPES or kind in ("date", "datetime") or (kind == "string" and self._iso_dates(series)):
+            parsed = pd.to_datetime(series, errors="coerce")
+            if parsed.isna().sum() == series.isna().sum():
+                return parsed
+        if kind == "decimal":
+            return series.astype("float64")
+        if kind == "string":
+            return self._text(series)
+        return series  # mixed, bytes, lists: left as they are
+
+    def compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        """A compacted shallow copy of `df` (attrs kept); `df` itself is not changed."""
+        started = time.perf_counter()
+        before = int(df.memory_usage(deep=True).sum())
+        compacted = df.copy(deep=False)
+        for index, column in enumerate(df.columns):
+            compacted.isetitem(index, self._column(df.iloc[:, index], self.column_types.get(str(column).upper())))
+        after = int(compacted.memory_usage(deep=True).sum())
+        with self._lock:
+            self.stats["frames"] += 1
+            self.stats["bytes_before"] += before
+            self.stats["bytes_after"] += after
+            self.stats["seconds"] += time.perf_counter() - started
+        return compacted
+
+    def summary(self) -> dict:
+        with self._lock:
+            summary = dict(self.stats)
+        summary["saved_pct"] = round(100 * (1 - summary["bytes_after"] / summary["bytes_before"]), 1) if summary["bytes_before"] else 0.0
+        summary["avg_ms"] = round(1000 * summary.pop("seconds") / summary["frames"], 2) if summary["frames"] else 0.0
+        return summary
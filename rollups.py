@@ -0,0 +1,367 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+
+import yaml
+
+from sql_tools import _NOT_AN_ALIAS, _TABLE_REFERENCE_PATTERN, apply_edits, mask_quoted
+
+logger = logging.getLogger(__name__)
+
+ROW_COUNT_COLUMN = "ROLLUP_ROW_COUNT"
+_WORD_PATTERN = re.compile(r"\b\w+\b")
+# Constructs the router does not reason about; such queries always read the fact table
+_UNSUPPORTED_WORDS = {"OVER", "UNION", "INTERSECT", "EXCEPT", "WITH", "QUALIFY", "UNNEST", "ROLLUP", "CUBE", "PIVOT"}
+_SELECT_STAR_PATTERN = re.compile(r"\bSELECT\s+(?:DISTINCT\s+)?\*|\.\s*\*", re.IGNORECASE)
+_AGGREGATE_CALL_PATTERN = re.compile(r"\b(SUM|AVG|COUNT|MIN|MAX)\s*\(", re.IGNORECASE)
+_COLUMN_REFERENCE_PATTERN = re.compile(r"(?<![\w.`])(?:(\w+)\.)?(\w+)\b(?!\s*\()")
+_CAST_WRAPPER_PATTERN = re.compile(r"^\s*(?:SAFE_CAST|CAST)\s*\(\s*(.+?)\s+AS\s+(\w+)\s*\)\s*$", re.IGNORECASE | re.DOTALL)
+_PLAIN_REFERENCE_PATTERN = re.compile(r"^\s*(?:(\w+)\.)?(\w+)\s*$")
+# A sum of FLOAT64 values cast to one of these equals the sum of the individually cast values
+_SUM_SAFE_CASTS = {"FLOAT64", "FLOAT", "NUMERIC", "BIGNUMERIC", "DECIMAL", "REAL", "DOUBLE"}
+
+
+@dataclass
+class RollupDefinition:
+    name: str
+    source_table: str
+    dimensions: list
+    measures: list
+    partition_column: str
+    updated_column: str
+
+    @property
+    def signature(self) -> str:
+        """Changes whenever the table layout or refresh keys change, which forces a full rebuild."""
+        payload = json.dumps([self.source_table, self.dimensions, self.measures, self.partition_column, self.updated_column])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def load_rollup_catalog(path: str, column_types: dict) -> tuple[list[RollupDefinition], dict]:
+    """Reads the rollup catalog YAML; returns (definitions, refresh settings). Raises ValueError on names the schema does not have."""
+    with open(path, "r", encoding="utf-8") as f:
+        catalog = yaml.safe_load(f) or {}
+    definitions, problems = [], []
+    for entry in catalog.get("rollups", []) or []:
+        definition = RollupDefinition(
+            name=str(entry["name"]).upper(),
+            source_table=str(entry["source_table"]).upper(),
+            dimensions=[str(column).upper() for column in entry.get("dimensions", [])],
+            measures=[str(column).upper() for column in entry.get("measures", [])],
+            partition_column=str(entry["partition_column"]).upper(),
+            updated_column=str(entry["updated_column"]).upper(),
+        )
+        source_columns = column_types.get(definition.source_table)
+        if source_columns is None:
+            problems.append(f"{definition.name}: source table {definition.source_table} is not in the schema")
+            continue
+        for column in definition.dimensions + definition.measures + [definition.updated_column]:
+            if column not in source_columns:
+                problems.append(f"{definition.name}: {definition.source_table} has no column {column}")
+        if definition.partition_column not in definition.dimensions:
+            problems.append(f"{definition.name}: partition_column must be one of the dimensions")
+        definitions.append(definition)
+    if problems:
+        raise ValueError("Invalid rollup catalog: " + "; ".join(problems))
+    return definitions, catalog.get("refresh", {}) or {}
+
+
+def register_rollup_ttls(result_cache, definitions: list[RollupDefinition], interval_seconds: float):
+    """Cached results read from a rollup expire by its next refresh, and no later than those read from its fact table."""
+    for definition in definitions:
+        ttl = min(result_cache.table_ttl(definition.source_table), interval_seconds)
+        result_cache.register_table_ttl(definition.name, ttl)
+
+
+class RollupRefresher:
+    """Builds and incrementally refreshes the rollup tables through a QueryBackend.
+
+    Per rollup, the state file records the definition signature, the source's MAX(updated_column) seen at
+    the last refresh (the watermark) and when it was last refreshed. A rollup is `ready` once it has been
+    refreshed with its current definition within `max_staleness_seconds`.
+    """
+
+    def __init__(self, definitions: list[RollupDefinition], backend, column_types: dict, project_id: str,
+                 source_dataset: str, rollup_dataset: str, state_path: str, full_refresh_seconds: float = 86400,
+                 max_staleness_seconds: float = 3600):
+        self.definitions = definitions
+        self.backend = backend
+        self.column_types = column_types
+        self.project_id = project_id
+        self.source_dataset = source_dataset
+        self.rollup_dataset = rollup_dataset
+        self.state_path = state_path
+        self.full_refresh_seconds = full_refresh_seconds
+        self.max_staleness_seconds = max_staleness_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.state = self._load_state()
+        self.last_report = {}
+
+    # --- State ---
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self):
+        with self._lock:
+            state = json.dumps(self.state)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(state)
+        os.replace(tmp_path, self.state_path)
+
+    def ready(self, definition: RollupDefinition) -> bool:
+        with self._lock:
+            entry = self.state.get(definition.name)
+        return (
+            entry is not None
+            and entry.get("signature") == definition.signature
+            and time.time() - entry.get("refreshed_at", 0) <= self.max_staleness_seconds
+        )
+
+    # --- SQL ---
+    def source_reference(self, definition: RollupDefinition) -> str:
+        return f"`{self.project_id}.{self.source_dataset}.{definition.source_table}`"
+
+    def rollup_reference(self, definition: RollupDefinition) -> str:
+        return f"`{self.project_id}.{self.rollup_dataset}.{definition.name}`"
+
+    def _measure_expression(self, definition: RollupDefinition, measure: str) -> str:
+        if self.column_types[definition.source_table][measure] == "STRING":
+            return f"SAFE_CAST({measure} AS FLOAT64)"  # same cast SQLValidator puts into SUM/AVG
+        return measure
+
+    def aggregate_sql(self, definition: RollupDefinition, where: str = "") -> str:
+        dimensions = ", ".join(definition.dimensions)
+        measures = ",\n  ".join(
+            f"SUM({self._measure_expression(definition, m)}) AS {m}, COUNT({self._measure_expression(definition, m)}) AS {m}__COUNT"
+            for m in definition.measures
+        )
+        return (
+            f"SELECT {dimensions},\n  {measures},\n  COUNT(*) AS {ROW_COUNT_COLUMN}\n"
+            f"FROM {self.source_reference(definition)}{where}\nGROUP BY {dimensions}"
+        )
+
+    def full_refresh_statements(self, definition: RollupDefinition) -> list[str]:
+        if self.backend.name == "bigquery":
+            return [f"CREATE OR REPLACE TABLE {self.rollup_reference(definition)} AS\n{self.aggregate_sql(definition)}"]
+        return [f"DROP TABLE IF EXISTS {self.rollup_reference(definition)}",
+                f"CREATE TABLE {self.rollup_reference(definition)} AS\n{self.aggregate_sql(definition)}"]
+
+    def incremental_statements(self, definition: RollupDefinition, watermark: str) -> list[str]:
+        literal = "'" + str(watermark).replace("'", "''") + "'"
+        # Every partition touched since the watermark is re-aggregated from all of its fact rows. Compared as
+        # text with NULL -> '' so the NULL partition is refreshed too; re-aggregating an extra '' partition is harmless.
+        partition_key = f"COALESCE(CAST({definition.partition_column} AS STRING), '')"
+        touched = (
+            f"{partition_key} IN (SELECT DISTINCT {partition_key} "
+            f"FROM {self.source_reference(definition)} WHERE {definition.updated_column} >= {literal})"
+        )
+        columns = definition.dimensions + [c for m in definition.measures for c in (m, f"{m}__COUNT")] + [ROW_COUNT_COLUMN]
+        return [
+            f"DELETE FROM {self.rollup_reference(definition)} WHERE {touched}",
+            f"INSERT INTO {self.rollup_reference(definition)} ({', '.join(columns)})\n{self.aggregate_sql(definition, f' WHERE {touched}')}",
+        ]
+
+    # --- Refresh ---
+    def refresh_one(self, definition: RollupDefinition, force_full: bool = False) -> dict:
+        with self._lock:
+            entry = dict(self.state.get(definition.name) or {})
+        started = time.perf_counter()
+        watermark_df = self.backend.run(
+            f"SELECT CAST(MAX({definition.updated_column}) AS STRING) AS watermark FROM {self.source_reference(definition)}")
+        new_watermark = watermark_df.iloc[0, 0] if len(watermark_df) else None
+        full = (
+            force_full
+            or entry.get("signature") != definition.signature
+            or not entry.get("watermark")
+            or time.time() - entry.get("full_refreshed_at", 0) > self.full_refresh_seconds
+        )
+        if full:
+            statements = self.full_refresh_statements(definition)
+        else:
+            statements = self.incremental_statements(definition, entry["watermark"])
+        bytes_processed = self.backend.execute(statements)
+        now = time.time()
+        entry.update({"signature": definition.signature, "watermark": None if new_watermark is None else str(new_watermark), "refreshed_at": now})
+        if full:
+            entry["full_refreshed_at"] = now
+        with self._lock:
+            self.state[definition.name] = entry
+        self._save_state()
+        return {"mode": "full" if full else "incremental", "seconds": round(time.perf_counter() - started, 2), "bytes_processed": bytes_processed}
+
+    def refresh(self, force_full: bool = False) -> dict:
+        """Refreshes every rollup; returns {rollup: {mode, seconds, bytes_processed} or {error}}."""
+        report = {}
+        with self._refresh_lock:
+            for definition in self.definitions:
+                try:
+                    report[definition.name] = self.refresh_one(definition, force_full)
+                except Exception as e:
+                    # The previous copy keeps being used until it is older than max_staleness_seconds
+                    logger.warning("Rollup %s refresh failed: %s", definition.name, e)
+                    report[definition.name] = {"error": str(e)[:300]}
+        self.last_report = report
+        return report
+
+    def start(self, interval_seconds: float) -> threading.Thread:
+        def _loop():
+            while not self._stop.is_set():
+                self.refresh()
+                self._stop.wait(interval_seconds)
+
+        thread = threading.Thread(target=_loop, name="rollup-refresh", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+
+class RollupRouter:
+    """Rewrites a single-SELECT query on a fact table to read a ready rollup of it, when that gives the same result.
+
+    The rewrite is exact because every fact column the query touches outside an aggregate is a group key
+    of the rollup, so joins, filters and GROUP BY see the same key combinations, only pre-summed:
+    SUM(m) reads the stored sum, AVG(m) becomes SUM(m) / SUM(m__COUNT), COUNT(m) becomes SUM(m__COUNT) and
+    COUNT(*) becomes SUM(ROLLUP_ROW_COUNT). Anything else (measures outside SUM/AVG, SUM/AVG over another table's columns,
+    window functions, subqueries) keeps the query on the fact table.
+    """
+
+    def __init__(self, refresher: RollupRefresher):
+        self.refresher = refresher
+        self.column_types = refresher.column_types
+        self.by_source = {}
+        for definition in refresher.definitions:
+            self.by_source.setdefault(definition.source_table, []).append(definition)
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "rewritten": 0, "fallbacks": 0, "per_rollup": {}}
+
+    @staticmethod
+    def _closing_paren(masked: str, open_index: int) -> int | None:
+        depth = 0
+        for index in range(open_index, len(masked)):
+            if masked[index] == "(":
+                depth += 1
+            elif masked[index] == ")":
+                depth -= 1
+                if depth == 0:
+                    return index
+        return None
+
+    def _try_rollup(self, sql: str, masked: str, definition: RollupDefinition, qualifier: str,
+                    fact_references: list, aggregates: list) -> list | None:
+        """Edits that point the query at `definition`, or None if the rollup cannot answer it."""
+        source_types = self.column_types[definition.source_table]
+        edits, exempt = [], set()
+        for function, start, open_index, close_index in aggregates:
+            inner_masked = masked[open_index + 1:close_index]
+            inner_references = [ref for ref in fact_references if open_index < ref[0] < close_index]
+            if function == "COUNT":
+                if inner_masked.strip() == "*":
+                    edits.append((start, close_index + 1, f"SUM({qualifier}.{ROW_COUNT_COLUMN})"))
+                    continue
+                if inner_masked.strip().upper().startswith("DISTINCT"):
+                    continue  # distinct group keys are the same in the rollup
+                reference = _PLAIN_REFERENCE_PATTERN.match(sql[open_index + 1:close_index])
+                if reference is None or len(inner_references) != 1 or reference.group(2).upper() not in definition.measures:
+                    return None
+                exempt.add(id(inner_references[0]))
+                edits.append((start, close_index + 1, f"SUM({qualifier}.{reference.group(2).upper()}__COUNT)"))
+                continue
+            if function in ("MIN", "MAX"):
+                continue  # only valid over group keys, which the general column check enforces
+            # SUM / AVG: the argument must be one measure of the rolled-up table, optionally cast
+            argument = sql[open_index + 1:close_index]
+            cast = _CAST_WRAPPER_PATTERN.match(argument)
+            reference = _PLAIN_REFERENCE_PATTERN.match(cast.group(1) if cast else argument)
+            if reference is None or len(inner_references) != 1:
+                return None
+            ref_qualifier, column = reference.group(1), reference.group(2).upper()
+            if ref_qualifier is not None and ref_qualifier.upper() != qualifier.upper():
+                return None
+            if column not in definition.measures:
+                return None
+            if cast and cast.group(2).upper() not in _SUM_SAFE_CASTS and source_types[column] != "INT64":
+                return None
+            exempt.update(id(ref) for ref in inner_references)
+            if function == "AVG":
+                edits.append((start, close_index + 1, f"SAFE_DIVIDE(SUM({argument.strip()}), SUM({qualifier}.{column}__COUNT))"))
+        for ref in fact_references:
+            if id(ref) not in exempt and ref[2] not in definition.dimensions:
+                return None
+        return edits
+
+    def rewrite(self, sql: str) -> tuple[str, str | None]:
+        """(sql to run, rollup used or None)."""
+        with self._lock:
+            self.stats["checked"] += 1
+        masked = mask_quoted(sql)
+        words = [word.upper() for word in _WORD_PATTERN.findall(masked)]
+        if words.count("SELECT") != 1 or _UNSUPPORTED_WORDS.intersection(words) or _SELECT_STAR_PATTERN.search(masked):
+            return sql, None
+
+        fact_matches = []
+        for match in _TABLE_REFERENCE_PATTERN.finditer(masked):
+            base_name = sql[match.start(2):match.end(2)].strip("`").split(".")[-1].upper()
+            if base_name in self.by_source:
+                fact_matches.append((match, base_name))
+        if len(fact_matches) != 1:
+            return sql, None  # no fact table with a rollup, or a fact joined to itself / another rolled-up fact
+        match, source_table = fact_matches[0]
+        alias = match.group(3) if match.group(3) and match.group(3).upper() not in _NOT_AN_ALIAS else None
+        qualifier = alias or source_table  # without an alias the rollup is aliased as the fact table
+        qualifiers = {source_table, qualifier.upper()}
+
+        source_columns = self.column_types[source_table]
+        fact_references = []  # (position, qualifier, COLUMN)
+        for ref in _COLUMN_REFERENCE_PATTERN.finditer(masked):
+            if match.start() <= ref.start() < match.end():
+                continue  # the FROM/JOIN reference itself
+            ref_qualifier, column = ref.group(1), ref.group(2).upper()
+            if ref_qualifier is not None and ref_qualifier.upper() in qualifiers or ref_qualifier is None and column in source_columns:
+                fact_references.append((ref.start(), ref_qualifier, column))
+
+        aggregates = []  # (FUNCTION, start, open paren, close paren)
+        for call in _AGGREGATE_CALL_PATTERN.finditer(masked):
+            close_index = self._closing_paren(masked, call.end() - 1)
+            if close_index is None:
+                return sql, None
+            aggregates.append((call.group(1).upper(), call.start(), call.end() - 1, close_index))
+
+        for definition in self.by_source[source_table]:
+            if not self.refresher.ready(definition):
+                continue
+            edits = self._try_rollup(sql, masked, definition, qualifier, fact_references, aggregates)
+            if edits is None:
+                continue
+            table_reference = self.refresher.rollup_reference(definition) + ("" if alias else f" AS {source_table}")
+            edits.append((match.start(2), match.end(2), table_reference))
+            with self._lock:
+                self.stats["rewritten"] += 1
+                self.stats["per_rollup"][definition.name] = self.stats["per_rollup"].get(definition.name, 0) + 1
+            return apply_edits(sql, edits), definition.name
+        return sql, None
+
+    def record_fallback(self):
+        with self._lock:
+            self.stats["fallbacks"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats, per_rollup=dict(self.stats["per_rollup"]))
+        stats["rewrite_pct"] = round(100.0 * stats["rewritten"] / stats["checked"], 1) if stats["checked"] else 0.0
+        stats["ready"] = sum(1 for definition in self.refresher.definitions if self.refresher.ready(definition))
+        stats["rollups"] = len(self.refresher.definitions)
+        return stats
@@ -0,0 +1,282 @@
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+from collections import defaultdict, deque
+
+import yaml
+
+from caches import file_sha256
+
+# --- Token weights for the inverted index ---
+# Table naam ka match sabse strong signal hai, description ka sabse weak.
+TABLE_NAME_BONUS = 6.0
+COLUMN_NAME_WEIGHT = 2.0
+SYNONYM_WEIGHT = 1.5
+DESCRIPTION_WEIGHT = 0.3
+
+# Foreign-key columns (DW_BUYER_KEY on a fact table) would make every fact table match every dimension name
+_FOREIGN_KEY_PATTERN = re.compile(r"^DW_\w+_KEY$", re.IGNORECASE)
+
+# Tokens that appear in almost every table name / column and carry no meaning for ranking
+IGNORED_TOKENS = {
+    "dil", "d", "f", "dw", "key", "id", "the", "a", "an", "of", "for", "in", "on", "to", "and", "or",
+    "by", "is", "are", "what", "which", "who", "how", "show", "me", "list", "give", "get", "tell",
+    "with", "from", "per", "each", "all", "this", "that", "it", "its", "be", "as", "at", "top",
+}
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# libyaml's C loader when PyYAML was built with it (several times faster on the ~480 KB schema)
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# Bump when SchemaIndex's attributes change, so artifacts pickled by an older version are rebuilt
+SCHEMA_ARTIFACT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercases, splits on anything that is not a letter/digit (so COLUMN_NAMES split on '_') and drops plural 's'."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(str(text).lower()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        if token not in IGNORED_TOKENS:
+            tokens.append(token)
+    return tokens
+
+
+def bigquery_type(data_type) -> str:
+    """Maps the YAML `data_type` (which mixes BigQuery and Oracle spellings) to a BigQuery type name."""
+    raw = str(data_type or "").strip().upper()
+    if raw.startswith(("VARCHAR", "CHAR", "STRING", "TEXT", "NVARCHAR")):
+        return "STRING"
+    number = re.match(r"^(?:NUMBER|NUMERIC|DECIMAL)\((\d+)\s*,\s*(\d+)\)$", raw)
+    if number:
+        return "INT64" if number.group(2) == "0" else "FLOAT64"
+    if raw in ("INTEGER", "INT", "INT64", "BIGINT", "SMALLINT"):
+        return "INT64"
+    if raw in ("FLOAT", "FLOAT64", "DOUBLE", "NUMBER", "NUMERIC", "DECIMAL", "BIGNUMERIC"):
+        return "FLOAT64"
+    if raw in ("BOOLEAN", "BOOL"):
+        return "BOOL"
+    if raw in ("DATE", "DATETIME", "TIMESTAMP", "TIME"):
+        return raw
+    return "STRING"
+
+
+class SchemaIndex:
+    """In-memory view of Full_Procurement_Schema.yaml: tables, columns, synonyms, relationships and a keyword index."""
+
+    def __init__(self, schema_yaml: dict):
+        self.tables = {}  # table name -> {"columns": {column: field dict}, "keywords": [...]}
+        self.relationships = []  # [{"left_table", "right_table", "columns": [(left, right)], "join_type"}]
+        self.adjacency = defaultdict(set)  # undirected relationship graph: table -> neighbouring tables
+        self.inverted_index = defaultdict(lambda: defaultdict(float))  # token -> table -> weight
+        self.table_name_tokens = {}  # table -> set of tokens in its own name
+        self.column_types = {}  # table -> {COLUMN: BigQuery type}
+
+        for table in schema_yaml.get("tables", []) or []:
+            table_name = table.get("name")
+            if not table_name:
+                continue
+            all_fields = (table.get("dimensions") or []) + (table.get("facts") or []) + (table.get("time_dimensions") or [])
+            columns = {field["name"]: field for field in all_fields if field.get("name")}
+            synonyms = []
+            for field in all_fields:
+                synonyms.extend(str(s) for s in field.get("synonyms", []) or [])
+            self.tables[table_name] = {
+                "columns": columns,
+                "keywords": sorted(set(list(columns) + synonyms)),
+            }
+            self.column_types[table_name] = {
+                column.upper(): bigquery_type(field.get("data_type")) for column, field in columns.items()
+            }
+            self._index_table(table_name, all_fields)
+
+        for rel in schema_yaml.get("relationships", []) or []:
+            left, right = rel.get("left_table"), rel.get("right_table")
+            if left not in self.tables or right not in self.tables:
+                continue
+            self.relationships.append({
+                "name": str(rel.get("name", "")).strip(),
+                "left_table": left,
+                "right_table": right,
+                "columns": [(c.get("left_column"), c.get("right_column")) for c in rel.get("relationship_columns", []) or []],
+                "join_type": rel.get("join_type", "left_outer"),
+            })
+            self.adjacency[left].add(right)
+            self.adjacency[right].add(left)
+
+        self._apply_idf()
+        self.full_guide = "".join(self.render_table(name) for name in self.tables)
+
+        self._stats_lock = threading.Lock()
+        self.prune_stats = {"questions": 0, "fallbacks": 0, "full_chars": 0, "pruned_chars": 0}
+
+    @classmethod
+    def from_yaml_file(cls, path: str) -> "SchemaIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(yaml.load(f, Loader=_YAML_LOADER))
+
+    @classmethod
+    def load(cls, path: str, artifact_path: str | None = None) -> "SchemaIndex":
+        """Like from_yaml_file, but reuses a compiled index pickled at `artifact_path` while the YAML is unchanged.
+
+        The artifact is keyed on the YAML's mtime and size, and on its SHA-256 when those differ (a fresh
+        checkout touches mtime without changing content). A missing, stale or unreadable artifact is rebuilt.
+        """
+        if artifact_path is None:
+            return cls.from_yaml_file(path)
+        stat = os.stat(path)
+        try:
+            with open(artifact_path, "rb") as f:
+                artifact = pickle.load(f)
+            if artifact["version"] == SCHEMA_ARTIFACT_VERSION:
+                if (artifact["mtime_ns"], artifact["size"]) == (stat.st_mtime_ns, stat.st_size):
+                    return artifact["index"]
+                if artifact["sha256"] == file_sha256(path):
+                    return artifact["index"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("Schema artifact %s is unreadable, rebuilding it: %s", artifact_path, e)
+
+        index = cls.from_yaml_file(path)
+        artifact = {
+            "version": SCHEMA_ARTIFACT_VERSION,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_sha256(path),
+            "index": index,
+        }
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(artifact_path)), exist_ok=True)
+            tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, artifact_path)
+        except OSError as e:
+            logger.warning("Could not write schema artifact %s: %s", artifact_path, e)
+        return index
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        # defaultdict factories are lambdas and locks cannot be pickled; usage stats start over on load
+        state["inverted_index"] = {token: dict(postings) for token, postings in self.inverted_index.items()}
+        state["adjacency"] = dict(self.adjacency)
+        del state["_stats_lock"], state["prune_stats"]
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        inverted_index = defaultdict(lambda: defaultdict(float))
+        for token, postings in state["inverted_index"].items():
+            inverted_index[token].update(postings)
+        self.inverted_index = inverted_index
+        self.adjacency = defaultdict(set, state["adjacency"])
+        self._stats_lock = threading.Lock()
+        self.prune_stats = {"questions": 0, "fallbacks": 0, "full_chars": 0, "pruned_chars": 0}
+
+    # --- Index construction ---
+    def _add_tokens(self, table_name: str, text: str, weight: float):
+        for token in tokenize(text):
+            current = self.inverted_index[token][table_name]
+            self.inverted_index[token][table_name] = max(current, weight)
+
+    def _index_table(self, table_name: str, fields: list):
+        self.table_name_tokens[table_name] = set(tokenize(table_name))
+        for field in fields:
+            if _FOREIGN_KEY_PATTERN.match(field.get("name", "")):
+                continue
+            self._add_tokens(table_name, field.get("name", ""), COLUMN_NAME_WEIGHT)
+            for synonym in field.get("synonyms", []) or []:
+                self._add_tokens(table_name, synonym, SYNONYM_WEIGHT)
+            self._add_tokens(table_name, field.get("description", ""), DESCRIPTION_WEIGHT)
+
+    def _apply_idf(self):
+        # Jo token har table me hai (jaise "date", "flag") uska weight kam ho jata hai.
+        table_count = max(len(self.tables), 1)
+        for token, postings in self.inverted_index.items():
+            idf = math.log(1 + table_count / len(postings))
+            for table_name in postings:
+                postings[table_name] *= idf
+
+    # --- Rendering ---
+    def render_table(self, table_name: str) -> str:
+        keywords = self.tables[table_name]["keywords"]
+        return f"\n- {table_name} (Columns: {', '.join(keywords)})" if keywords else ""
+
+    def render_guide(self, table_names) -> str:
+        return "".join(self.render_table(name) for name in table_names if name in self.tables)
+
+    # --- Question-aware table selection ---
+    def score_tables(self, question: str) -> list[tuple[str, float]]:
+        scores = defaultdict(float)
+        question_tokens = set(tokenize(question))
+        for token in question_tokens:
+            for table_name, weight in self.inverted_index.get(token, {}).items():
+                scores[table_name] += weight
+        for table_name, name_tokens in self.table_name_tokens.items():
+            scores[table_name] += TABLE_NAME_BONUS * len(question_tokens & name_tokens)
+        # An explicitly named table always wins
+        upper_question = question.upper()
+        for table_name in self.tables:
+            if table_name in upper_question:
+                scores[table_name] += 100.0
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def shortest_join_path(self, source: str, target: str) -> list[str]:
+        """BFS over the relationship graph; returns [source, ..., target] or [] if not connected."""
+        if source == target:
+            return [source]
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            current = queue.popleft()
+            for neighbour in sorted(self.adjacency.get(current, ())):
+                if neighbour in previous:
+                    continue
+                previous[neighbour] = current
+                if neighbour == target:
+                    path = [target]
+                    while previous[path[-1]] is not None:
+                        path.append(previous[path[-1]])
+                    return path[::-1]
+                queue.append(neighbour)
+        return []
+
+    def select_tables(self, question: str, top_k: int) -> list[str]:
+        """Top-K scored tables plus any intermediate tables needed to join them to the best match."""
+        ranked = [name for name, score in self.score_tables(question) if score > 0][:top_k]
+        if not ranked:
+            return []
+        selected = list(ranked)
+        anchor = ranked[0]
+        for table_name in ranked[1:]:
+            for hop in self.shortest_join_path(anchor, table_name):
+                if hop not in selected:
+                    selected.append(hop)
+        return selected
+
+    def prune_guide(self, question: str, top_k: int) -> tuple[str, list[str]]:
+        """Returns the schema slice for the question (or the full guide if nothing matched) and the tables used."""
+        selected = self.select_tables(question, top_k)
+        guide = self.render_guide(selected) if selected else self.full_guide
+        with self._stats_lock:
+            self.prune_stats["questions"] += 1
+            self.prune_stats["fallbacks"] += 0 if selected else 1
+            self.prune_stats["full_chars"] += len(self.full_guide)
+            self.prune_stats["pruned_chars"] += len(guide)
+        return guide, selected
+
+    def prompt_reduction(self) -> dict:
+        """Cumulative schema prompt-size reduction (characters and approx. tokens at ~4 chars/token)."""
+        with self._stats_lock:
+            stats = dict(self.prune_stats)
+        full, pruned = stats["full_chars"], stats["pruned_chars"]
+        stats["reduction_pct"] = round(100.0 * (full - pruned) / full, 1) if full else 0.0
+        stats["approx_tokens_saved"] = (full - pruned) // 4
+        return stats
@@ -0,0 +1,114 @@
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+
+@dataclass
+class CandidateOutcome:
+    index: int
+    hint: str
+    generated: object = None  # what generate() returned
+    result: object = None  # what check() returned
+    error: Exception | None = None
+    seconds: float = 0.0
+    ok: bool = False
+    skipped: bool = False  # never sent to the LLM: the race was over before its turn
+
+
+class SpeculativeSQL:
+    """Writes the SQL for a question from several prompt variants at once and keeps the first candidate that checks out.
+
+    `hints[0]` is the unchanged prompt; the others are extra rules appended to it. race() starts the first
+    candidate, and the others either together with it (`hedge_after_seconds` 0), after that many seconds, or
+    (None) only once an earlier candidate has failed its check. Candidates not yet sent to the LLM when one wins
+    are skipped; the ones already in flight finish on their own and are discarded.
+    """
+
+    def __init__(self, hints: list[str], hedge_after_seconds: float | None = 0.0, max_workers: int = 16):
+        self.hints = hints
+        self.hedge_after_seconds = hedge_after_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sql-candidate")
+        self._lock = threading.Lock()
+        self._race_seconds = deque(maxlen=1000)
+        self.stats = {"races": 0, "llm_calls": 0, "skipped": 0, "no_valid": 0, "wins": [0] * len(hints)}
+
+    def _attempt(self, index: int, generate, check, stop: threading.Event, cancel_event: threading.Event | None) -> CandidateOutcome:
+        outcome = CandidateOutcome(index, self.hints[index])
+        if stop.is_set() or (cancel_event is not None and cancel_event.is_set()):
+            outcome.skipped = True
+            with self._lock:
+                self.stats["skipped"] += 1
+            return outcome
+        started = time.perf_counter()
+        with self._lock:
+            self.stats["llm_calls"] += 1
+        try:
+            outcome.generated = generate(self.hints[index])
+            # Once another candidate has won, this one's check (a dry run) would be spent for nothing
+            if not stop.is_set():
+                outcome.result = check(index, outcome.generated)
+                outcome.ok = True
+        except Exception as e:
+            outcome.error = e
+        outcome.seconds = time.perf_counter() - started
+        return outcome
+
+    def race(self, generate, check, cancel_event: threading.Event | None = None) -> tuple[CandidateOutcome | None, list[CandidateOutcome]]:
+        """(winner, outcomes by index). generate(hint) -> candidate; check(index, candidate) -> result, or raises to reject it.
+
+        The calls run on the pool inside a copy of the caller's context, so their spans nest under the caller's span.
+        """
+        stop = threading.Event()
+        started = time.monotonic()
+        futures, outcomes, winner = set(), [], None
+        launched = 0
+
+        def launch(count: int):
+            nonlocal launched
+            for index in range(launched, min(launched + count, len(self.hints))):
+                futures.add(self._executor.submit(contextvars.copy_context().run, self._attempt, index, generate, check, stop, cancel_event))
+            launched = min(launched + count, len(self.hints))
+
+        launch(1)
+        try:
+            while futures:
+                timeout = None
+                if launched < len(self.hints) and self.hedge_after_seconds is not None:
+                    timeout = max(0.0, started + self.hedge_after_seconds - time.monotonic())
+                done, futures = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                failed = False
+                for future in done:
+                    outcome = future.result()
+                    outcomes.append(outcome)
+                    if outcome.ok and winner is None:
+                        winner = outcome
+                    failed = failed or not outcome.ok
+                if winner is not None:
+                    break
+                hedge_due = self.hedge_after_seconds is not None and time.monotonic() >= started + self.hedge_after_seconds
+                if failed or hedge_due:
+                    launch(len(self.hints))
+        finally:
+            stop.set()
+        with self._lock:
+            self.stats["races"] += 1
+            self.stats["skipped"] += len(self.hints) - launched
+            if winner is None:
+                self.stats["no_valid"] += 1
+            else:
+                self.stats["wins"][winner.index] += 1
+            self._race_seconds.append(time.monotonic() - started)
+        return winner, sorted(outcomes, key=lambda outcome: outcome.index)
+
+    def summary(self) -> dict:
+        with self._lock:
+            seconds = sorted(self._race_seconds)
+            summary = dict(self.stats, wins=list(self.stats["wins"]), candidates=len(self.hints))
+        # LLM calls beyond the winning one: the extra cost of racing
+        summary["discarded"] = summary["llm_calls"] - sum(summary["wins"])
+        summary["avg_ms"] = round(1000 * sum(seconds) / len(seconds), 1) if seconds else 0.0
+        summary["p95_ms"] = round(1000 * seconds[min(len(seconds) - 1, int(0.95 * len(seconds)))], 1) if seconds else 0.0
+        return summary
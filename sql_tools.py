@@ -0,0 +1,507 @@
+import re
+import threading
+from dataclasses import dataclass, field
+
+from schema_index import SchemaIndex
+
+NUMERIC_TYPES = {"INT64", "FLOAT64"}
+
+# Words that can follow a table reference but are never its alias
+_NOT_AN_ALIAS = {
+    "ON", "USING", "WHERE", "GROUP", "ORDER", "LIMIT", "LEFT", "RIGHT", "INNER", "OUTER", "FULL", "CROSS",
+    "JOIN", "UNION", "HAVING", "WINDOW", "QUALIFY", "EXCEPT", "INTERSECT", "AS", "FOR", "TABLESAMPLE",
+}
+
+_QUOTED_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+_EXTRACT_FROM_PATTERN = re.compile(r"(\b(?:EXTRACT|TRIM)\s*\([^()]*?)\bFROM\b", re.IGNORECASE)
+# An alias after a table name; never a keyword, so `FROM t JOIN u` leaves the JOIN for the next reference
+_ALIAS_GROUP = r"(?!(?:" + "|".join(sorted(_NOT_AN_ALIAS)) + r")\b)(\w+)"
+_TABLE_REFERENCE_PATTERN = re.compile(r"\b(FROM|JOIN)\s+(`[^`]+`|[\w.-]+)(?:\s+(?:AS\s+)?" + _ALIAS_GROUP + ")?", re.IGNORECASE)
+_CTE_PATTERN = re.compile(r"(?:\bWITH|,)\s*(\w+)\s+AS\s*\(", re.IGNORECASE)
+_QUALIFIED_COLUMN_PATTERN = re.compile(r"(?<![\w.`-])(\w+)\.(\w+)\b(?!\s*\.|\s*\()")
+_AGGREGATE_PATTERN = re.compile(r"\b(SUM|AVG)\s*\(\s*(DISTINCT\s+)?((?:\w+\.)?\w+)\s*\)", re.IGNORECASE)
+_COMPARISON_OPERATORS = r"(?:=|!=|<>|<=|>=|<|>)"
+_COLUMN_VS_LITERAL_PATTERN = re.compile(rf"(?<![\w.])((?:\w+\.)?\w+)(\s*{_COMPARISON_OPERATORS}\s*)('[^']*'|-?\d+(?:\.\d+)?)(?![\w.])")
+_LITERAL_VS_COLUMN_PATTERN = re.compile(rf"(?<![\w.])('[^']*'|-?\d+(?:\.\d+)?)(\s*{_COMPARISON_OPERATORS}\s*)((?:\w+\.)?\w+)(?![\w.(])")
+# Operand: function call / parenthesised expression (two levels of nesting), column ref or number
+_OPERAND = r"(?:(?:\w+(?:\.\w+)?)?\((?:[^()]|\((?:[^()]|\([^()]*\))*\))*\)|(?:\w+\.)?\w+(?:\.\d+)?)"
+_DIVISION_PATTERN = re.compile(rf"({_OPERAND})\s*/\s*({_OPERAND})")
+_NUMERIC_LITERAL = re.compile(r"^-?\d+(?:\.\d+)?$")
+_INTEGER_LITERAL = re.compile(r"^-?\d+$")
+# STRING columns holding codes ('0042', 'Y', '9'), not amounts: equality with a number means the same digits as text
+_CODE_COLUMN_PATTERN = re.compile(
+    r"(?:^|_)(?:ID|IDENTIFIER|SETID|KEY|CODE|CD|NUM|NUMBER|NBR|NO|FLAG|FLG|SEGMENT\d*|STATUS|TYPE|SUBTYPE|REVISION)$",
+    re.IGNORECASE,
+)
+
+
+class SQLValidationError(ValueError):
+    """Raised when generated SQL references tables or columns that do not exist in the schema."""
+
+
+@dataclass
+class ValidationResult:
+    sql: str
+    errors: list = field(default_factory=list)
+    fixes: list = field(default_factory=list)
+
+
+def mask_quoted(sql: str) -> str:
+    """Blanks out the inside of string literals and backtick names so regexes only see SQL structure.
+
+    The masked string has the same length as the input, so match offsets can be applied to the original.
+    """
+    masked = _QUOTED_PATTERN.sub(lambda m: m.group(0)[0] + " " * (len(m.group(0)) - 2) + m.group(0)[-1], sql)
+    # EXTRACT(YEAR FROM col) / TRIM(x FROM col) are not table references
+    return _EXTRACT_FROM_PATTERN.sub(lambda m: m.group(1) + "    ", masked)
+
+
+def apply_edits(sql: str, edits: list[tuple[int, int, str]]) -> str:
+    """Applies non-overlapping (start, end, replacement) edits; later overlapping edits are dropped."""
+    result, cursor = [], 0
+    for start, end, replacement in sorted(edits):
+        if start < cursor:
+            continue
+        result.append(sql[cursor:start])
+        result.append(replacement)
+        cursor = end
+    result.append(sql[cursor:])
+    return "".join(result)
+
+
+class SQLValidator:
+    """Checks generated SQL against the schema YAML before it is sent to BigQuery and inserts the CASTs it needs.
+
+    Hard errors (unknown table, unknown column on a known table) are reported; type problems that
+    BigQuery would reject (STRING in SUM/AVG, numeric column vs. string literal, unguarded division)
+    are fixed in place.
+    """
+
+    def __init__(self, schema_index: SchemaIndex):
+        self.column_types = schema_index.column_types
+        self._lock = threading.Lock()
+        self.stats = {"validated": 0, "fixed": 0, "blocked": 0, "fixed_first_try_ok": 0, "fixed_first_try_failed": 0}
+
+    # --- Scope resolution ---
+    def table_scope(self, sql: str) -> tuple[dict, list]:
+        """Returns ({ALIAS or TABLE: table}, errors) for every FROM/JOIN reference in the query."""
+        masked = mask_quoted(sql)
+        cte_names = {name.upper() for name in _CTE_PATTERN.findall(masked)}
+        scope, errors = {}, []
+        for match in _TABLE_REFERENCE_PATTERN.finditer(masked):
+            raw_name = sql[match.start(2):match.end(2)].strip("`")
+            if sql[match.end(2):].lstrip().startswith("("):
+                continue  # UNNEST(...), table functions
+            base_name = raw_name.split(".")[-1].upper()
+            if "." not in raw_name and base_name in cte_names:
+                continue
+            if base_name not in self.column_types:
+                errors.append(f"Table {base_name} does not exist in the procurement schema.")
+                continue
+            scope[base_name] = base_name
+            alias = match.group(3)
+            if alias and alias.upper() not in _NOT_AN_ALIAS:
+                scope[alias.upper()] = base_name
+        return scope, errors
+
+    def column_type(self, reference: str, scope: dict) -> str | None:
+        if "." in reference:
+            qualifier, column = reference.split(".", 1)
+            table = scope.get(qualifier.upper())
+            return self.column_types[table].get(column.upper()) if table else None
+        types = {
+            self.column_types[table][reference.upper()]
+            for table in set(scope.values()) if reference.upper() in self.column_types[table]
+        }
+        return types.pop() if len(types) == 1 else None
+
+    # --- Checks and fixes ---
+    def _unknown_columns(self, sql: str, scope: dict) -> list:
+        errors = []
+        for match in _QUALIFIED_COLUMN_PATTERN.finditer(mask_quoted(sql)):
+            table = scope.get(match.group(1).upper())
+            if table and match.group(2).upper() not in self.column_types[table]:
+                errors.append(f"Column {match.group(2)} does not exist in table {table}.")
+        return errors
+
+    def _cast_string_aggregates(self, sql: str, scope: dict, fixes: list) -> str:
+        edits = []
+        for match in _AGGREGATE_PATTERN.finditer(mask_quoted(sql)):
+            column = match.group(3)
+            if self.column_type(column, scope) == "STRING":
+                edits.append((match.start(3), match.end(3), f"SAFE_CAST({column} AS FLOAT64)"))
+                fixes.append(f"{match.group(1).upper()}({column}): STRING column cast to FLOAT64")
+        return apply_edits(sql, edits)
+
+    def _fix_literal_comparisons(self, sql: str, scope: dict, fixes: list) -> str:
+        masked = mask_quoted(sql)
+        edits = []
+        for pattern, column_group, literal_group in ((_COLUMN_VS_LITERAL_PATTERN, 1, 3), (_LITERAL_VS_COLUMN_PATTERN, 3, 1)):
+            for match in pattern.finditer(masked):
+                column = match.group(column_group)
+                column_type = self.column_type(column, scope)
+                literal = sql[match.start(literal_group):match.end(literal_group)]
+                if column_type in NUMERIC_TYPES and literal.startswith("'"):
+                    if _NUMERIC_LITERAL.match(literal.strip("'").strip()):
+                        edits.append((match.start(literal_group), match.end(literal_group), f"CAST({literal} AS {column_type})"))
+                    else:
+                        edits.append((match.start(column_group), match.end(column_group), f"CAST({column} AS STRING)"))
+                    fixes.append(f"{column} ({column_type}) compared to string literal {literal}")
+                elif column_type == "STRING" and not literal.startswith("'"):
+                    operator = match.group(2).strip()
+                    if operator in ("=", "!=", "<>") and _INTEGER_LITERAL.match(literal) and _CODE_COLUMN_PATTERN.search(column.split(".")[-1]):
+                        edits.append((match.start(literal_group), match.end(literal_group), f"'{literal}'"))
+                    else:
+                        # As text '999' > '1000' and '0.00' != '0': compare the column as a number instead
+                        edits.append((match.start(column_group), match.end(column_group), f"SAFE_CAST({column} AS FLOAT64)"))
+                    fixes.append(f"{column} (STRING) compared to numeric literal {literal}")
+        return apply_edits(sql, edits)
+
+    def _guard_divisions(self, sql: str, fixes: list) -> str:
+        masked = mask_quoted(sql)
+        edits = []
+        for match in _DIVISION_PATTERN.finditer(masked):
+            numerator, denominator = sql[match.start(1):match.end(1)], sql[match.start(2):match.end(2)]
+            if _NUMERIC_LITERAL.match(denominator) and float(denominator) != 0:
+                continue
+            if denominator.upper().startswith("NULLIF("):
+                continue
+            # Already wrapped in CASE WHEN <denominator> != 0 THEN ... as the prompt asks
+            if re.search(rf"WHEN\s+{re.escape(denominator)}\s*(?:!=|<>|>)\s*0\b", sql, re.IGNORECASE):
+                continue
+            edits.append((match.start(), match.end(), f"SAFE_DIVIDE({numerator}, {denominator})"))
+            fixes.append(f"{numerator} / {denominator} rewritten as SAFE_DIVIDE")
+        return apply_edits(sql, edits)
+
+    def validate(self, sql: str) -> ValidationResult:
+        scope, errors = self.table_scope(sql)
+        errors += self._unknown_columns(sql, scope)
+        fixes = []
+        fixed_sql = self._cast_string_aggregates(sql, scope, fixes)
+        fixed_sql = self._fix_literal_comparisons(fixed_sql, scope, fixes)
+        fixed_sql = self._guard_divisions(fixed_sql, fixes)
+        with self._lock:
+            self.stats["validated"] += 1
+            self.stats["fixed"] += 1 if fixes else 0
+            self.stats["blocked"] += 1 if errors else 0
+        return ValidationResult(sql=fixed_sql, errors=errors, fixes=fixes)
+
+    def record_first_execution(self, result: ValidationResult, succeeded: bool):
+        """Counts fixed queries that ran on the first BigQuery attempt, i.e. retries the validator prevented."""
+        if not result.fixes:
+            return
+        with self._lock:
+            self.stats["fixed_first_try_ok" if succeeded else "fixed_first_try_failed"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+# --- Single-parse alias rewriter ---
+# Short aliases for the most used tables; any other table is aliased by its lowercased name.
+alias_map = {
+    "DIL_SUPPLIERS_D": "sup",
+    "DIL_PURCH_SCHEDULE_LINE_F": "psl",
+    "DIL_PURCH_COST_F": "pc",
+    "DIL_PURCHASE_ORDER_D": "po",
+    "DIL_SUPPLIER_SITE_D": "site",
+    "DIL_ITEMS_D": "itm",
+    "DIL_CURRENCY_D": "cur",
+    "DIL_ORG_D": "org"
+}
+
+reserved_keywords = {
+    "select", "from", "where", "group", "order", "limit",
+    "join", "union", "on", "inner", "outer", "as", "and", "or",
+    "left", "right", "full", "by", "asc", "desc", "count", "sum", "avg", "min", "max"
+}
+
+_FROM_CLAUSE_FUNCTIONS = {"EXTRACT", "TRIM", "SUBSTRING"}  # FROM inside these is not a table reference
+_TABLE_REFERENCE_STOP = {",", "(", ")", ";"}
+# Words that are never table or column names (clause keywords, date parts, type names)
+_SQL_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "OFFSET", "JOIN", "LEFT", "RIGHT",
+    "INNER", "OUTER", "FULL", "CROSS", "ON", "USING", "AS", "AND", "OR", "NOT", "IN", "IS", "NULL", "CASE",
+    "WHEN", "THEN", "ELSE", "END", "UNION", "ALL", "DISTINCT", "WITH", "EXISTS", "BETWEEN", "LIKE", "INTERVAL",
+    "TRUE", "FALSE", "ASC", "DESC", "OVER", "PARTITION", "ROWS", "RANGE", "QUALIFY", "WINDOW", "EXCEPT",
+    "INTERSECT", "NULLS", "FIRST", "LAST", "PRECEDING", "FOLLOWING", "UNBOUNDED", "CURRENT", "ROW", "ESCAPE",
+    "YEAR", "MONTH", "DAY", "WEEK", "QUARTER", "HOUR", "MINUTE", "SECOND", "DAYOFWEEK", "DAYOFYEAR",
+    "ISOWEEK", "ISOYEAR", "DATE", "DATETIME", "TIMESTAMP", "TIME", "INT64", "FLOAT64", "STRING", "NUMERIC",
+    "BIGNUMERIC", "BOOL", "BOOLEAN", "BYTES",
+}
+_SQL_TOKEN_PATTERN = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<quoted>`[^`]*`)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<punct>.)
+""", re.VERBOSE | re.DOTALL)
+# The same tokens with the whitespace and comments before each one attached as its prefix
+_PREFIXED_TOKEN_PATTERN = re.compile(r"""
+    (?P<prefix>(?:\s+|--[^\n]*|/\*.*?\*/)*)
+    (?:
+        (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+      | (?P<quoted>`[^`]*`)
+      | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+      | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<punct>\S)
+    )
+""", re.VERBOSE | re.DOTALL)
+
+
+class SQLToken:
+    __slots__ = ("kind", "value", "upper", "prefix")
+
+    def __init__(self, kind: str, value: str, prefix: str = ""):
+        self.kind = kind
+        self.value = value
+        self.upper = value.upper()
+        self.prefix = prefix  # whitespace / comments before the token (tokenize_sql_prefixed only)
+
+    @property
+    def is_keyword(self) -> bool:
+        return self.kind == "word" and self.upper in _SQL_KEYWORDS
+
+    @property
+    def is_name(self) -> bool:
+        return self.kind == "quoted" or (self.kind == "word" and self.upper not in _SQL_KEYWORDS)
+
+    @property
+    def is_blank(self) -> bool:
+        return self.kind in ("ws", "comment")
+
+
+def tokenize_sql(sql: str) -> list[SQLToken]:
+    """Single-regex SQL lexer; far cheaper than sqlparse when only a flat token stream is needed."""
+    return [SQLToken(match.lastgroup, match.group()) for match in _SQL_TOKEN_PATTERN.finditer(sql)]
+
+
+def tokenize_sql_prefixed(sql: str) -> tuple[list[SQLToken], str]:
+    """(tokens, trailing blanks) with no blank tokens: each token carries the blanks before it as `prefix`.
+
+    Neighbouring tokens are then adjacent indexes, so a token walk needs no scan past whitespace.
+    """
+    tokens, end = [], 0
+    for match in _PREFIXED_TOKEN_PATTERN.finditer(sql):
+        kind = match.lastgroup
+        tokens.append(SQLToken(kind, match.group(kind), match.group("prefix")))
+        end = match.end()
+    return tokens, sql[end:]
+
+
+class SQLAliasRewriter:
+    """Tokenizes the SQL once and rewrites it from the token stream.
+
+    Every schema table in FROM/JOIN becomes `PROJECT.DATASET.TABLE` with its alias_map alias (LLM aliases
+    are dropped). Qualified columns (`s.COL`, `DIL_X.COL`) are re-pointed to the new alias and bare
+    columns are qualified with the table in their own query scope that owns them in the schema YAML.
+    Names that are not schema columns (SELECT aliases, CTE columns, functions) are left untouched.
+    """
+
+    def __init__(self, schema_index: SchemaIndex | None, alias_map: dict, project_id: str, dataset_id: str, reserved_aliases: set):
+        self.column_types = schema_index.column_types if schema_index is not None else {}
+        self.alias_map = alias_map
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self.reserved_aliases = {word.lower() for word in reserved_aliases}
+
+    def _find_table_references(self, tokens: list):
+        """Assigns every token a query scope and returns (scope_of, in_call, scope_parent, table references).
+
+        `tokens` come from tokenize_sql_prefixed, so the next / previous token is always index + 1 / - 1.
+        `in_call[i]` is True when token i sits inside function-call or expression parentheses of its scope.
+        """
+        last = len(tokens) - 1
+        scope_of = [0] * len(tokens)
+        in_call = [False] * len(tokens)
+        scope_parent = {0: None}
+        scope_stack, frames = [0], []
+        references = []  # dicts: start, end (exclusive, includes any old alias), scope, raw_name, old_alias
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            scope_of[index] = scope_stack[-1]
+            in_call[index] = bool(frames) and frames[-1][0] == "paren"
+            if token.value == "(":
+                if index < last and tokens[index + 1].upper in ("SELECT", "WITH"):
+                    new_scope = len(scope_parent)
+                    scope_parent[new_scope] = scope_stack[-1]
+                    scope_stack.append(new_scope)
+                    frames.append(("scope", None))
+                else:
+                    frames.append(("paren", tokens[index - 1].upper if index > 0 else None))
+            elif token.value == ")":
+                if frames and frames.pop()[0] == "scope":
+                    scope_stack.pop()
+            elif token.kind == "word" and token.upper in ("FROM", "JOIN"):
+                if frames and frames[-1][0] == "paren" and frames[-1][1] in _FROM_CLAUSE_FUNCTIONS:
+                    index += 1
+                    continue
+                start = index + 1
+                while start <= last and tokens[start].value != "(":
+                    end = start
+                    # A name is the tokens up to the first blank: `p.d.T`, p-d.d.T
+                    while end <= last and (end == start or not tokens[end].prefix) and tokens[end].value not in _TABLE_REFERENCE_STOP:
+                        end += 1
+                    if end == start:
+                        break
+                    raw_name = "".join(t.value for t in tokens[start:end])
+                    old_alias, reference_end = None, end
+                    candidate = end
+                    if candidate <= last and tokens[candidate].upper == "AS":
+                        candidate += 1
+                    if candidate <= last and tokens[candidate].is_name:
+                        old_alias, reference_end = tokens[candidate].value, candidate + 1
+                    references.append({"start": start, "end": reference_end, "scope": scope_stack[-1], "raw_name": raw_name, "old_alias": old_alias})
+                    for j in range(start, reference_end):
+                        scope_of[j] = scope_stack[-1]
+                    index = reference_end - 1
+                    # Comma joins: FROM a, b
+                    comma = index + 1
+                    if token.upper == "FROM" and comma <= last and tokens[comma].value == ",":
+                        scope_of[comma] = scope_stack[-1]
+                        start = comma + 1
+                        continue
+                    break
+            index += 1
+        return scope_of, in_call, scope_parent, references
+
+    # --- Rewrite ---
+    def rewrite(self, sql: str) -> str:
+        tokens, trailing = tokenize_sql_prefixed(sql)
+        scope_of, in_call, scope_parent, references = self._find_table_references(tokens)
+
+        qualifiers = {scope: {} for scope in scope_parent}  # scope -> {OLD ALIAS / TABLE NAME: new alias}
+        scope_tables = {scope: [] for scope in scope_parent}  # scope -> [(TABLE, alias)] in FROM order
+        replacements = {}  # start token index -> (end token index, replacement text)
+        used_aliases = {}
+        for reference in references:
+            raw_name = reference["raw_name"].strip("`")
+            base_name = raw_name.split(".")[-1]
+            if base_name.upper() not in self.column_types and base_name not in self.alias_map and "." not in raw_name:
+                continue  # CTE or unknown bare name: leave it exactly as written
+            alias = self.alias_map.get(base_name, base_name.lower())
+            if alias.lower() in self.reserved_aliases:
+                alias += "_t"
+            used_aliases[alias] = used_aliases.get(alias, 0) + 1
+            if used_aliases[alias] > 1:  # self-join
+                alias = f"{alias}_{used_aliases[alias]}"
+            scope = reference["scope"]
+            qualifiers[scope][base_name.upper()] = alias
+            if reference["old_alias"]:
+                qualifiers[scope][reference["old_alias"].strip("`").upper()] = alias
+            scope_tables[scope].append((base_name.upper(), alias))
+            replacements[reference["start"]] = (reference["end"], f"{tokens[reference['start']].prefix}`{self.project_id}.{self.dataset_id}.{base_name}` {alias}")
+
+        output_aliases = set()
+        for index, token in enumerate(tokens[:-1]):
+            if token.upper == "AS" and token.kind == "word":
+                nxt = index + 1
+                if tokens[nxt].is_name and nxt not in replacements:
+                    output_aliases.add(tokens[nxt].value.strip("`").upper())
+
+        def lookup_qualifier(name: str, scope):
+            while scope is not None:
+                if name in qualifiers[scope]:
+                    return qualifiers[scope][name]
+                scope = scope_parent[scope]
+            return None
+
+        def owning_alias(column: str, scope):
+            while scope is not None:
+                for table, alias in scope_tables[scope]:
+                    if column in self.column_types.get(table, {}):
+                        return alias
+                scope = scope_parent[scope]
+            return None
+
+        output, index, count = [], 0, len(tokens)
+        while index < count:
+            if index in replacements:
+                end, text = replacements[index]
+                output.append(text)
+                index = end
+                continue
+            token = tokens[index]
+            if not token.is_name or (index > 0 and tokens[index - 1].value == "." and not token.prefix):
+                output.append(token.prefix + token.value)
+                index += 1
+                continue
+
+            chain = [index]
+            while (chain[-1] + 2 < count and tokens[chain[-1] + 1].value == "." and not tokens[chain[-1] + 1].prefix
+                   and tokens[chain[-1] + 2].is_name and not tokens[chain[-1] + 2].prefix):
+                chain.append(chain[-1] + 2)
+            original = "".join(t.value for t in tokens[chain[0]:chain[-1] + 1])
+            is_function = chain[-1] + 1 < count and tokens[chain[-1] + 1].value == "("
+            defines_alias = index > 0 and tokens[index - 1].upper == "AS"
+            scope = scope_of[index]
+
+            rewritten = original
+            if not is_function and not defines_alias:
+                if len(chain) >= 2:
+                    alias = lookup_qualifier(tokens[chain[-2]].value.strip("`").upper(), scope)
+                    if alias:
+                        rewritten = f"{alias}.{tokens[chain[-1]].value}"
+                else:
+                    column = token.value.strip("`").upper()
+                    # A SELECT alias can shadow a column name in GROUP BY / ORDER BY, but not inside SUM(...) etc.
+                    if column not in output_aliases or in_call[index]:
+                        alias = owning_alias(column, scope)
+                        if alias:
+                            rewritten = f"{alias}.{token.value}"
+            output.append(token.prefix + rewritten)
+            index = chain[-1] + 1
+        output.append(trailing)
+        return "".join(output)
+
+
+# --- Row caps and chart aggregation pushdown ---
+def cap_rows(sql: str, row_limit: int) -> str:
+    """Makes the query return at most `row_limit` rows: lowers a larger top-level LIMIT or appends one."""
+    tokens = tokenize_sql(sql)
+    depth = 0
+    for index, token in enumerate(tokens):
+        if token.value == "(":
+            depth += 1
+        elif token.value == ")":
+            depth -= 1
+        elif depth == 0 and token.kind == "word" and token.upper == "LIMIT":
+            j = index + 1
+            while j < len(tokens) and tokens[j].is_blank:
+                j += 1
+            if j < len(tokens) and tokens[j].kind == "number":
+                if int(float(tokens[j].value)) <= row_limit:
+                    return sql
+                tokens[j] = SQLToken("number", str(row_limit))
+                return "".join(t.value for t in tokens)
+    return sql.strip().rstrip(";").rstrip() + f"\nLIMIT {row_limit}"
+
+
+def chart_aggregate_sql(sql: str, x_col: str, y_col: str | None, chart_type: str, top_n: int) -> str | None:
+    """Wraps the query so BigQuery returns only what the chart draws, or None if the chart needs raw rows.
+
+    bar/pie: SUM(y) per x, top `top_n` by value plus one 'Others' row. countplot: the same with COUNT(*)
+    into a `Count` column. line: AVG(y) per x (seaborn's lineplot estimator), ordered by x.
+    """
+    base = sql.strip().rstrip(";")
+    x, y = f"`{x_col}`", f"`{y_col}`" if y_col else None
+    if chart_type == "line" and y:
+        return f"SELECT {x}, AVG({y}) AS {y} FROM ({base}) AS chart_base GROUP BY {x} ORDER BY {x}"
+    if chart_type in ("bar", "pie") and y:
+        value, value_name = f"SUM({y})", y
+    elif chart_type == "countplot":
+        value, value_name = "COUNT(*)", "`Count`"
+    else:
+        return None
+    return (
+        f"WITH chart_base AS ({base}),\n"
+        f"chart_grouped AS (SELECT {x} AS chart_x, {value} AS chart_value FROM chart_base GROUP BY {x}),\n"
+        f"chart_ranked AS (SELECT chart_x, chart_value, ROW_NUMBER() OVER (ORDER BY chart_value DESC) AS chart_rank FROM chart_grouped)\n"
+        f"SELECT CASE WHEN chart_rank <= {top_n} THEN CAST(chart_x AS STRING) ELSE 'Others' END AS {x}, "
+        f"SUM(chart_value) AS {value_name}\n"
+        f"FROM chart_ranked GROUP BY 1 ORDER BY MIN(chart_rank)"
+    )
@@ -0,0 +1,295 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# The question being traced and its innermost open span, per thread / context
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    parent: str | None = None
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:8])
+    start_offset: float = 0.0  # seconds after the trace started
+    seconds: float = 0.0
+    attributes: dict = field(default_factory=dict)
+    error: str | None = None
+
+    def set(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent": self.parent,
+            "start_ms": round(1000 * self.start_offset, 2),
+            "duration_ms": round(1000 * self.seconds, 2),
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class Trace:
+    """All spans of one question. Spans can be opened from several threads (the answer paths run in parallel)."""
+
+    def __init__(self, question: str):
+        self.trace_id = uuid.uuid4().hex
+        self.question = question
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.seconds = 0.0
+        self.spans = []
+        self.attributes = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get() if _current_trace.get() is self else None
+        span = Span(name, parent=parent.span_id if parent is not None else None)
+        span.set(**attributes)
+        span.start_offset = time.perf_counter() - self._started
+        trace_token, span_token = _current_trace.set(self), _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            span.seconds = time.perf_counter() - self._started - span.start_offset
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            with self._lock:
+                self.spans.append(span)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self._started
+
+    def snapshot(self) -> list[Span]:
+        """Spans closed so far, in start order (a timed-out path may still be adding to the list)."""
+        with self._lock:
+            return sorted(self.spans, key=lambda span: span.start_offset)
+
+    def as_dict(self) -> dict:
+        spans = self.snapshot()
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "question": self.question,
+            "duration_ms": round(1000 * self.seconds, 2),
+            **self.attributes,
+            "spans": [span.as_dict() for span in spans],
+        }
+
+
+class _NullSpan:
+    """Stand-in when nothing is being traced, so instrumented code never has to check."""
+
+    def set(self, **attributes):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Opens a child of the current span (no-op outside a traced question, e.g. the Dynamic Visualization reruns)."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NULL_SPAN
+        return
+    with trace.span(name, **attributes) as new_span:
+        yield new_span
+
+
+def annotate(**attributes):
+    """Adds attributes to the innermost open span, e.g. bytes processed reported deep inside a backend."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def current_trace_id() -> str | None:
+    trace = _current_trace.get()
+    return trace.trace_id if trace is not None else None
+
+
+def token_usage(message) -> dict:
+    """prompt/completion token counts from a LangChain message's usage_metadata (empty if the model sent none)."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {"prompt_tokens": usage.get("input_tokens"), "completion_tokens": usage.get("output_tokens")}
+
+
+# --- Sinks: JSONL log and in-process metrics ---
+class TraceLog:
+    """Appends every finished trace as one JSON line; the file is rotated to `<path>.1` past `max_bytes`."""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, trace: Trace):
+        line = json.dumps(trace.as_dict(), default=str) + "\n"
+        with self._lock:
+            try:
+                if os.path.getsize(self.path) + len(line) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+            except FileNotFoundError:
+                pass
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+# Numeric span attributes that are summed into Prometheus counters
+_COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "bytes_processed", "rows")
+
+
+class TraceMetrics:
+    """Per-stage latency over a rolling window of recent spans plus running totals, for the sidebar and /metrics."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.window = window
+        self.durations = defaultdict(lambda: deque(maxlen=window))  # span name -> recent seconds
+        self.totals = defaultdict(lambda: defaultdict(float))  # span name -> {count, seconds, errors, cache_hits, ...}
+        self.questions = 0
+        self.question_seconds = 0.0
+        self.question_durations = deque(maxlen=window)
+        self.startup = {}  # milestone -> seconds after the process' first script run
+        self.collectors = []  # () -> Prometheus text of other components (upstream limiters), appended to /metrics
+
+    def add_collector(self, collector):
+        with self._lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def record_startup(self, milestone: str, seconds: float) -> bool:
+        """Keeps the first value per milestone, so only the cold start is reported; True if this was the first."""
+        with self._lock:
+            if milestone in self.startup:
+                return False
+            self.startup[milestone] = seconds
+            return True
+
+    def startup_summary(self) -> dict:
+        with self._lock:
+            return {milestone: round(seconds, 2) for milestone, seconds in self.startup.items()}
+
+    def observe(self, trace: Trace):
+        spans = trace.snapshot()
+        with self._lock:
+            self.questions += 1
+            self.question_seconds += trace.seconds
+            self.question_durations.append(trace.seconds)
+            for item in spans:
+                totals = self.totals[item.name]
+                self.durations[item.name].append(item.seconds)
+                totals["count"] += 1
+                totals["seconds"] += item.seconds
+                totals["errors"] += int(item.error is not None)
+                totals["cache_hits"] += int(bool(item.attributes.get("cache_hit")))
+                for key in _COUNTED_ATTRIBUTES:
+                    value = item.attributes.get(key)
+                    if isinstance(value, (int, float)):
+                        totals[key] += value
+
+    @staticmethod
+    def _quantile(values, q: float) -> float:
+        ordered = sorted(values)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    def summary(self) -> dict:
+        """{stage: {count, p50_ms, p95_ms, errors}} over the rolling window, slowest p95 first."""
+        with self._lock:
+            stages = {
+                name: {
+                    "count": int(self.totals[name]["count"]),
+                    "p50_ms": round(1000 * self._quantile(values, 0.5), 1),
+                    "p95_ms": round(1000 * self._quantile(values, 0.95), 1),
+                    "errors": int(self.totals[name]["errors"]),
+                }
+                for name, values in self.durations.items()
+            }
+        return dict(sorted(stages.items(), key=lambda item: -item[1]["p95_ms"]))
+
+    def prometheus_text(self) -> str:
+        """Quantiles come from the rolling window; _sum/_count and the counters are cumulative since start."""
+        lines = [
+            "# HELP chatbot_question_seconds End-to-end answer latency.",
+            "# TYPE chatbot_question_seconds summary",
+        ]
+        with self._lock:
+            questions, question_seconds = self.questions, self.question_seconds
+            question_durations = list(self.question_durations)
+            stage_durations = {name: list(values) for name, values in self.durations.items()}
+            totals = {name: dict(values) for name, values in self.totals.items()}
+            startup = dict(self.startup)
+            collectors = list(self.collectors)
+        for q in (0.5, 0.95):
+            lines.append(f'chatbot_question_seconds{{quantile="{q}"}} {self._quantile(question_durations, q):.6f}')
+        lines.append(f"chatbot_question_seconds_sum {question_seconds:.6f}")
+        lines.append(f"chatbot_question_seconds_count {questions}")
+
+        lines += ["# HELP chatbot_stage_seconds Latency per stage.", "# TYPE chatbot_stage_seconds summary"]
+        for name, values in sorted(stage_durations.items()):
+            for q in (0.5, 0.95):
+                lines.append(f'chatbot_stage_seconds{{stage="{name}",quantile="{q}"}} {self._quantile(values, q):.6f}')
+            lines.append(f'chatbot_stage_seconds_sum{{stage="{name}"}} {totals[name]["seconds"]:.6f}')
+            lines.append(f'chatbot_stage_seconds_count{{stage="{name}"}} {totals[name]["count"]:g}')
+
+        for metric, key, help_text in (
+            ("chatbot_stage_errors_total", "errors", "Spans that raised, per stage."),
+            ("chatbot_stage_cache_hits_total", "cache_hits", "Spans served from a cache, per stage."),
+            ("chatbot_prompt_tokens_total", "prompt_tokens", "Prompt tokens sent to the LLM, per stage."),
+            ("chatbot_completion_tokens_total", "completion_tokens", "Completion tokens received, per stage."),
+            ("chatbot_bigquery_bytes_processed_total", "bytes_processed", "BigQuery bytes processed, per stage."),
+            ("chatbot_result_rows_total", "rows", "Result rows returned, per stage."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for name, values in sorted(totals.items()):
+                if values.get(key):
+                    lines.append(f'{metric}{{stage="{name}"}} {values[key]:g}')
+
+        if startup:
+            lines += ["# HELP chatbot_startup_seconds Seconds from the first script run to each cold-start milestone.",
+                      "# TYPE chatbot_startup_seconds gauge"]
+            for milestone, seconds in sorted(startup.items()):
+                lines.append(f'chatbot_startup_seconds{{milestone="{milestone}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n" + "".join(collector() for collector in collectors)
+
+
+def start_metrics_server(metrics: TraceMetrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serves `metrics.prometheus_text()` at /metrics from a daemon thread."""
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes every few seconds would flood the Streamlit log
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
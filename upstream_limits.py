@@ -0,0 +1,238 @@
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # only LimitedEmbeddings needs LangChain; the benches use the limiter without it
+    Embeddings = object
+
+import tracing
+
+_BACKGROUND = "background"  # fairness key for calls made outside an answered question (ingestion, rollup refresh)
+# HTTP statuses worth retrying: quota / rate limit, and the transient server-side ones
+_RETRYABLE_CODES = {429, 500, 502, 503, 504}
+# The same, for errors that carry no .code (wrapped by LangChain, or BigQuery's 403 rateLimitExceeded)
+_THROTTLE_MARKERS = ("429", "resource exhausted", "resource_exhausted", "ratelimitexceeded", "quota exceeded", "too many requests")
+_TRANSIENT_MARKERS = ("503", "service unavailable", "deadline exceeded")
+
+
+class UpstreamBusy(RuntimeError):
+    """A call waited longer than the limiter's max_wait_seconds for a slot and was refused."""
+
+
+def is_throttled(error: Exception) -> bool:
+    """True for quota / rate-limit errors (google.api_core ResourceExhausted / TooManyRequests, BigQuery rateLimitExceeded)."""
+    text = f"{type(error).__name__} {error}".lower()
+    return getattr(error, "code", None) == 429 or any(marker in text for marker in _THROTTLE_MARKERS)
+
+
+def is_retryable(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in _RETRYABLE_CODES:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in _THROTTLE_MARKERS + _TRANSIENT_MARKERS)
+
+
+class UpstreamLimiter:
+    """Process-wide admission control for one upstream (Vertex AI chat, Vertex AI embeddings, BigQuery).
+
+    A call needs a token from a bucket refilled at `rate_per_second` (up to `burst`) and one of `max_concurrency`
+    slots. Waiting calls are queued per answered question and served round-robin, so one question firing many
+    calls cannot starve the others. Throttling errors halve the bucket rate (down to a tenth of the configured
+    one); every success adds back 5% of it. Retryable errors are retried with full-jitter exponential backoff.
+    A call that cannot get a slot within `max_wait_seconds` is refused with UpstreamBusy.
+    """
+
+    def __init__(self, name: str, rate_per_second: float, burst: int, max_concurrency: int, max_wait_seconds: float = 30.0,
+                 max_retries: int = 4, base_backoff_seconds: float = 0.5, max_backoff_seconds: float = 8.0):
+        self.name = name
+        self.configured_rate = rate_per_second
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_wait_seconds = max_wait_seconds
+        self.max_retries = max_retries
+        self.base_backoff_seconds = base_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._in_use = 0
+        self._waiting = OrderedDict()  # fairness key -> deque of tickets, served round-robin
+        self._condition = threading.Condition()
+        self._waits = deque(maxlen=1000)
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "rejected": 0, "failed": 0, "wait_seconds": 0.0}
+
+    # --- Admission ---
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _head(self):
+        for tickets in self._waiting.values():
+            if tickets:
+                return tickets[0]
+        return None
+
+    def _dequeue(self, key, ticket):
+        tickets = self._waiting[key]
+        tickets.remove(ticket)
+        if tickets:
+            self._waiting.move_to_end(key)  # its next call queues behind the other questions' calls
+        else:
+            del self._waiting[key]
+
+    def acquire(self, key=None) -> float:
+        """Waits for a token and a slot; returns the seconds waited."""
+        key = key or tracing.current_trace_id() or _BACKGROUND
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + self.max_wait_seconds
+        with self._condition:
+            self._waiting.setdefault(key, deque()).append(ticket)
+            while True:
+                now = time.monotonic()
+                timeout = deadline - now
+                if self._head() is ticket and self._in_use < self.max_concurrency:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        self._in_use += 1
+                        self._dequeue(key, ticket)
+                        waited = now - started
+                        self._waits.append(waited)
+                        self.stats["calls"] += 1
+                        self.stats["wait_seconds"] += waited
+                        self._condition.notify_all()  # the next ticket may be admissible too
+                        return waited
+                    timeout = min(timeout, (1 - self._tokens) / self.rate)
+                if deadline - now <= 0:
+                    self._dequeue(key, ticket)
+                    self.stats["rejected"] += 1
+                    self._condition.notify_all()
+                    raise UpstreamBusy(f"{self.name} is at capacity: no slot within {self.max_wait_seconds:.0f}s")
+                self._condition.wait(timeout)
+
+    def release(self, error: Exception | None = None):
+        with self._condition:
+            self._in_use -= 1
+            if error is not None and is_throttled(error):
+                self.stats["throttled"] += 1
+                self.rate = max(self.configured_rate / 10, self.rate / 2)
+            elif error is None:
+                self.rate = min(self.configured_rate, self.rate + self.configured_rate / 20)
+            self._condition.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception):
+        delay = random.uniform(0, min(self.max_backoff_seconds, self.base_backoff_seconds * 2 ** attempt))
+        logging.getLogger(__name__).info("%s call failed (%s), retry %d in %.2fs", self.name, error, attempt + 1, delay)
+        with self._condition:
+            self.stats["retries"] += 1
+        time.sleep(delay)
+
+    # --- Calls ---
+    def call(self, fn, *args, **kwargs):
+        """fn(*args, **kwargs) under the limits, retried on retryable errors."""
+        attempt = 0
+        while True:
+            waited = self.acquire()
+            tracing.annotate(upstream_wait_ms=round(1000 * waited, 1))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.release(e)
+                if attempt >= self.max_retries or not is_retryable(e):
+                    with self._condition:
+                        self.stats["failed"] += 1
+                    raise
+                self._backoff(attempt, e)
+                attempt += 1
+            else:
+                self.release()
+                return result
+
+    def stream(self, fn, *args, **kwargs):
+        """Yields from fn(*args, **kwargs) holding one slot; retried only if it fails before the first item."""
+        attempt = 0
+        while True:
+            tracing.annotate(upstream_wait_ms=round(1000 * self.acquire(), 1))
+            started = False
+            try:
+                for item in fn(*args, **kwargs):
+                    started = True
+                    yield item
+            except Exception as e:
+                self.release(e)
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    with self._condition:
+                        self.stats["failed"] += 1
+                    raise
+                self._backoff(attempt, e)
+                attempt += 1
+            except BaseException:  # GeneratorExit: the consumer stopped (cancelled path)
+                self.release()
+                raise
+            else:
+                self.release()
+                return
+
+    # --- Metrics ---
+    def summary(self) -> dict:
+        with self._condition:
+            waits = sorted(self._waits)
+            summary = dict(self.stats, in_use=self._in_use, waiting=sum(len(t) for t in self._waiting.values()),
+                           rate=round(self.rate, 2), configured_rate=self.configured_rate)
+        summary["avg_wait_ms"] = round(1000 * summary.pop("wait_seconds") / summary["calls"], 1) if summary["calls"] else 0.0
+        summary["p95_wait_ms"] = round(1000 * waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else 0.0
+        return summary
+
+    def prometheus_text(self) -> str:
+        s = self.summary()
+        upstream = f'upstream="{self.name}"'
+        lines = []
+        for metric, kind, value, help_text in (
+            ("chatbot_upstream_calls_total", "counter", s["calls"], "Calls admitted by the upstream limiter."),
+            ("chatbot_upstream_throttled_total", "counter", s["throttled"], "Calls the upstream answered with a quota error."),
+            ("chatbot_upstream_retries_total", "counter", s["retries"], "Retries after a retryable error."),
+            ("chatbot_upstream_rejected_total", "counter", s["rejected"], "Calls refused after waiting max_wait_seconds."),
+            ("chatbot_upstream_wait_seconds_p95", "gauge", s["p95_wait_ms"] / 1000, "p95 queueing delay before a call was admitted."),
+            ("chatbot_upstream_waiting", "gauge", s["waiting"], "Calls currently waiting for a slot."),
+            ("chatbot_upstream_rate", "gauge", s["rate"], "Current token bucket rate (calls per second)."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", f"{metric}{{{upstream}}} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+
+class LimitedChatModel:
+    """A chat model whose invoke/stream go through an UpstreamLimiter; everything else is the wrapped model's."""
+
+    def __init__(self, model, limiter: UpstreamLimiter):
+        self.model = model
+        self.limiter = limiter
+
+    def invoke(self, *args, **kwargs):
+        return self.limiter.call(self.model.invoke, *args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        return self.limiter.stream(self.model.stream, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+class LimitedEmbeddings(Embeddings):
+    """Embeddings whose calls go through an UpstreamLimiter (CachedEmbeddings sits in front, so only misses get here)."""
+
+    def __init__(self, embeddings: Embeddings, limiter: UpstreamLimiter):
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.model_name = getattr(embeddings, "model_name", None)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.limiter.call(self.embeddings.embed_documents, texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.limiter.call(self.embeddings.embed_query, text)